@@ -1,18 +1,28 @@
-import os, datetime
+import os, datetime, time, threading
+from collections import OrderedDict
 from typing import Optional, Dict, Any
 from jose import jwt, JWTError
-from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from db_mysql import get_conn
+from mysql.connector import errorcode, IntegrityError
+from db_mysql import get_conn, run_db
+from db_schema import email_unico
+from senha_pool import pwd_context, hash_password_async, verify_password_async
 
 SECRET_KEY = os.getenv("SECRET_KEY", "devsecret-change")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "60"))
+# cache do usuário autenticado (por "sub" do JWT): evita um SELECT por requisição protegida
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "60"))
+USER_CACHE_MAX = int(os.getenv("USER_CACHE_MAX", "1000"))
+# JWT_CLAIMS_USUARIO=1: o token leva id/nome/ativo e a maioria das requisições nem consulta o cache
+JWT_CLAIMS_USUARIO = os.getenv("JWT_CLAIMS_USUARIO", "0") == "1"
+# e-mails (separados por vírgula) que podem ativar/desativar usuários
+AUTH_ADMINS = {e.strip().lower() for e in os.getenv("AUTH_ADMINS", "").split(",") if e.strip()}
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
 
+# versões síncronas (scripts/CLI); os endpoints usam as *_async do senha_pool
 def hash_password(password: str) -> str:
     return pwd_context.hash(password)
 
@@ -22,9 +32,93 @@ def verify_password(password: str, password_hash: str) -> bool:
 def create_access_token(data: dict, expires_minutes: int = ACCESS_TOKEN_EXPIRE_MINUTES) -> str:
     to_encode = data.copy()
     expire = datetime.datetime.utcnow() + datetime.timedelta(minutes=expires_minutes)
-    to_encode.update({"exp": expire})
+    to_encode.update({"exp": expire, "iat": int(time.time())})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
+def claims_usuario(user: Dict[str, Any]) -> Dict[str, Any]:
+    claims = {"sub": user["email"]}
+    if JWT_CLAIMS_USUARIO:
+        claims.update({"uid": user.get("id"), "name": user.get("name"), "act": bool(user.get("is_active", True))})
+    return claims
+
+# ===== Cache de usuários autenticados =====
+# Só os campos que os handlers usam (nada de password_hash em memória).
+USER_FIELDS = "id, name, email, is_active, tokens_revogados_em"
+_user_cache: "OrderedDict[str, tuple[float, Dict[str, Any]]]" = OrderedDict()
+_user_lock = threading.Lock()
+# e-mail -> segundo (int, como o iat) da última desativação/troca de senha: tokens
+# emitidos antes disso são recusados, com ou sem claims. A fonte é users.tokens_revogados_em;
+# este mapa é a cópia local, relida do banco a cada USER_CACHE_TTL (outros workers, restart).
+_revogados: Dict[str, int] = {}
+_revogados_prox_sync = 0.0
+_user_stats = {"hits": 0, "misses": 0, "claims": 0, "invalidacoes": 0, "revogados": 0}
+
+def _user_cache_get(email: str) -> Optional[Dict[str, Any]]:
+    with _user_lock:
+        ent = _user_cache.get(email)
+        if ent is None or time.monotonic() >= ent[0]:
+            _user_cache.pop(email, None)
+            return None
+        _user_cache.move_to_end(email)
+        return ent[1]
+
+def _user_cache_put(email: str, user: Dict[str, Any]) -> None:
+    with _user_lock:
+        _user_cache[email] = (time.monotonic() + USER_CACHE_TTL, user)
+        _user_cache.move_to_end(email)
+        while len(_user_cache) > USER_CACHE_MAX:
+            _user_cache.popitem(last=False)
+
+def invalidar_usuario(email: str, revogado_em: Optional[int] = None) -> None:
+    with _user_lock:
+        _user_cache.pop(email, None)
+        if revogado_em is not None:
+            _revogados[email] = max(revogado_em, _revogados.get(email, 0))
+        _user_stats["invalidacoes"] += 1
+
+def _carregar_revogacoes() -> Dict[str, int]:
+    # só as revogações que ainda podem atingir um token não expirado
+    desde = int(time.time()) - ACCESS_TOKEN_EXPIRE_MINUTES * 60
+    conn = get_conn()
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT email, tokens_revogados_em FROM users WHERE tokens_revogados_em >= %s", (desde,))
+        return {email: int(ts) for email, ts in cur.fetchall()}
+    finally:
+        conn.close()
+
+async def _sincronizar_revogacoes() -> None:
+    global _revogados_prox_sync
+    if time.monotonic() < _revogados_prox_sync:
+        return
+    _revogados_prox_sync = time.monotonic() + USER_CACHE_TTL  # antes do await: uma leitura por vez
+    try:
+        novos = await run_db(_carregar_revogacoes)
+    except Exception as e:
+        print(f"[AUTH] falha relendo revogações: {e}")
+        return
+    with _user_lock:
+        for email, ts in novos.items():
+            _revogados[email] = max(ts, _revogados.get(email, 0))
+
+def _token_revogado(payload: Dict[str, Any], revogado_em: Optional[int]) -> bool:
+    # o token do mesmo segundo da revogação (ex.: o que /auth/senha devolve) continua valendo
+    return revogado_em is not None and int(payload.get("iat") or 0) < int(revogado_em)
+
+def user_cache_stats() -> Dict[str, Any]:
+    with _user_lock:
+        return {**_user_stats, "em_cache": len(_user_cache), "revogacoes": len(_revogados),
+                "claims_no_jwt": JWT_CLAIMS_USUARIO}
+
+def _load_user_slim(email: str) -> Optional[Dict[str, Any]]:
+    conn = get_conn()
+    try:
+        cur = conn.cursor(dictionary=True)
+        cur.execute(f"SELECT {USER_FIELDS} FROM users WHERE email=%s LIMIT 1", (email,))
+        return cur.fetchone()
+    finally:
+        conn.close()
+
 def get_user_by_email(email: str) -> Optional[Dict[str, Any]]:
     conn = get_conn()
     try:
@@ -34,27 +128,79 @@ def get_user_by_email(email: str) -> Optional[Dict[str, Any]]:
     finally:
         conn.close()
 
-def create_user(name: str, email: str, password: str) -> int:
-    if get_user_by_email(email):
-        raise HTTPException(409, "E-mail já cadastrado.")
-    password_hash = hash_password(password)
+def _insert_user(name: str, email: str, password_hash: str) -> int:
+    conn = get_conn()
+    try:
+        cur = conn.cursor()
+        if not email_unico():
+            # sem a chave única o INSERT aceitaria a duplicata
+            cur.execute("SELECT 1 FROM users WHERE email=%s LIMIT 1", (email,))
+            if cur.fetchone():
+                raise HTTPException(409, "E-mail já cadastrado.")
+        try:
+            cur.execute(
+                "INSERT INTO users (name, email, password_hash) VALUES (%s,%s,%s)",
+                (name, email, password_hash)
+            )
+        except IntegrityError as e:
+            # a chave única em users.email decide; sem SELECT prévio (e sem corrida entre dois cadastros)
+            if e.errno == errorcode.ER_DUP_ENTRY:
+                raise HTTPException(409, "E-mail já cadastrado.")
+            raise
+        conn.commit()
+        return cur.lastrowid
+    finally:
+        conn.close()
+
+async def create_user(name: str, email: str, password: str) -> int:
+    password_hash = await hash_password_async(password)
+    return await run_db(_insert_user, name, email, password_hash)
+
+def set_user_active(email: str, ativo: bool) -> bool:
+    # desativar também revoga os tokens já emitidos (em todos os workers, via banco)
+    agora = None if ativo else int(time.time())
     conn = get_conn()
     try:
         cur = conn.cursor()
         cur.execute(
-            "INSERT INTO users (name, email, password_hash) VALUES (%s,%s,%s)",
-            (name, email, password_hash)
+            "UPDATE users SET is_active=%s, tokens_revogados_em=COALESCE(%s, tokens_revogados_em) WHERE email=%s",
+            (1 if ativo else 0, agora, email)
         )
         conn.commit()
-        return cur.lastrowid
+        existe = cur.rowcount > 0
+        if not existe:
+            # rowcount 0 também quando o valor já era esse
+            cur.execute("SELECT 1 FROM users WHERE email=%s LIMIT 1", (email,))
+            existe = cur.fetchone() is not None
     finally:
         conn.close()
+    invalidar_usuario(email, revogado_em=agora)
+    return existe
 
-def authenticate_user(email: str, password: str) -> Optional[Dict[str, Any]]:
-    user = get_user_by_email(email)
+def _update_password(email: str, password_hash: str) -> bool:
+    agora = int(time.time())
+    conn = get_conn()
+    try:
+        cur = conn.cursor()
+        cur.execute("UPDATE users SET password_hash=%s, tokens_revogados_em=%s WHERE email=%s",
+                    (password_hash, agora, email))
+        conn.commit()
+        alterado = cur.rowcount > 0
+    finally:
+        conn.close()
+    invalidar_usuario(email, revogado_em=agora)
+    return alterado
+
+async def change_password(email: str, nova_senha: str) -> bool:
+    password_hash = await hash_password_async(nova_senha)
+    return await run_db(_update_password, email, password_hash)
+
+async def authenticate_user(email: str, password: str) -> Optional[Dict[str, Any]]:
+    # bcrypt no pool de processos (senha_pool); banco no executor do MySQL
+    user = await run_db(get_user_by_email, email)
     if not user:
         return None
-    if not verify_password(password, user["password_hash"]):
+    if not await verify_password_async(password, user["password_hash"]):
         return None
     if not user["is_active"]:
         raise HTTPException(403, "Usuário desativado.")
@@ -69,7 +215,32 @@ async def get_current_user(token: str = Depends(oauth2_scheme)) -> Dict[str, Any
             raise cred_exc
     except JWTError:
         raise cred_exc
-    user = get_user_by_email(email)
-    if not user:
+    # token emitido antes da última troca de senha/desativação
+    await _sincronizar_revogacoes()
+    if _token_revogado(payload, _revogados.get(email)):
         raise cred_exc
+    # 1) claims do próprio token, se habilitado
+    if JWT_CLAIMS_USUARIO and payload.get("uid") is not None and payload.get("act"):
+        _user_stats["claims"] += 1
+        return {"id": payload["uid"], "name": payload.get("name"), "email": email, "is_active": True}
+    # 2) cache curto; 3) banco (fora do event loop)
+    user = _user_cache_get(email)
+    if user is None:
+        _user_stats["misses"] += 1
+        user = await run_db(_load_user_slim, email)
+        if not user:
+            raise cred_exc
+        _user_cache_put(email, user)
+    else:
+        _user_stats["hits"] += 1
+    if _token_revogado(payload, user.get("tokens_revogados_em")):
+        _user_stats["revogados"] += 1
+        raise cred_exc
+    if not user["is_active"]:
+        raise HTTPException(403, "Usuário desativado.")
+    return user
+
+async def require_admin(user: Dict[str, Any] = Depends(get_current_user)) -> Dict[str, Any]:
+    if (user.get("email") or "").lower() not in AUTH_ADMINS:
+        raise HTTPException(403, "Apenas administradores.")
     return user
@@ -0,0 +1,127 @@
+import os
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+# Estratégias de busca de cliente na Hubsoft (/cliente?busca=...). Cada base de
+# clientes costuma casar sempre pela mesma forma, então a ordem das tentativas é
+# aprendida pelas vitórias recentes em vez de ser fixa.
+ESTRATEGIAS_CLIENTE = ["", "codigo_cliente", "codigo"]
+# quantas estratégias disparar em paralelo (1 = sequencial; as perdedoras são canceladas)
+HUBSOFT_CLIENTE_CORRIDA = int(os.getenv("HUBSOFT_CLIENTE_CORRIDA", "1"))
+# peso das vitórias antigas: placar = placar * decaimento + 1 a cada vitória
+HUBSOFT_CLIENTE_DECAIMENTO = float(os.getenv("HUBSOFT_CLIENTE_DECAIMENTO", "0.98"))
+
+# consultar(params, coalesce) -> lista de clientes retornada pela Hubsoft
+Consulta = Callable[[dict, bool], Awaitable[List[dict]]]
+
+def _match(clientes: List[dict], codigo: str) -> Optional[dict]:
+    for cli in clientes:
+        if str(cli.get("codigo_cliente")) == str(codigo):
+            return cli
+    return None
+
+class BuscaCliente:
+    def __init__(self, estrategias: List[str] = ESTRATEGIAS_CLIENTE, corrida: int = HUBSOFT_CLIENTE_CORRIDA,
+                 decaimento: float = HUBSOFT_CLIENTE_DECAIMENTO):
+        self.estrategias = list(estrategias)
+        self.corrida = max(1, corrida)
+        self.decaimento = decaimento
+        self._placar: Dict[str, float] = {e: 0.0 for e in self.estrategias}
+        self._stats: Dict[str, Dict[str, int]] = {
+            e: {"tentativas": 0, "vitorias": 0, "erros": 0, "canceladas": 0} for e in self.estrategias
+        }
+        self.buscas = 0
+        self.nao_encontrados = 0
+        self.requisicoes = 0
+
+    def ordem(self) -> List[str]:
+        # sorted é estável: empate mantém a ordem original
+        return sorted(self.estrategias, key=lambda e: -self._placar[e])
+
+    def _venceu(self, estrategia: str) -> None:
+        for e in self.estrategias:
+            self._placar[e] *= self.decaimento
+        self._placar[estrategia] += 1.0
+        self._stats[estrategia]["vitorias"] += 1
+
+    def _params(self, estrategia: str, codigo: str) -> dict:
+        return {"busca": estrategia, "termo_busca": codigo, "limit": 5}
+
+    async def _tentar(self, estrategia: str, codigo: str, consultar: Consulta, coalesce: bool) -> Optional[dict]:
+        self._stats[estrategia]["tentativas"] += 1
+        self.requisicoes += 1
+        params = self._params(estrategia, codigo)
+        try:
+            clientes = await consultar(params, coalesce)
+        except asyncio.CancelledError:
+            self._stats[estrategia]["canceladas"] += 1
+            raise
+        except Exception as e:
+            self._stats[estrategia]["erros"] += 1
+            print(f"[CLIENTE] erro HTTP params={params} err={e}")
+            raise
+        print(f"[CLIENTE] tentativa params={params} retornou {len(clientes)} cliente(s)")
+        return _match(clientes, codigo)
+
+    async def _correr(self, rodada: List[str], codigo: str, consultar: Consulta) -> tuple:
+        # dispara a rodada em paralelo; o primeiro match vence e as demais são canceladas.
+        # sem coalescência: cancelar a perdedora tem que cancelar a requisição de verdade
+        tarefas = {asyncio.ensure_future(self._tentar(e, codigo, consultar, False)): e for e in rodada}
+        erro = None
+        try:
+            pendentes = set(tarefas)
+            while pendentes:
+                prontas, pendentes = await asyncio.wait(pendentes, return_when=asyncio.FIRST_COMPLETED)
+                for t in prontas:
+                    if t.exception() is not None:
+                        erro = t.exception()
+                        continue
+                    if t.result() is not None:
+                        return tarefas[t], t.result(), erro
+            return None, None, erro
+        finally:
+            for t in tarefas:
+                if not t.done():
+                    t.cancel()
+            await asyncio.gather(*tarefas, return_exceptions=True)
+
+    async def buscar(self, codigo: str, consultar: Consulta) -> Optional[dict]:
+        self.buscas += 1
+        ordem = self.ordem()
+        erro = None
+        for i in range(0, len(ordem), self.corrida):
+            rodada = ordem[i:i + self.corrida]
+            if len(rodada) == 1:
+                estrategia = rodada[0]
+                try:
+                    cli = await self._tentar(estrategia, codigo, consultar, True)
+                except Exception as e:
+                    erro = e
+                    continue
+            else:
+                estrategia, cli, erro_rodada = await self._correr(rodada, codigo, consultar)
+                erro = erro_rodada or erro
+            if cli is not None:
+                self._venceu(estrategia)
+                print(f"[CLIENTE] match exato codigo_cliente={codigo} (busca='{estrategia}') -> id={cli.get('id_cliente')}")
+                return cli
+        if erro is not None:
+            # não dá para afirmar "não encontrado" se alguma busca falhou: não entra no cache negativo
+            raise erro
+        self.nao_encontrados += 1
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "ordem": self.ordem(),
+            "corrida": self.corrida,
+            "buscas": self.buscas,
+            "nao_encontrados": self.nao_encontrados,
+            "requisicoes_por_busca": round(self.requisicoes / self.buscas, 2) if self.buscas else None,
+            "estrategias": {
+                (e or "padrao"): {**self._stats[e], "placar": round(self._placar[e], 2)}
+                for e in self.estrategias
+            },
+        }
+
+busca_cliente = BuscaCliente()
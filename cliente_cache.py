@@ -0,0 +1,167 @@
+import os
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+from db_mysql import get_conn, run_db
+from singleflight import grupo
+
+# Cache persistente dos clientes Hubsoft usados no enriquecimento das O.S.:
+# memória (LRU) -> tabela clientes_cache -> API. Guarda também os "não encontrados".
+CLIENTE_CACHE_TTL = float(os.getenv("CLIENTE_CACHE_TTL_HORAS", "24")) * 3600
+CLIENTE_CACHE_TTL_NEGATIVO = float(os.getenv("CLIENTE_CACHE_TTL_NEGATIVO_HORAS", "2")) * 3600
+CLIENTE_CACHE_MEMORIA_MAX = int(os.getenv("CLIENTE_CACHE_MEMORIA_MAX", "5000"))
+
+Loader = Callable[[str], Awaitable[Optional[dict]]]
+
+def _payload_enriquecimento(cli: dict) -> dict:
+    # só o que _enriquecer_os_com_cliente usa; o retorno completo de /cliente é bem maior
+    servicos = []
+    for svc in cli.get("servicos") or []:
+        servicos.append({
+            "status_prefixo": svc.get("status_prefixo"),
+            "id_cliente_servico": svc.get("id_cliente_servico"),
+            "nome": svc.get("nome"),
+            "referencia": svc.get("referencia"),
+            "endereco_instalacao": svc.get("endereco_instalacao"),
+        })
+    payload = {
+        "id_cliente": cli.get("id_cliente"),
+        "codigo_cliente": cli.get("codigo_cliente"),
+        "nome_razaosocial": cli.get("nome_razaosocial"),
+        "telefone_primario": cli.get("telefone_primario"),
+        "telefone_secundario": cli.get("telefone_secundario"),
+        "servicos": servicos,
+    }
+    for key in ("endereco_cadastral", "endereco_fiscal", "endereco_cobranca"):
+        blk = cli.get(key)
+        if isinstance(blk, dict) and blk.get("completo"):
+            payload[key] = {"completo": blk.get("completo")}
+    return payload
+
+def _db_get(codigo: str) -> Optional[Tuple[bool, Optional[dict], int]]:
+    conn = get_conn()
+    try:
+        cur = conn.cursor(dictionary=True)
+        cur.execute("""
+          SELECT encontrado, payload, TIMESTAMPDIFF(SECOND, atualizado_em, NOW()) AS idade
+          FROM clientes_cache WHERE codigo_cliente = %s
+        """, (codigo,))
+        row = cur.fetchone()
+        if not row: return None
+        payload = json.loads(row["payload"]) if row["payload"] else None
+        return bool(row["encontrado"]), payload, int(row["idade"] or 0)
+    finally:
+        conn.close()
+
+def _db_put(codigo: str, cli: Optional[dict]) -> None:
+    conn = get_conn()
+    try:
+        cur = conn.cursor()
+        cur.execute("""
+          INSERT INTO clientes_cache (codigo_cliente, encontrado, payload, atualizado_em)
+          VALUES (%s, %s, %s, NOW())
+          ON DUPLICATE KEY UPDATE
+            encontrado = VALUES(encontrado),
+            payload = VALUES(payload),
+            atualizado_em = NOW()
+        """, (codigo, 1 if cli else 0, json.dumps(cli, ensure_ascii=False) if cli else None))
+        conn.commit()
+    finally:
+        conn.close()
+
+def invalidar_cliente_db(codigo: str) -> None:
+    conn = get_conn()
+    try:
+        cur = conn.cursor()
+        cur.execute("DELETE FROM clientes_cache WHERE codigo_cliente = %s", (codigo,))
+        conn.commit()
+    finally:
+        conn.close()
+
+class ClienteCache:
+    def __init__(self, ttl: float = CLIENTE_CACHE_TTL, ttl_negativo: float = CLIENTE_CACHE_TTL_NEGATIVO,
+                 max_memoria: int = CLIENTE_CACHE_MEMORIA_MAX):
+        self.ttl = ttl
+        self.ttl_negativo = ttl_negativo
+        self.max_memoria = max(1, max_memoria)
+        self._mem: "OrderedDict[str, Tuple[float, Optional[dict]]]" = OrderedDict()
+        self._em_voo = grupo("cliente_cache")
+        self.stats_ = {"hits_memoria": 0, "hits_banco": 0, "misses": 0,
+                       "hits_negativos": 0, "gravacoes": 0, "erros_banco": 0}
+
+    def _ttl_de(self, cli: Optional[dict]) -> float:
+        return self.ttl if cli else self.ttl_negativo
+
+    def _lembrar(self, codigo: str, cli: Optional[dict], idade: float = 0.0) -> None:
+        self._mem[codigo] = (time.monotonic() + self._ttl_de(cli) - idade, cli)
+        self._mem.move_to_end(codigo)
+        while len(self._mem) > self.max_memoria:
+            self._mem.popitem(last=False)
+
+    def _da_memoria(self, codigo: str) -> Tuple[bool, Optional[dict]]:
+        ent = self._mem.get(codigo)
+        if ent is None:
+            return False, None
+        expira, cli = ent
+        if time.monotonic() >= expira:
+            del self._mem[codigo]
+            return False, None
+        self._mem.move_to_end(codigo)
+        return True, cli
+
+    async def get(self, codigo: str, loader: Loader) -> Optional[dict]:
+        codigo = str(codigo)
+        achou, cli = self._da_memoria(codigo)
+        if achou:
+            self.stats_["hits_memoria"] += 1
+            if cli is None:
+                self.stats_["hits_negativos"] += 1
+            return cli
+        # várias O.S. do mesmo cliente chegando juntas compartilham a mesma busca
+        return await self._em_voo.do(codigo, lambda: self._carregar(codigo, loader))
+
+    async def _carregar(self, codigo: str, loader: Loader) -> Optional[dict]:
+        try:
+            row = await run_db(_db_get, codigo)
+        except Exception as e:
+            print(f"[CLIENTE_CACHE] falha lendo cache no banco codigo={codigo}: {e}")
+            self.stats_["erros_banco"] += 1
+            row = None
+        if row is not None:
+            encontrado, payload, idade = row
+            cli = payload if encontrado else None
+            if idade < self._ttl_de(cli):
+                self.stats_["hits_banco"] += 1
+                if cli is None:
+                    self.stats_["hits_negativos"] += 1
+                self._lembrar(codigo, cli, idade)
+                return cli
+
+        self.stats_["misses"] += 1
+        # erros do loader sobem: falha de rede não pode virar "cliente não encontrado"
+        bruto = await loader(codigo)
+        cli = _payload_enriquecimento(bruto) if bruto else None
+        self._lembrar(codigo, cli)
+        try:
+            await run_db(_db_put, codigo, cli)
+            self.stats_["gravacoes"] += 1
+        except Exception as e:
+            print(f"[CLIENTE_CACHE] falha gravando cache no banco codigo={codigo}: {e}")
+            self.stats_["erros_banco"] += 1
+        return cli
+
+    async def invalidar(self, codigo: str) -> None:
+        self._mem.pop(str(codigo), None)
+        await run_db(invalidar_cliente_db, str(codigo))
+
+    def stats(self) -> Dict[str, Any]:
+        consultas = self.stats_["hits_memoria"] + self.stats_["hits_banco"] + self.stats_["misses"]
+        hits = self.stats_["hits_memoria"] + self.stats_["hits_banco"]
+        return {
+            **self.stats_,
+            "em_memoria": len(self._mem),
+            "taxa_acerto": round(hits / consultas, 3) if consultas else None,
+        }
+
+cliente_cache = ClienteCache()
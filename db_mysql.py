@@ -1,4 +1,10 @@
 import os
+import time
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
 from dotenv import load_dotenv
 import mysql.connector
 from fastapi import HTTPException
@@ -11,7 +17,18 @@ MYSQL_DB = os.getenv("MYSQL_DB", "posvenda")
 MYSQL_USER = os.getenv("MYSQL_USER", "rodrigo")
 MYSQL_PWD = os.getenv("MYSQL_PASSWORD", "Opsim354")
 
-def get_conn():
+# ===== Pool de conexões =====
+MYSQL_POOL_SIZE = int(os.getenv("MYSQL_POOL_SIZE", "10"))
+MYSQL_POOL_MIN_IDLE = int(os.getenv("MYSQL_POOL_MIN_IDLE", "1"))
+MYSQL_POOL_TIMEOUT = float(os.getenv("MYSQL_POOL_TIMEOUT", "30"))
+# conexões ociosas há mais que isso são fechadas (acima de MYSQL_POOL_MIN_IDLE)
+MYSQL_POOL_IDLE_SECONDS = float(os.getenv("MYSQL_POOL_IDLE_SECONDS", "300"))
+# conexões ociosas há mais que isso recebem ping antes de voltar ao uso
+MYSQL_POOL_PING_AFTER = float(os.getenv("MYSQL_POOL_PING_AFTER", "30"))
+# threads dedicadas às chamadas de banco feitas a partir do event loop
+MYSQL_ASYNC_WORKERS = int(os.getenv("MYSQL_ASYNC_WORKERS", str(MYSQL_POOL_SIZE)))
+
+def _connect():
     try:
         return mysql.connector.connect(
             host=MYSQL_HOST,
@@ -24,4 +41,271 @@ def get_conn():
     except mysql.connector.Error as e:
         msg = (f"Falha ao conectar no MySQL {MYSQL_HOST}:{MYSQL_PORT} "
                f"db={MYSQL_DB} user={MYSQL_USER} -> {e}")
-        raise HTTPException(status_code=500, detail=msg)
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=msg)
+
+def _close_quietly(raw) -> None:
+    try:
+        raw.close()
+    except Exception:
+        pass
+
+def _close_all_quietly(raws: List[Any]) -> None:
+    for raw in raws:
+        _close_quietly(raw)
+
+class PooledConnection:
+    # Proxy da conexão do mysql.connector: close() devolve ao pool em vez de desconectar.
+    def __init__(self, pool: "ConnectionPool", raw):
+        self._pool = pool
+        self._raw = raw
+
+    def __getattr__(self, name):
+        raw = self.__dict__.get("_raw")
+        if raw is None:
+            raise AttributeError(f"Conexão já devolvida ao pool ({name})")
+        return getattr(raw, name)
+
+    def close(self) -> None:
+        raw, self._raw = self._raw, None
+        if raw is not None:
+            self._pool._release(raw)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class ConnectionPool:
+    def __init__(self, size: int, min_idle: int, timeout: float,
+                 idle_seconds: float, ping_after: float):
+        self.size = max(1, size)
+        self.min_idle = max(0, min(min_idle, self.size))
+        self.timeout = timeout
+        self.idle_seconds = idle_seconds
+        self.ping_after = ping_after
+        self._cond = threading.Condition(threading.Lock())
+        self._idle: List[tuple] = []  # (raw, devolvida_em), LIFO
+        self._open = 0
+        self._in_use = 0
+        self._stats: Dict[str, float] = {
+            "checkouts": 0, "created": 0, "discarded": 0, "reaped": 0,
+            "waits": 0, "wait_seconds": 0.0, "max_wait_seconds": 0.0, "timeouts": 0,
+        }
+
+    def acquire(self) -> PooledConnection:
+        deadline = time.monotonic() + self.timeout
+        waited_from = None
+        while True:
+            with self._cond:
+                reaped = self._reap_locked()
+                raw = None
+                if self._idle:
+                    raw, returned_at = self._idle.pop()
+                elif self._open < self.size:
+                    self._open += 1
+                else:
+                    if waited_from is None:
+                        waited_from = time.monotonic()
+                        self._stats["waits"] += 1
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats["timeouts"] += 1
+                        self._account_wait_locked(waited_from)
+                        raise HTTPException(
+                            status_code=503,
+                            detail=f"Pool MySQL esgotado ({self.size} conexões em uso há {self.timeout:g}s)."
+                        )
+                    self._cond.wait(remaining)
+                    continue
+                self._in_use += 1
+                self._stats["checkouts"] += 1
+                self._account_wait_locked(waited_from)
+            _close_all_quietly(reaped)
+
+            if raw is None:
+                try:
+                    raw = _connect()
+                except Exception:
+                    with self._cond:
+                        self._open -= 1
+                        self._in_use -= 1
+                        self._cond.notify()
+                    raise
+                with self._cond:
+                    self._stats["created"] += 1
+                return PooledConnection(self, raw)
+
+            if self._healthy(raw, returned_at):
+                return PooledConnection(self, raw)
+            # conexão morta: descarta e tenta de novo sem consumir o prazo de espera
+            _close_quietly(raw)
+            with self._cond:
+                self._open -= 1
+                self._in_use -= 1
+                self._stats["discarded"] += 1
+                self._cond.notify()
+
+    def _healthy(self, raw, returned_at: float) -> bool:
+        if time.monotonic() - returned_at < self.ping_after:
+            return True
+        try:
+            raw.ping(reconnect=False)
+            return True
+        except Exception:
+            return False
+
+    def _release(self, raw) -> None:
+        ok = True
+        try:
+            # descarta transação pendente de quem não fez commit
+            if raw.in_transaction:
+                raw.rollback()
+        except Exception:
+            ok = False
+        with self._cond:
+            self._in_use -= 1
+            if ok:
+                self._idle.append((raw, time.monotonic()))
+            else:
+                self._open -= 1
+                self._stats["discarded"] += 1
+            reaped = self._reap_locked()
+            self._cond.notify()
+        if not ok:
+            _close_quietly(raw)
+        _close_all_quietly(reaped)
+
+    def _reap_locked(self) -> List[Any]:
+        # só separa as ociosas vencidas; quem chama fecha depois de soltar o lock
+        if not self._idle or self.idle_seconds <= 0:
+            return []
+        now = time.monotonic()
+        keep, reap = [], []
+        # _idle é LIFO: as mais antigas ficam no início da lista
+        for raw, returned_at in self._idle:
+            if now - returned_at > self.idle_seconds and len(self._idle) - len(reap) > self.min_idle:
+                reap.append(raw)
+            else:
+                keep.append((raw, returned_at))
+        if reap:
+            self._idle = keep
+            self._open -= len(reap)
+            self._stats["reaped"] += len(reap)
+        return reap
+
+    def _account_wait_locked(self, waited_from: Optional[float]) -> None:
+        if waited_from is None:
+            return
+        w = time.monotonic() - waited_from
+        self._stats["wait_seconds"] += w
+        self._stats["max_wait_seconds"] = max(self._stats["max_wait_seconds"], w)
+
+    def close_all(self) -> None:
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._open -= len(idle)
+        for raw, _ in idle:
+            _close_quietly(raw)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            s = dict(self._stats)
+            s.update({
+                "size": self.size,
+                "open": self._open,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "avg_wait_seconds": (s["wait_seconds"] / s["waits"]) if s["waits"] else 0.0,
+            })
+            return s
+
+_pool: Optional[ConnectionPool] = None
+_pool_lock = threading.Lock()
+_pool_pid: Optional[int] = None
+
+def get_pool() -> ConnectionPool:
+    global _pool, _pool_pid
+    # recria o pool depois de um fork (workers do uvicorn/gunicorn)
+    if _pool is None or _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool_pid != os.getpid():
+                _pool = ConnectionPool(
+                    MYSQL_POOL_SIZE, MYSQL_POOL_MIN_IDLE, MYSQL_POOL_TIMEOUT,
+                    MYSQL_POOL_IDLE_SECONDS, MYSQL_POOL_PING_AFTER,
+                )
+                _pool_pid = os.getpid()
+    return _pool
+
+def get_conn():
+    return get_pool().acquire()
+
+def get_conn_dedicada():
+    # conexão própria, fora do pool, para leituras longas (export): um cliente lento
+    # não segura uma das conexões que os outros endpoints usam. close() desconecta.
+    return _connect()
+
+def pool_stats() -> Dict[str, Any]:
+    return get_pool().stats()
+
+def close_pool() -> None:
+    if _pool is not None:
+        _pool.close_all()
+
+# ===== Execução não bloqueante (event loop) =====
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_pid: Optional[int] = None
+_executor_stats = {"submitted": 0, "pending": 0, "running": 0}
+_executor_stats_lock = threading.Lock()
+
+def get_db_executor() -> ThreadPoolExecutor:
+    global _executor, _executor_pid
+    if _executor is None or _executor_pid != os.getpid():
+        with _pool_lock:
+            if _executor is None or _executor_pid != os.getpid():
+                # nunca mais threads que conexões: ninguém fica parado esperando o pool
+                workers = max(1, min(MYSQL_ASYNC_WORKERS, MYSQL_POOL_SIZE))
+                _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="mysql")
+                _executor_pid = os.getpid()
+    return _executor
+
+def _tracked(fn: Callable[..., Any], state: Dict[str, bool]) -> Any:
+    with _executor_stats_lock:
+        state["started"] = True
+        if not state["abandoned"]:
+            _executor_stats["pending"] -= 1
+        _executor_stats["running"] += 1
+    try:
+        return fn()
+    finally:
+        with _executor_stats_lock:
+            _executor_stats["running"] -= 1
+
+async def run_db(fn: Callable[..., Any], *args, **kwargs) -> Any:
+    # Executa uma função síncrona de banco fora do event loop, no executor limitado.
+    loop = asyncio.get_running_loop()
+    state = {"started": False, "abandoned": False}
+    with _executor_stats_lock:
+        _executor_stats["submitted"] += 1
+        _executor_stats["pending"] += 1
+    call = functools.partial(fn, *args, **kwargs)
+    try:
+        return await loop.run_in_executor(get_db_executor(), _tracked, call, state)
+    finally:
+        with _executor_stats_lock:
+            if not state["started"] and not state["abandoned"]:
+                # cancelado antes de sair da fila
+                state["abandoned"] = True
+                _executor_stats["pending"] -= 1
+
+def db_executor_stats() -> Dict[str, Any]:
+    with _executor_stats_lock:
+        s = dict(_executor_stats)
+    s["workers"] = max(1, min(MYSQL_ASYNC_WORKERS, MYSQL_POOL_SIZE))
+    return s
+
+def close_db_executor() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
@@ -0,0 +1,272 @@
+import os
+from typing import List, Optional, Tuple
+from mysql.connector import errorcode, Error as MySQLError
+from db_mysql import get_conn
+
+# Tabelas auxiliares criadas pela própria aplicação (idempotente, roda no startup).
+# ordens_servico e users continuam sendo criadas fora daqui. As colunas e índices
+# novos dessas tabelas (COLUNAS/INDICES) podem reescrever ou varrer a tabela inteira:
+# não rodam no startup, e sim em migrar_schema.py; o startup só confere se já estão lá.
+DDL: List[str] = [
+    """
+    CREATE TABLE IF NOT EXISTS import_falhas (
+      numero        VARCHAR(32)  NOT NULL PRIMARY KEY,
+      erro          TEXT         NULL,
+      tentativas    INT          NOT NULL DEFAULT 1,
+      primeira_falha DATETIME    NOT NULL DEFAULT CURRENT_TIMESTAMP,
+      ultima_falha  DATETIME     NOT NULL DEFAULT CURRENT_TIMESTAMP
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS clientes_cache (
+      codigo_cliente VARCHAR(32)  NOT NULL PRIMARY KEY,
+      encontrado     TINYINT(1)   NOT NULL,
+      payload        MEDIUMTEXT   NULL,
+      atualizado_em  DATETIME     NOT NULL,
+      KEY idx_clientes_cache_atualizado (atualizado_em)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS sync_watermarks (
+      fonte            VARCHAR(64)  NOT NULL PRIMARY KEY,
+      janela_inicio    DATE         NULL,
+      janela_fim       DATE         NULL,
+      ultimo_marcador  DATETIME     NULL,
+      ultima_execucao  DATETIME     NULL,
+      ultimo_sucesso   DATETIME     NULL,
+      itens_ultima     INT          NOT NULL DEFAULT 0,
+      execucoes        INT          NOT NULL DEFAULT 0,
+      erro             TEXT         NULL
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS ordens_rollup_diario (
+      dia                  DATE         NOT NULL,
+      status               VARCHAR(100) NOT NULL,
+      cidade               VARCHAR(100) NOT NULL,
+      tecnico_principal_id VARCHAR(32)  NOT NULL,
+      tipo                 VARCHAR(100) NOT NULL,
+      tecnico_nome         VARCHAR(150) NULL,
+      total                INT          NOT NULL,
+      atualizado_em        DATETIME     NOT NULL,
+      PRIMARY KEY (dia, status, cidade, tecnico_principal_id, tipo)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS ordens_rollup_pendentes (
+      dia         DATE     NOT NULL PRIMARY KEY,
+      versao      INT      NOT NULL DEFAULT 1,
+      marcado_em  DATETIME NOT NULL,
+      erro        TEXT     NULL
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS ordens_servico_raw (
+      conteudo_hash    CHAR(32)     NOT NULL PRIMARY KEY,
+      formato          VARCHAR(8)   NOT NULL,
+      payload          MEDIUMBLOB   NOT NULL,
+      tamanho_original INT          NOT NULL,
+      criado_em        DATETIME     NOT NULL
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """,
+]
+
+# (tabela, coluna, ALTER que a cria) — aplicadas por migrar_schema.py
+COLUNAS: List[Tuple[str, str, str]] = [
+    ("ordens_servico", "conteudo_hash",
+     "ALTER TABLE ordens_servico ADD COLUMN conteudo_hash CHAR(32) NULL"),
+    # chave de ordenação e dos filtros de período: indexável, ao contrário do COALESCE
+    # no ORDER BY e do OR entre as duas datas; o MySQL mantém o valor a cada upsert
+    ("ordens_servico", "data_referencia",
+     "ALTER TABLE ordens_servico ADD COLUMN data_referencia DATETIME "
+     "AS (COALESCE(data_termino_executado, data_cadastro)) STORED"),
+    # segundo (unix) da última troca de senha/desativação: tokens com iat anterior não valem
+    ("users", "tokens_revogados_em",
+     "ALTER TABLE users ADD COLUMN tokens_revogados_em BIGINT NULL"),
+]
+
+# busca textual de /api/ordens (q): índice FULLTEXT com parser ngram, que acha
+# pedaços de palavras como o LIKE '%q%' fazia. A lista de colunas tem que ser
+# exatamente a do MATCH() em os_repository.
+OS_BUSCA_FULLTEXT = os.getenv("OS_BUSCA_FULLTEXT", "1") == "1"
+BUSCA_COLUNAS = "tipo, cliente_nome, cidade, cliente_rotulo, servico_rotulo"
+
+# (tabela, índice, coluna que já basta estar na frente de outro índice, ALTER que o cria)
+INDICES: List[Tuple[str, str, Optional[str], str]] = [
+    # limpeza de payloads órfãos em ordens_servico_raw (migrar_raw.py --limpar-orfaos)
+    ("ordens_servico", "idx_os_conteudo_hash", "conteudo_hash",
+     "ALTER TABLE ordens_servico ADD INDEX idx_os_conteudo_hash (conteudo_hash)"),
+    # paginação por cursor em /api/ordens
+    ("ordens_servico", "idx_os_data_referencia", None,
+     "ALTER TABLE ordens_servico ADD INDEX idx_os_data_referencia (data_referencia, id_ordem_servico)"),
+    # filtros de status + período na listagem e nos relatórios (faixa em data_referencia)
+    ("ordens_servico", "idx_os_status_referencia", None,
+     "ALTER TABLE ordens_servico ADD INDEX idx_os_status_referencia (status, data_referencia, id_ordem_servico)"),
+    # atalhos exatos da busca: número da O.S. e código do cliente
+    ("ordens_servico", "idx_os_numero", "numero",
+     "ALTER TABLE ordens_servico ADD INDEX idx_os_numero (numero)"),
+    ("ordens_servico", "idx_os_cliente_codigo", "cliente_codigo",
+     "ALTER TABLE ordens_servico ADD INDEX idx_os_cliente_codigo (cliente_codigo)"),
+]
+if OS_BUSCA_FULLTEXT:
+    INDICES.append(("ordens_servico", "ft_os_busca", None,
+                    f"ALTER TABLE ordens_servico ADD FULLTEXT INDEX ft_os_busca ({BUSCA_COLUNAS}) WITH PARSER ngram"))
+
+# o startup registra se ft_os_busca existe; sem ele (migração não rodou, MySQL sem
+# o parser ngram) a busca de os_repository usa o LIKE
+_fulltext_ok = False
+
+def fulltext_disponivel() -> bool:
+    return OS_BUSCA_FULLTEXT and _fulltext_ok
+
+# com vários workers do uvicorn subindo juntos, só um mexe no schema por vez
+SCHEMA_LOCK = "ensure_schema"
+SCHEMA_LOCK_TIMEOUT = int(os.getenv("SCHEMA_LOCK_TIMEOUT", "120"))
+
+def _tabela_existe(cur, tabela: str) -> bool:
+    cur.execute("""
+      SELECT 1 FROM information_schema.TABLES
+      WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+    """, (tabela,))
+    return cur.fetchone() is not None
+
+def _coluna_existe(cur, tabela: str, coluna: str) -> bool:
+    cur.execute("""
+      SELECT 1 FROM information_schema.COLUMNS
+      WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s
+    """, (tabela, coluna))
+    return cur.fetchone() is not None
+
+def _indice_existe(cur, tabela: str, indice: str) -> bool:
+    cur.execute("""
+      SELECT 1 FROM information_schema.STATISTICS
+      WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s
+      LIMIT 1
+    """, (tabela, indice))
+    return cur.fetchone() is not None
+
+def _coluna_indexada(cur, tabela: str, coluna: str) -> bool:
+    # algum índice (PK/UNIQUE inclusive) já começa por esta coluna
+    cur.execute("""
+      SELECT 1 FROM information_schema.STATISTICS
+      WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s AND SEQ_IN_INDEX = 1
+      LIMIT 1
+    """, (tabela, coluna))
+    return cur.fetchone() is not None
+
+# create_user conta com a chave única em users.email para recusar e-mail repetido;
+# enquanto ela não existir (ex.: duplicatas antigas), ele volta a consultar antes do INSERT
+_email_unico = False
+
+def email_unico() -> bool:
+    return _email_unico
+
+UNICOS: List[Tuple[str, str, str, str]] = [
+    ("users", "uq_users_email", "email", "ALTER TABLE users ADD UNIQUE INDEX uq_users_email (email)"),
+]
+
+def _coluna_unica(cur, tabela: str, coluna: str) -> bool:
+    # PK/UNIQUE só desta coluna
+    cur.execute("""
+      SELECT 1 FROM information_schema.STATISTICS s
+      WHERE s.TABLE_SCHEMA = DATABASE() AND s.TABLE_NAME = %s AND s.COLUMN_NAME = %s
+        AND s.SEQ_IN_INDEX = 1 AND s.NON_UNIQUE = 0
+        AND NOT EXISTS (
+          SELECT 1 FROM information_schema.STATISTICS s2
+          WHERE s2.TABLE_SCHEMA = s.TABLE_SCHEMA AND s2.TABLE_NAME = s.TABLE_NAME
+            AND s2.INDEX_NAME = s.INDEX_NAME AND s2.SEQ_IN_INDEX = 2
+        )
+      LIMIT 1
+    """, (tabela, coluna))
+    return cur.fetchone() is not None
+
+def _com_lock(fn):
+    conn = get_conn()
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT GET_LOCK(%s, %s)", (SCHEMA_LOCK, SCHEMA_LOCK_TIMEOUT))
+        (ok,) = cur.fetchone()
+        if ok != 1:
+            raise RuntimeError(f"não consegui o lock '{SCHEMA_LOCK}' em {SCHEMA_LOCK_TIMEOUT}s (migração rodando?)")
+        try:
+            return fn(conn, cur)
+        finally:
+            cur.execute("SELECT RELEASE_LOCK(%s)", (SCHEMA_LOCK,))
+            cur.fetchone()
+    finally:
+        conn.close()
+
+def _alter(cur, alter: str) -> None:
+    try:
+        cur.execute(alter)
+    except MySQLError as e:
+        # outro processo criou antes de nós: o objetivo já foi atingido
+        if e.errno in (errorcode.ER_DUP_FIELDNAME, errorcode.ER_DUP_KEYNAME):
+            print(f"[SCHEMA] já existia: {e.msg}")
+            return
+        raise
+
+def colunas_pendentes(cur) -> List[str]:
+    return [f"{t}.{c}" for t, c, _ in COLUNAS if _tabela_existe(cur, t) and not _coluna_existe(cur, t, c)]
+
+def _indice_pendente(cur, tabela: str, indice: str, coluna: Optional[str]) -> bool:
+    if not _tabela_existe(cur, tabela) or _indice_existe(cur, tabela, indice):
+        return False
+    return not (coluna and _coluna_indexada(cur, tabela, coluna))
+
+def indices_pendentes(cur) -> List[str]:
+    return [f"{t}.{i}" for t, i, c, _ in INDICES if _indice_pendente(cur, t, i, c)]
+
+def aplicar_migracoes() -> Tuple[List[str], List[str]]:
+    # chamada por migrar_schema.py; pode levar minutos numa tabela grande.
+    # Índice que não dá para criar (ex.: FULLTEXT sem o parser ngram) não impede os outros.
+    def _aplicar(conn, cur):
+        feitas, falhas = [], []
+        for tabela, coluna, alter in COLUNAS:
+            if _tabela_existe(cur, tabela) and not _coluna_existe(cur, tabela, coluna):
+                print(f"[SCHEMA] criando {tabela}.{coluna}")
+                _alter(cur, alter)
+                feitas.append(f"{tabela}.{coluna}")
+        for tabela, indice, coluna, alter in INDICES:
+            if not _indice_pendente(cur, tabela, indice, coluna):
+                continue
+            print(f"[SCHEMA] criando índice {tabela}.{indice}")
+            try:
+                _alter(cur, alter)
+            except MySQLError as e:
+                print(f"[SCHEMA] ERRO criando índice {tabela}.{indice}: {e}")
+                falhas.append(f"{tabela}.{indice}")
+                continue
+            feitas.append(f"{tabela}.{indice}")
+        conn.commit()
+        return feitas, falhas
+    return _com_lock(_aplicar)
+
+def ensure_schema() -> None:
+    def _garantir(conn, cur):
+        global _fulltext_ok, _email_unico
+        for stmt in DDL:
+            cur.execute(stmt)
+        for tabela, indice, coluna, alter in UNICOS:
+            if not _tabela_existe(cur, tabela) or _coluna_unica(cur, tabela, coluna):
+                continue
+            print(f"[SCHEMA] criando chave única {tabela}.{indice}")
+            try:
+                _alter(cur, alter)
+            except Exception as e:
+                # duplicatas antigas impedem a chave; o cadastro segue com a checagem prévia
+                print(f"[SCHEMA] não foi possível criar {tabela}.{indice} (há valores repetidos?): {e}")
+        conn.commit()
+        _email_unico = _tabela_existe(cur, "users") and _coluna_unica(cur, "users", "email")
+        if not _email_unico:
+            print("[SCHEMA] AVISO: users.email sem chave única; /auth/register consulta o e-mail antes de inserir")
+        faltando = colunas_pendentes(cur)
+        if faltando:
+            # upsert e listagens dependem delas: melhor não subir do que falhar em cada requisição
+            raise RuntimeError(f"colunas pendentes em {', '.join(faltando)}: rode 'python migrar_schema.py'")
+        for nome in indices_pendentes(cur):
+            print(f"[SCHEMA] AVISO: índice {nome} ausente (consultas mais lentas); rode 'python migrar_schema.py'")
+        _fulltext_ok = _tabela_existe(cur, "ordens_servico") and _indice_existe(cur, "ordens_servico", "ft_os_busca")
+        if OS_BUSCA_FULLTEXT and not _fulltext_ok:
+            print("[SCHEMA] AVISO: sem ft_os_busca; a busca textual usa LIKE")
+    _com_lock(_garantir)
@@ -0,0 +1,100 @@
+import io
+import os
+import csv
+import json
+import zlib
+import threading
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
+
+# Serialização do export de O.S. em pedaços de ~64 KB, sem montar o arquivo em memória.
+EXPORT_PEDACO_BYTES = 64 * 1024
+# cada export prende uma conexão MySQL enquanto o cliente baixa; acima disso, 503
+EXPORT_MAX_SIMULTANEOS = int(os.getenv("EXPORT_MAX_SIMULTANEOS", "3"))
+
+_vagas = threading.BoundedSemaphore(max(1, EXPORT_MAX_SIMULTANEOS))
+_vagas_stats = {"em_andamento": 0, "concluidos": 0, "recusados": 0}
+_vagas_lock = threading.Lock()
+
+class VagaExport:
+    # liberar() pode ser chamado mais de uma vez (fim do stream e background da resposta)
+    def __init__(self):
+        self._liberada = False
+        self._lock = threading.Lock()
+
+    def liberar(self) -> None:
+        with self._lock:
+            if self._liberada:
+                return
+            self._liberada = True
+        _vagas.release()
+        with _vagas_lock:
+            _vagas_stats["em_andamento"] -= 1
+            _vagas_stats["concluidos"] += 1
+
+def reservar_vaga():
+    # None quando todas as vagas estão ocupadas (não espera)
+    if not _vagas.acquire(blocking=False):
+        with _vagas_lock:
+            _vagas_stats["recusados"] += 1
+        return None
+    with _vagas_lock:
+        _vagas_stats["em_andamento"] += 1
+    return VagaExport()
+
+def export_stats() -> Dict[str, Any]:
+    with _vagas_lock:
+        return {**_vagas_stats, "maximo": EXPORT_MAX_SIMULTANEOS}
+
+def _valor(v: Any) -> Any:
+    if isinstance(v, datetime):
+        return v.strftime("%Y-%m-%d %H:%M:%S")
+    if isinstance(v, date):
+        return v.isoformat()
+    if isinstance(v, Decimal):
+        return float(v)
+    if isinstance(v, (bytes, bytearray)):
+        return v.decode("utf-8", "replace")
+    return v
+
+def _agrupar(pedacos: Iterable[str]) -> Iterator[bytes]:
+    buf: List[str] = []
+    tamanho = 0
+    for p in pedacos:
+        buf.append(p)
+        tamanho += len(p)
+        if tamanho >= EXPORT_PEDACO_BYTES:
+            yield "".join(buf).encode("utf-8")
+            buf, tamanho = [], 0
+    if buf:
+        yield "".join(buf).encode("utf-8")
+
+def _csv(colunas: List[str], linhas: Iterable[Tuple]) -> Iterator[str]:
+    saida = io.StringIO()
+    w = csv.writer(saida)
+    w.writerow(colunas)
+    for row in linhas:
+        w.writerow([_valor(v) for v in row])
+        if saida.tell() >= EXPORT_PEDACO_BYTES:
+            yield saida.getvalue()
+            saida.seek(0)
+            saida.truncate()
+    yield saida.getvalue()
+
+def _ndjson(colunas: List[str], linhas: Iterable[Tuple]) -> Iterator[str]:
+    for row in linhas:
+        yield json.dumps({c: _valor(v) for c, v in zip(colunas, row)}, ensure_ascii=False) + "\n"
+
+def _gzip(pedacos: Iterable[bytes]) -> Iterator[bytes]:
+    z = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31: cabeçalho gzip
+    for p in pedacos:
+        out = z.compress(p)
+        if out:
+            yield out
+    yield z.flush()
+
+def exportar(formato: str, colunas: List[str], linhas: Iterable[Tuple], gzip: bool = False) -> Iterator[bytes]:
+    texto = _csv(colunas, linhas) if formato == "csv" else _ndjson(colunas, linhas)
+    pedacos = _agrupar(texto)
+    return _gzip(pedacos) if gzip else pedacos
@@ -2,10 +2,20 @@ import os
 import json
 import time
 import asyncio
+import tempfile
+from contextlib import asynccontextmanager
 from typing import Any, Dict, Optional
 import httpx
 from fastapi import HTTPException
 from dotenv import load_dotenv
+from hubsoft_client import get_client
+from hubsoft_limiter import limiter_para, parse_retry_after
+from hubsoft_resiliencia import politica, orcamento, circuito, contar
+from singleflight import grupo
+try:
+    import fcntl
+except ImportError:  # Windows: sem trava entre processos
+    fcntl = None
 
 load_dotenv()
 
@@ -20,8 +30,17 @@ TOKEN_FILE = os.getenv(
     os.path.join(BASE_DIR, ".cache_hubsoft_token.json")
 )
 
+TOKEN_LOCK_FILE = TOKEN_FILE + ".lock"
+
 SKEW_SECONDS = 300
+# a renovação em segundo plano roda esse tanto antes de o token entrar na janela de SKEW_SECONDS
+REFRESH_MARGIN_SECONDS = int(os.getenv("HUBSOFT_TOKEN_REFRESH_MARGIN", "120"))
+FILE_LOCK_TIMEOUT = float(os.getenv("HUBSOFT_TOKEN_LOCK_TIMEOUT", "60"))
 _lock = asyncio.Lock()
+# token em memória: o caminho rápido de get_hubsoft_token só lê esta referência
+_token: Optional[Dict[str, Any]] = None
+_token_rejeitado: Optional[str] = None
+_refresher: Optional[asyncio.Task] = None
 
 def _load_cache() -> Optional[Dict[str, Any]]:
     if not os.path.exists(TOKEN_FILE):
@@ -37,26 +56,77 @@ def _load_cache() -> Optional[Dict[str, Any]]:
         return None
 
 def _save_cache(data: Dict[str, Any]) -> None:
+    # escrita atômica: outros workers nunca leem um JSON pela metade
     try:
-        with open(TOKEN_FILE, "w", encoding="utf-8") as f:
-            json.dump(data, f)
+        fd, tmp = tempfile.mkstemp(prefix=".token-", dir=os.path.dirname(TOKEN_FILE) or ".")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, TOKEN_FILE)
+        except Exception:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
         print("💾 [AUTH] Token salvo em cache.")
     except Exception as e:
         print(f"⚠️  [AUTH] Falha ao salvar cache: {e}")
 
-def _invalidate_cache() -> None:
+def _invalidate_cache(access_token: Optional[str] = None) -> None:
+    # Descarta o token recusado pela API (401). Se outro worker já trocou o token,
+    # não apaga o arquivo novo dele.
+    global _token, _token_rejeitado
+    atual = (_token or {}).get("access_token")
+    if access_token and atual and access_token != atual:
+        return
+    _token_rejeitado = access_token or atual
+    _token = None
     try:
-        if os.path.exists(TOKEN_FILE):
+        disco = _load_cache()
+        if disco and disco.get("access_token") == _token_rejeitado:
             os.remove(TOKEN_FILE)
             print("🧹 [AUTH] Cache de token invalidado/removido.")
     except Exception as e:
         print(f"⚠️  [AUTH] Falha ao invalidar cache: {e}")
 
-def _is_valid(cache: Optional[Dict[str, Any]]) -> bool:
-    if not cache:
+def _valido_por(cache: Optional[Dict[str, Any]], segundos: float) -> bool:
+    if not cache or not cache.get("access_token"):
+        return False
+    if cache.get("access_token") == _token_rejeitado:
         return False
-    expires_at = cache.get("expires_at", 0)
-    return (time.time() + SKEW_SECONDS) < expires_at and bool(cache.get("access_token"))
+    return (time.time() + segundos) < cache.get("expires_at", 0)
+
+def _is_valid(cache: Optional[Dict[str, Any]]) -> bool:
+    return _valido_por(cache, SKEW_SECONDS)
+
+@asynccontextmanager
+async def _file_lock():
+    # Trava entre processos (vários workers do uvicorn) para só um deles pedir token.
+    # flock não bloqueante + sleep para não travar o event loop.
+    if fcntl is None:
+        yield
+        return
+    f = open(TOKEN_LOCK_FILE, "a+")
+    try:
+        deadline = time.monotonic() + FILE_LOCK_TIMEOUT
+        while True:
+            try:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                if time.monotonic() > deadline:
+                    print("⚠️  [AUTH] Timeout esperando trava do token; seguindo sem ela.")
+                    break
+                await asyncio.sleep(0.1)
+        yield
+    finally:
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+        finally:
+            f.close()
 
 # Grants
 
@@ -70,14 +140,13 @@ async def _password_grant() -> Dict[str, Any]:
         "grant_type": "password",
     }
     print("🚀 [AUTH] Solicitando novo token (password grant)...")
-    async with httpx.AsyncClient(timeout=30) as client:
-        r = await client.post(url, json=payload)
-        if r.status_code != 200:
-            raise HTTPException(status_code=500, detail=f"Erro ao obter token: {r.text}")
-        data = r.json()
-        data["expires_at"] = time.time() + int(data.get("expires_in", 0))
-        print(f"✅ [AUTH] Novo token obtido. Expira em {time.ctime(data['expires_at'])}")
-        return data
+    r = await get_client().post(url, json=payload, timeout=30)
+    if r.status_code != 200:
+        raise HTTPException(status_code=500, detail=f"Erro ao obter token: {r.text}")
+    data = r.json()
+    data["expires_at"] = time.time() + int(data.get("expires_in", 0))
+    print(f"✅ [AUTH] Novo token obtido. Expira em {time.ctime(data['expires_at'])}")
+    return data
 
 async def _refresh_grant(refresh_token: str) -> Dict[str, Any]:
     url = f"{HUBSOFT_BASE_URL}/oauth/token"
@@ -88,37 +157,96 @@ async def _refresh_grant(refresh_token: str) -> Dict[str, Any]:
         "grant_type": "refresh_token",
     }
     print("🔁 [AUTH] Tentando refresh do token...")
-    async with httpx.AsyncClient(timeout=30) as client:
-        r = await client.post(url, json=payload)
-        if r.status_code != 200:
-            raise HTTPException(status_code=401, detail=f"Erro em refresh token: {r.text}")
-        data = r.json()
-        data["expires_at"] = time.time() + int(data.get("expires_in", 0))
-        print(f"✅ [AUTH] Token renovado. Expira em {time.ctime(data['expires_at'])}")
-        return data
+    r = await get_client().post(url, json=payload, timeout=30)
+    if r.status_code != 200:
+        raise HTTPException(status_code=401, detail=f"Erro em refresh token: {r.text}")
+    data = r.json()
+    data["expires_at"] = time.time() + int(data.get("expires_in", 0))
+    print(f"✅ [AUTH] Token renovado. Expira em {time.ctime(data['expires_at'])}")
+    return data
 
 # API externa: obter token / headers
 
-async def get_hubsoft_token() -> str:
-    async with _lock:
+async def _obter_token(minimo_segundos: float) -> Dict[str, Any]:
+    # Chamado com _lock adquirido. Garante em _token um token válido por pelo menos
+    # minimo_segundos, preferindo o que outro processo já gravou em disco.
+    global _token
+    async with _file_lock():
         cache = _load_cache()
-        if _is_valid(cache):
-            return cache["access_token"]
-        if cache and cache.get("refresh_token"):
+        if _valido_por(cache, minimo_segundos):
+            _token = cache
+            return cache
+        base = cache if (cache and cache.get("refresh_token")) else _token
+        if base and base.get("refresh_token"):
             try:
-                refreshed = await _refresh_grant(cache["refresh_token"])
+                refreshed = await _refresh_grant(base["refresh_token"])
                 _save_cache(refreshed)
-                return refreshed["access_token"]
+                _token = refreshed
+                return refreshed
             except HTTPException:
                 pass
 
         fresh = await _password_grant()
         _save_cache(fresh)
-        return fresh["access_token"]
+        _token = fresh
+        return fresh
 
-async def get_auth_headers() -> Dict[str, str]:
-    token = await get_hubsoft_token()
-    return {"Authorization": f"Bearer {token}"}
+async def get_hubsoft_token() -> str:
+    cache = _token
+    if _is_valid(cache):
+        return cache["access_token"]
+    async with _lock:
+        if _is_valid(_token):
+            return _token["access_token"]
+        return (await _obter_token(SKEW_SECONDS))["access_token"]
+
+async def _loop_refresh() -> None:
+    while True:
+        cache = _token
+        antecedencia = SKEW_SECONDS + REFRESH_MARGIN_SECONDS
+        espera = (cache.get("expires_at", 0) - antecedencia - time.time()) if cache else 0
+        if espera > 0:
+            # reavalia periodicamente: outro worker pode ter trocado o token
+            await asyncio.sleep(min(espera, 300))
+            continue
+        try:
+            async with _lock:
+                if not _valido_por(_token, antecedencia):
+                    await _obter_token(antecedencia)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"⚠️  [AUTH] Falha na renovação antecipada do token: {e}")
+            await asyncio.sleep(30)
+
+def start_token_refresher() -> None:
+    global _refresher
+    if _refresher is None or _refresher.done():
+        _refresher = asyncio.create_task(_loop_refresh())
+        print("🔁 [AUTH] Renovação antecipada do token ativada.")
+
+async def stop_token_refresher() -> None:
+    global _refresher
+    if _refresher is not None:
+        _refresher.cancel()
+        try:
+            await _refresher
+        except asyncio.CancelledError:
+            pass
+        _refresher = None
+
+class HubsoftBearerAuth(httpx.Auth):
+    # Injeta o Bearer em cada requisição do cliente compartilhado e repete uma vez em caso de 401.
+    async def async_auth_flow(self, request: httpx.Request):
+        token = await get_hubsoft_token()
+        request.headers["Authorization"] = f"Bearer {token}"
+        response = yield request
+        if response.status_code == 401:
+            _invalidate_cache(token)
+            request.headers["Authorization"] = f"Bearer {await get_hubsoft_token()}"
+            yield request
+
+_bearer_auth = HubsoftBearerAuth()
 
 async def _request_with_retry(
     method: str,
@@ -129,24 +257,73 @@ async def _request_with_retry(
     timeout: int = 60,
 ) -> Dict[str, Any]:
 
-    # Chamada HTTP à API Hubsoft com retry em caso de 401 (expiração do token).
+    # Chamada HTTP à API Hubsoft pelo cliente compartilhado. O 401 é tratado em HubsoftBearerAuth,
+    # a concorrência por endpoint pelo limitador adaptativo, e timeouts / 5xx / 429 / conexões
+    # derrubadas são repetidos com backoff+jitter enquanto houver orçamento de retry.
+    # Com o circuito aberto, o chamador espera a Hubsoft voltar em vez de insistir.
     
     if not HUBSOFT_BASE_URL:
         raise HTTPException(500, "HUBSOFT_BASE_URL não configurada.")
     url = f"{HUBSOFT_BASE_URL.rstrip('/')}/{path.lstrip('/')}"
-    async with httpx.AsyncClient(timeout=timeout) as client:
-        r = await client.request(method, url, headers=await get_auth_headers(), params=params, json=json_body)
-        if r.status_code == 401:
-            _invalidate_cache()
-            r = await client.request(method, url, headers=await get_auth_headers(), params=params, json=json_body)
-        r.raise_for_status()
+    contar("requisicoes")
+    orcamento.registrar_requisicao()
+    tentativa = 0
+    while True:
+        tentativa += 1
+        sonda = await circuito.aguardar()
+        resolvido = False
         try:
-            return r.json()
-        except ValueError:
-            return {"status_code": r.status_code, "text": r.text}
+            try:
+                async with limiter_para(path).slot() as slot:
+                    r = await get_client().request(method, url, params=params, json=json_body, timeout=timeout, auth=_bearer_auth)
+                    slot.resultado(r.status_code, r.headers.get("Retry-After"))
+            except (httpx.TimeoutException, httpx.TransportError) as e:
+                circuito.falha()
+                resolvido = True
+                if tentativa >= politica.tentativas or not orcamento.pode_repetir():
+                    contar("falhas_definitivas")
+                    raise
+                espera = politica.espera(tentativa)
+                print(f"🔁 [HUBSOFT] {method} {path} falhou ({type(e).__name__}: {e}); tentativa {tentativa} -> nova em {espera:.1f}s")
+                contar("retries")
+                await asyncio.sleep(espera)
+                continue
+
+            transitorio = r.status_code == 429 or r.status_code >= 500
+            if r.status_code >= 500:
+                circuito.falha()
+            elif r.status_code < 400:
+                circuito.sucesso()
+            else:
+                circuito.neutro()
+            resolvido = True
+            if transitorio:
+                if tentativa < politica.tentativas and orcamento.pode_repetir():
+                    espera = politica.espera(tentativa, parse_retry_after(r.headers.get("Retry-After")))
+                    print(f"🔁 [HUBSOFT] {method} {path} -> HTTP {r.status_code}; tentativa {tentativa} -> nova em {espera:.1f}s")
+                    contar("retries")
+                    await asyncio.sleep(espera)
+                    continue
+                contar("falhas_definitivas")
+            r.raise_for_status()
+            try:
+                return r.json()
+            except ValueError:
+                return {"status_code": r.status_code, "text": r.text}
+        finally:
+            if sonda and not resolvido:
+                circuito.cancelar_sondagem()
+
+_get_em_voo = grupo("hubsoft_get")
 
-async def hubsoft_get(path: str, params: Optional[Dict[str, Any]] = None, timeout: int = 60) -> Dict[str, Any]:
-    return await _request_with_retry("GET", path, params=params, timeout=timeout)
+async def hubsoft_get(path: str, params: Optional[Dict[str, Any]] = None, timeout: int = 60,
+                      coalesce: bool = True) -> Dict[str, Any]:
+    # GETs idênticos em paralelo viram uma única chamada; o resultado é compartilhado
+    # entre os chamadores (não deve ser alterado por eles).
+    if not coalesce:
+        return await _request_with_retry("GET", path, params=params, timeout=timeout)
+    chave = (path, tuple(sorted((k, str(v)) for k, v in (params or {}).items())))
+    return await _get_em_voo.do(chave, lambda: _request_with_retry("GET", path, params=params, timeout=timeout))
 
 async def hubsoft_post(path: str, json_body: Optional[Dict[str, Any]] = None, timeout: int = 60) -> Dict[str, Any]:
     return await _request_with_retry("POST", path, json_body=json_body, timeout=timeout)
\ No newline at end of file
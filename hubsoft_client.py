@@ -0,0 +1,68 @@
+import os
+import asyncio
+from typing import Any, Dict, Optional
+import httpx
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Cliente HTTP único para toda a aplicação: reaproveita conexões TLS (keep-alive)
+# em vez de abrir um httpx.AsyncClient por chamada.
+HUBSOFT_TIMEOUT = float(os.getenv("HUBSOFT_TIMEOUT", "60"))
+HUBSOFT_CONNECT_TIMEOUT = float(os.getenv("HUBSOFT_CONNECT_TIMEOUT", "10"))
+HUBSOFT_MAX_CONNECTIONS = int(os.getenv("HUBSOFT_MAX_CONNECTIONS", "50"))
+HUBSOFT_MAX_KEEPALIVE = int(os.getenv("HUBSOFT_MAX_KEEPALIVE", "20"))
+HUBSOFT_KEEPALIVE_EXPIRY = float(os.getenv("HUBSOFT_KEEPALIVE_EXPIRY", "60"))
+HUBSOFT_HTTP2 = os.getenv("HUBSOFT_HTTP2", "0").lower() in ("1", "true", "sim", "yes")
+
+_client: Optional[httpx.AsyncClient] = None
+_client_loop: Optional[asyncio.AbstractEventLoop] = None
+
+def _http2_disponivel() -> bool:
+    if not HUBSOFT_HTTP2:
+        return False
+    try:
+        import h2  # noqa: F401  (instalado via httpx[http2])
+        return True
+    except ImportError:
+        print("⚠️  [HTTP] HUBSOFT_HTTP2 ativo mas o pacote 'h2' não está instalado; usando HTTP/1.1.")
+        return False
+
+def _build_client() -> httpx.AsyncClient:
+    http2 = _http2_disponivel()
+    limits = httpx.Limits(
+        max_connections=HUBSOFT_MAX_CONNECTIONS,
+        max_keepalive_connections=HUBSOFT_MAX_KEEPALIVE,
+        keepalive_expiry=HUBSOFT_KEEPALIVE_EXPIRY,
+    )
+    timeout = httpx.Timeout(HUBSOFT_TIMEOUT, connect=HUBSOFT_CONNECT_TIMEOUT)
+    print(f"🌐 [HTTP] Cliente Hubsoft criado (http2={http2} max_conn={HUBSOFT_MAX_CONNECTIONS} keepalive={HUBSOFT_MAX_KEEPALIVE})")
+    return httpx.AsyncClient(http2=http2, limits=limits, timeout=timeout)
+
+def get_client() -> httpx.AsyncClient:
+    # Criado no startup; se alguém usar fora do app (scripts, outro loop), cria sob demanda.
+    global _client, _client_loop
+    loop = asyncio.get_running_loop()
+    if _client is None or _client.is_closed or _client_loop is not loop:
+        _client = _build_client()
+        _client_loop = loop
+    return _client
+
+async def startup() -> None:
+    get_client()
+
+async def shutdown() -> None:
+    global _client, _client_loop
+    if _client is not None and not _client.is_closed:
+        await _client.aclose()
+        print("🌐 [HTTP] Cliente Hubsoft fechado.")
+    _client = None
+    _client_loop = None
+
+def client_stats() -> Dict[str, Any]:
+    return {
+        "ativo": _client is not None and not _client.is_closed,
+        "http2": HUBSOFT_HTTP2,
+        "max_connections": HUBSOFT_MAX_CONNECTIONS,
+        "max_keepalive": HUBSOFT_MAX_KEEPALIVE,
+    }
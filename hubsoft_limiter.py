@@ -0,0 +1,166 @@
+import os
+import time
+import asyncio
+from collections import deque
+from email.utils import parsedate_to_datetime
+from typing import Any, Deque, Dict, Optional
+
+# Limite de concorrência adaptativo (AIMD) para a API Hubsoft:
+# sobe devagar enquanto a latência se mantém estável e corta pela metade
+# em 429/5xx/timeouts, respeitando Retry-After.
+HUBSOFT_LIMITE_INICIAL = float(os.getenv("HUBSOFT_LIMITE_INICIAL", "6"))
+HUBSOFT_LIMITE_MIN = float(os.getenv("HUBSOFT_LIMITE_MIN", "1"))
+HUBSOFT_LIMITE_MAX = float(os.getenv("HUBSOFT_LIMITE_MAX", "32"))
+# latência acima de baseline * tolerância conta como "fila se formando" do lado da Hubsoft
+HUBSOFT_LIMITE_TOLERANCIA = float(os.getenv("HUBSOFT_LIMITE_TOLERANCIA", "2.0"))
+HUBSOFT_LIMITE_RECUO = float(os.getenv("HUBSOFT_LIMITE_RECUO", "0.5"))
+JANELA_LATENCIAS = 500
+
+def parse_retry_after(valor: Optional[str]) -> Optional[float]:
+    if not valor:
+        return None
+    try:
+        return max(0.0, float(valor))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(valor).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def _percentil(ordenados: list, p: float) -> Optional[float]:
+    if not ordenados:
+        return None
+    k = min(len(ordenados) - 1, max(0, int(round(p / 100.0 * (len(ordenados) - 1)))))
+    return ordenados[k]
+
+class AdaptiveLimiter:
+    def __init__(self, nome: str, inicial: float = HUBSOFT_LIMITE_INICIAL,
+                 minimo: float = HUBSOFT_LIMITE_MIN, maximo: float = HUBSOFT_LIMITE_MAX,
+                 tolerancia: float = HUBSOFT_LIMITE_TOLERANCIA, recuo: float = HUBSOFT_LIMITE_RECUO):
+        self.nome = nome
+        self.minimo = max(1.0, minimo)
+        self.maximo = max(self.minimo, maximo)
+        self.limite = min(self.maximo, max(self.minimo, inicial))
+        self.tolerancia = tolerancia
+        self.recuo = recuo
+        self.em_voo = 0
+        self._cond = asyncio.Condition()
+        self._latencias: Deque[float] = deque(maxlen=JANELA_LATENCIAS)
+        self._pausa_ate = 0.0
+        self._ultimo_recuo = 0.0
+        self.sucessos = 0
+        self.sobrecargas = 0
+        self.recuos = 0
+        self.espera_segundos = 0.0
+
+    def _baseline(self) -> Optional[float]:
+        if len(self._latencias) < 10:
+            return None
+        return _percentil(sorted(self._latencias), 10)
+
+    async def acquire(self) -> None:
+        t0 = time.monotonic()
+        async with self._cond:
+            while True:
+                pausa = self._pausa_ate - time.monotonic()
+                if pausa > 0:
+                    # Retry-After: ninguém sai até o prazo que a Hubsoft pediu
+                    try:
+                        await asyncio.wait_for(self._cond.wait(), timeout=pausa)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                if self.em_voo < int(self.limite):
+                    break
+                await self._cond.wait()
+            self.em_voo += 1
+        self.espera_segundos += time.monotonic() - t0
+
+    async def release(self, latencia: Optional[float], sobrecarga: bool,
+                      retry_after: Optional[float] = None) -> None:
+        async with self._cond:
+            self.em_voo -= 1
+            agora = time.monotonic()
+            if sobrecarga:
+                self.sobrecargas += 1
+                if retry_after:
+                    self._pausa_ate = max(self._pausa_ate, agora + retry_after)
+                # um recuo por "rodada": várias falhas simultâneas não derrubam o limite a zero
+                janela = _percentil(sorted(self._latencias), 50) or 1.0
+                if agora - self._ultimo_recuo >= janela:
+                    self.limite = max(self.minimo, self.limite * self.recuo)
+                    self._ultimo_recuo = agora
+                    self.recuos += 1
+            elif latencia is not None:
+                self.sucessos += 1
+                base = self._baseline()
+                self._latencias.append(latencia)
+                if base is None or latencia <= base * self.tolerancia:
+                    # aumento aditivo: ~+1 a cada "limite" respostas estáveis
+                    self.limite = min(self.maximo, self.limite + 1.0 / self.limite)
+                else:
+                    self.limite = max(self.minimo, self.limite - 0.5 / self.limite)
+            self._cond.notify_all()
+
+    def slot(self) -> "_Slot":
+        return _Slot(self)
+
+    def stats(self) -> Dict[str, Any]:
+        lat = sorted(self._latencias)
+        ms = lambda v: round(v * 1000, 1) if v is not None else None
+        return {
+            "limite": round(self.limite, 2),
+            "em_voo": self.em_voo,
+            "sucessos": self.sucessos,
+            "sobrecargas": self.sobrecargas,
+            "recuos": self.recuos,
+            "pausado_por": max(0.0, round(self._pausa_ate - time.monotonic(), 1)),
+            "espera_segundos": round(self.espera_segundos, 3),
+            "latencia_ms": {
+                "p50": ms(_percentil(lat, 50)),
+                "p90": ms(_percentil(lat, 90)),
+                "p99": ms(_percentil(lat, 99)),
+                "baseline": ms(self._baseline()),
+            },
+        }
+
+class _Slot:
+    # async with limiter.slot() as s: ...; s.resultado(status, retry_after)
+    def __init__(self, limiter: AdaptiveLimiter):
+        self.limiter = limiter
+        self.status: Optional[int] = None
+        self.retry_after: Optional[float] = None
+        self._t0 = 0.0
+
+    def resultado(self, status: int, retry_after: Optional[str] = None) -> None:
+        self.status = status
+        self.retry_after = parse_retry_after(retry_after)
+
+    async def __aenter__(self) -> "_Slot":
+        await self.limiter.acquire()
+        self._t0 = time.monotonic()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        latencia = time.monotonic() - self._t0
+        if exc_type is not None:
+            # timeouts/erros de conexão contam como sobrecarga; cancelamentos são neutros
+            sobrecarga = not issubclass(exc_type, asyncio.CancelledError)
+            await asyncio.shield(self.limiter.release(None, sobrecarga))
+            return
+        sobrecarga = self.status == 429 or (self.status is not None and self.status >= 500) \
+            or self.retry_after is not None
+        await self.limiter.release(None if sobrecarga else latencia, sobrecarga, self.retry_after)
+
+_limiters: Dict[str, AdaptiveLimiter] = {}
+
+def limiter_para(endpoint: str) -> AdaptiveLimiter:
+    chave = "/" + endpoint.strip("/")
+    lim = _limiters.get(chave)
+    if lim is None:
+        lim = _limiters[chave] = AdaptiveLimiter(chave)
+    return lim
+
+def limiter_stats() -> Dict[str, Any]:
+    return {k: v.stats() for k, v in _limiters.items()}
@@ -0,0 +1,102 @@
+import os
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+from hubsoft_auth import hubsoft_get
+
+TODOS_PATH = "/api/v1/integracao/ordem_servico/todos"
+HUBSOFT_PAGINAS_CONCORRENTES = int(os.getenv("HUBSOFT_PAGINAS_CONCORRENTES", "4"))
+
+FetchPage = Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]]
+
+def extrair_itens(data: Dict[str, Any]) -> List[dict]:
+    return data.get("ordens_servico") or data.get("dados") or data.get("itens") or []
+
+async def _fetch_todos(params: Dict[str, Any]) -> Dict[str, Any]:
+    return await hubsoft_get(TODOS_PATH, params=params)
+
+async def paginar_todos(
+    data_inicio: str,
+    data_fim: str,
+    itens_por_pagina: int = 100,
+    *,
+    fetch_page: Optional[FetchPage] = None,
+    concorrencia: int = HUBSOFT_PAGINAS_CONCORRENTES,
+    ordenado: bool = True,
+) -> AsyncIterator[Tuple[int, Dict[str, Any]]]:
+    # Percorre /todos: lê a página 0 e, com paginacao.ultima_pagina em mãos, busca as
+    # demais em paralelo (no máximo `concorrencia` em voo). Produz (pagina, resposta)
+    # na ordem das páginas ou conforme forem chegando (ordenado=False).
+    # Sem paginacao na resposta, busca janelas especulativas até achar uma página incompleta.
+    concorrencia = max(1, concorrencia)
+    fetch_page = fetch_page or _fetch_todos
+
+    def params(pagina: int) -> Dict[str, Any]:
+        return {
+            "pagina": pagina,
+            "itens_por_pagina": itens_por_pagina,
+            "data_inicio": data_inicio,
+            "data_fim": data_fim,
+        }
+
+    primeira = await fetch_page(params(0))
+    yield 0, primeira
+    itens0 = extrair_itens(primeira)
+    if not itens0:
+        return
+
+    pag = primeira.get("paginacao") or {}
+    ult = pag.get("ultima_pagina")
+    atual = pag.get("pagina_atual")
+    if ult is not None and atual is not None:
+        # pagina_atual pode vir deslocada (base 1): mantém o mesmo deslocamento
+        ultima: Optional[int] = int(ult) - int(atual)
+        if ultima <= 0:
+            return
+    else:
+        if len(itens0) < itens_por_pagina:
+            return
+        ultima = None  # desconhecida: especula até uma página vir incompleta
+    especulando = ultima is None
+
+    pendentes: Dict[int, asyncio.Task] = {}
+    proxima = 1
+
+    def lancar() -> None:
+        nonlocal proxima
+        while len(pendentes) < concorrencia and (ultima is None or proxima <= ultima):
+            pendentes[proxima] = asyncio.create_task(fetch_page(params(proxima)))
+            proxima += 1
+
+    def fim_detectado(pagina: int, data: Dict[str, Any]) -> None:
+        nonlocal ultima
+        if len(extrair_itens(data)) < itens_por_pagina:
+            # página incompleta: é a última; descarta o que foi especulado além dela
+            ultima = pagina
+            for p in [p for p in pendentes if p > pagina]:
+                pendentes.pop(p).cancel()
+
+    try:
+        lancar()
+        while pendentes:
+            if ordenado:
+                pagina = min(pendentes)
+                data = await pendentes.pop(pagina)
+                concluidas = [(pagina, data)]
+            else:
+                done, _ = await asyncio.wait(pendentes.values(), return_when=asyncio.FIRST_COMPLETED)
+                concluidas = []
+                for pagina in sorted(p for p, t in pendentes.items() if t in done):
+                    concluidas.append((pagina, pendentes.pop(pagina).result()))
+            for pagina, data in concluidas:
+                if ultima is not None and pagina > ultima:
+                    continue
+                if especulando:
+                    fim_detectado(pagina, data)
+                if extrair_itens(data):
+                    yield pagina, data
+            lancar()
+    finally:
+        for t in pendentes.values():
+            t.cancel()
+        if pendentes:
+            await asyncio.gather(*pendentes.values(), return_exceptions=True)
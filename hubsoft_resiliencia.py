@@ -0,0 +1,159 @@
+import os
+import time
+import random
+import asyncio
+from typing import Any, Dict, Optional
+
+# Política única de resiliência para as chamadas à Hubsoft:
+# backoff exponencial com jitter, orçamento de retries e circuit breaker.
+HUBSOFT_RETRY_TENTATIVAS = int(os.getenv("HUBSOFT_RETRY_TENTATIVAS", "4"))
+HUBSOFT_RETRY_BASE = float(os.getenv("HUBSOFT_RETRY_BASE", "0.5"))
+HUBSOFT_RETRY_TETO = float(os.getenv("HUBSOFT_RETRY_TETO", "20"))
+# cada requisição deposita essa fração de retry no orçamento (0.2 = no máx. 20% de retries)
+HUBSOFT_RETRY_ORCAMENTO = float(os.getenv("HUBSOFT_RETRY_ORCAMENTO", "0.2"))
+HUBSOFT_RETRY_ORCAMENTO_MAX = float(os.getenv("HUBSOFT_RETRY_ORCAMENTO_MAX", "30"))
+HUBSOFT_CIRCUITO_FALHAS = int(os.getenv("HUBSOFT_CIRCUITO_FALHAS", "8"))
+HUBSOFT_CIRCUITO_PAUSA = float(os.getenv("HUBSOFT_CIRCUITO_PAUSA", "15"))
+HUBSOFT_CIRCUITO_PAUSA_MAX = float(os.getenv("HUBSOFT_CIRCUITO_PAUSA_MAX", "300"))
+# quanto tempo um worker aceita ficar parado esperando o circuito fechar
+HUBSOFT_CIRCUITO_ESPERA_MAX = float(os.getenv("HUBSOFT_CIRCUITO_ESPERA_MAX", "600"))
+
+class CircuitoAberto(Exception):
+    pass
+
+class RetryPolicy:
+    def __init__(self, tentativas: int = HUBSOFT_RETRY_TENTATIVAS, base: float = HUBSOFT_RETRY_BASE,
+                 teto: float = HUBSOFT_RETRY_TETO):
+        self.tentativas = max(1, tentativas)
+        self.base = base
+        self.teto = teto
+
+    def espera(self, tentativa: int, retry_after: Optional[float] = None) -> float:
+        # "full jitter": uniforme entre 0 e o backoff exponencial da tentativa
+        atraso = random.uniform(0, min(self.teto, self.base * (2 ** (tentativa - 1))))
+        if retry_after:
+            atraso = max(atraso, min(retry_after, HUBSOFT_CIRCUITO_PAUSA_MAX))
+        return atraso
+
+class RetryBudget:
+    # Balde de fichas: retries só acontecem enquanto houver saldo, o que limita
+    # a amplificação de carga quando a Hubsoft inteira está com problema.
+    def __init__(self, proporcao: float = HUBSOFT_RETRY_ORCAMENTO, maximo: float = HUBSOFT_RETRY_ORCAMENTO_MAX):
+        self.proporcao = proporcao
+        self.maximo = maximo
+        self.saldo = maximo
+        self.negados = 0
+
+    def registrar_requisicao(self) -> None:
+        self.saldo = min(self.maximo, self.saldo + self.proporcao)
+
+    def pode_repetir(self) -> bool:
+        if self.saldo >= 1:
+            self.saldo -= 1
+            return True
+        self.negados += 1
+        return False
+
+class CircuitBreaker:
+    def __init__(self, limite_falhas: int = HUBSOFT_CIRCUITO_FALHAS, pausa: float = HUBSOFT_CIRCUITO_PAUSA,
+                 pausa_max: float = HUBSOFT_CIRCUITO_PAUSA_MAX):
+        self.limite_falhas = max(1, limite_falhas)
+        self.pausa_inicial = pausa
+        self.pausa_max = pausa_max
+        self.estado = "fechado"
+        self.falhas_seguidas = 0
+        self._pausa = pausa
+        self._aberto_ate = 0.0
+        self._sondando = False
+        self._evento: Optional[asyncio.Event] = None
+        self.aberturas = 0
+
+    def _event(self) -> asyncio.Event:
+        if self._evento is None:
+            self._evento = asyncio.Event()
+            self._evento.set()
+        return self._evento
+
+    async def aguardar(self, espera_max: float = HUBSOFT_CIRCUITO_ESPERA_MAX) -> bool:
+        # Aberto: segura o chamador até a pausa acabar. Depois disso só uma
+        # requisição de sondagem passa (meio aberto); as demais esperam o resultado.
+        limite = time.monotonic() + espera_max
+        while True:
+            agora = time.monotonic()
+            if self.estado == "fechado":
+                return False
+            if self.estado == "aberto" and agora >= self._aberto_ate:
+                self.estado = "meio_aberto"
+            if self.estado == "meio_aberto" and not self._sondando:
+                self._sondando = True
+                return True  # este chamador é a sondagem
+            restante = limite - agora
+            if restante <= 0:
+                raise CircuitoAberto("Hubsoft indisponível (circuito aberto)")
+            if self.estado == "aberto":
+                passo = min(restante, max(0.05, self._aberto_ate - agora))
+            else:
+                passo = min(restante, 1.0)  # sondagem em andamento
+            try:
+                await asyncio.wait_for(self._event().wait(), timeout=passo)
+            except asyncio.TimeoutError:
+                pass
+
+    def sucesso(self) -> None:
+        self.falhas_seguidas = 0
+        if self.estado != "fechado":
+            print("✅ [HUBSOFT] Circuito fechado: API respondendo de novo.")
+        self.estado = "fechado"
+        self._sondando = False
+        self._pausa = self.pausa_inicial
+        self._event().set()
+
+    def falha(self) -> None:
+        self.falhas_seguidas += 1
+        if self.estado == "meio_aberto":
+            self._sondando = False
+            self._pausa = min(self.pausa_max, self._pausa * 2)
+            self._abrir()
+        elif self.estado == "fechado" and self.falhas_seguidas >= self.limite_falhas:
+            self._abrir()
+
+    def cancelar_sondagem(self) -> None:
+        # a sondagem terminou sem resultado (ex.: cancelada): deixa outro chamador sondar
+        if self.estado == "meio_aberto":
+            self._sondando = False
+
+    def neutro(self) -> None:
+        # resposta que não diz nada sobre a saúde da API (ex.: 4xx): libera a sondagem
+        if self.estado == "meio_aberto":
+            self.sucesso()
+
+    def _abrir(self) -> None:
+        self.estado = "aberto"
+        self._aberto_ate = time.monotonic() + self._pausa
+        self.aberturas += 1
+        self._event().clear()
+        print(f"⛔ [HUBSOFT] Circuito aberto por {self._pausa:.0f}s após {self.falhas_seguidas} falha(s) seguidas.")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "estado": self.estado,
+            "falhas_seguidas": self.falhas_seguidas,
+            "aberturas": self.aberturas,
+            "reabre_em": max(0.0, round(self._aberto_ate - time.monotonic(), 1)) if self.estado == "aberto" else 0.0,
+        }
+
+politica = RetryPolicy()
+orcamento = RetryBudget()
+circuito = CircuitBreaker()
+_contadores = {"requisicoes": 0, "retries": 0, "falhas_definitivas": 0}
+
+def contar(chave: str) -> None:
+    _contadores[chave] += 1
+
+def resiliencia_stats() -> Dict[str, Any]:
+    return {
+        **_contadores,
+        "orcamento_saldo": round(orcamento.saldo, 2),
+        "orcamento_negados": orcamento.negados,
+        "circuito": circuito.stats(),
+    }
@@ -1,15 +1,37 @@
-from fastapi import FastAPI, HTTPException, Query, Depends, Body
+from fastapi import FastAPI, HTTPException, Query, Depends, Body, Request
 from fastapi.security import OAuth2PasswordRequestForm
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
 from pydantic import BaseModel, EmailStr, Field
 from functools import lru_cache
-from typing import Optional, List
-import httpx, logging, asyncio, re
-from scheduler import start_scheduler
-from hubsoft_auth import get_hubsoft_token, HUBSOFT_BASE_URL
+from typing import Optional, List, AsyncIterator
+import os, json, httpx, logging, asyncio, re, itertools, threading
+from scheduler import start_scheduler, sincronizar_incremental
+from sync_repository import list_watermarks
+from hubsoft_auth import hubsoft_get, hubsoft_post, start_token_refresher, stop_token_refresher
 from dotenv import load_dotenv
 from datetime import date, datetime
-from os_repository import upsert_ordens, list_ordens, get_ordem, list_concluidas_ontem
-from auth_backend import create_user, authenticate_user, create_access_token, get_current_user
+from os_repository import (map_item, upsert_ordens_async, contagem_vazia, somar_contagem, list_ordens, list_ordens_cursor, cache_contagem, nova_geracao, get_ordem,
+                           iterar_ordens, validar_colunas_export, EXPORT_DEFAULT, list_concluidas_ontem,
+                           registrar_falhas_import, limpar_falhas_import, list_falhas_import)
+from auth_backend import (create_user, authenticate_user, create_access_token, get_current_user,
+                          claims_usuario, change_password, user_cache_stats, require_admin, set_user_active)
+from senha_pool import senha_pool_stats, close_senha_pool
+from os_batcher import UpsertBatcher
+from hubsoft_paginacao import paginar_todos, extrair_itens, TODOS_PATH
+import hubsoft_client
+from hubsoft_limiter import limiter_stats, HUBSOFT_LIMITE_MAX
+from pipeline import Pipeline
+from db_mysql import pool_stats, close_pool, db_executor_stats, close_db_executor, run_db
+from db_schema import ensure_schema
+from hubsoft_resiliencia import resiliencia_stats
+from cliente_cache import cliente_cache
+from singleflight import singleflight_stats
+from cliente_busca import busca_cliente
+from relacoes_negociacao import negociador_relacoes
+from resposta_cache import resposta_cache
+from rollup_repository import DIMENSOES, relatorio_diario, reconstruir_intervalo
+from exportacao import exportar, reservar_vaga, export_stats
 
 load_dotenv()
 app = FastAPI()
@@ -29,19 +51,43 @@ def home():
     return {"status": "API Online"}
 
 @app.post("/auth/register", response_model=TokenOut)
-def register(payload: RegisterIn):
-    create_user(payload.name, payload.email, payload.password)
-    token = create_access_token({"sub": payload.email})
+async def register(payload: RegisterIn):
+    user_id = await create_user(payload.name, payload.email, payload.password)
+    token = create_access_token(claims_usuario({"id": user_id, "name": payload.name, "email": payload.email, "is_active": True}))
     return {"access_token": token, "token_type": "bearer"}
 
 @app.post("/auth/login", response_model=TokenOut)
-def login(form_data: OAuth2PasswordRequestForm = Depends()):
-    user = authenticate_user(form_data.username, form_data.password)
+async def login(form_data: OAuth2PasswordRequestForm = Depends()):
+    user = await authenticate_user(form_data.username, form_data.password)
     if not user:
         raise HTTPException(401, "Credenciais inválidas.")
-    token = create_access_token({"sub": user["email"]})
+    token = create_access_token(claims_usuario(user))
     return {"access_token": token, "token_type": "bearer"}
 
+class ChangePasswordIn(BaseModel):
+    senha_atual: str
+    nova_senha: str = Field(..., min_length=6)
+
+@app.post("/auth/senha")
+async def alterar_senha(payload: ChangePasswordIn, user: dict = Depends(get_current_user)):
+    if not await authenticate_user(user["email"], payload.senha_atual):
+        raise HTTPException(401, "Credenciais inválidas.")
+    # invalida o usuário em cache e os claims dos tokens já emitidos
+    await change_password(user["email"], payload.nova_senha)
+    token = create_access_token(claims_usuario(user))
+    return {"access_token": token, "token_type": "bearer"}
+
+class UserActiveIn(BaseModel):
+    email: EmailStr
+    ativo: bool
+
+@app.post("/auth/usuarios/ativo")
+async def alterar_usuario_ativo(payload: UserActiveIn, admin: dict = Depends(require_admin)):
+    # desativar derruba os tokens já emitidos do usuário
+    if not await run_db(set_user_active, payload.email, payload.ativo):
+        raise HTTPException(404, "Usuário não encontrado.")
+    return {"email": payload.email, "ativo": payload.ativo}
+
 
 # ===== Valida a data do filtro =====
 def _valida_data(s: str) -> None:
@@ -51,30 +97,18 @@ def _valida_data(s: str) -> None:
         raise HTTPException(422, f"Data inválida: {s}. Use YYYY-MM-DD")
 
 # ===== Validação do codigo cliente =====
+CLIENTE_PATH = "/api/v1/integracao/cliente"
+CONSULTAR_PATH = "/api/v1/integracao/ordem_servico/consultar"
+
 # realiza a extração do código do cliente na ordem e faz a comparação para puxar os dados do cliente
-async def _get_cliente_por_codigo(codigo: str, token: str) -> dict | None:
-    url_cli = f"{HUBSOFT_BASE_URL}/api/v1/integracao/cliente"
-    headers = {"Authorization": f"Bearer {token}"}
-    attempts = [
-        {"busca": "", "termo_busca": codigo, "limit": 5},
-        {"busca": "codigo_cliente", "termo_busca": codigo, "limit": 5},
-        {"busca": "codigo", "termo_busca": codigo, "limit": 5},
-    ]
-    async with httpx.AsyncClient(timeout=60) as c:
-        for params in attempts:
-            try:
-                r = await c.get(url_cli, headers=headers, params=params)
-                r.raise_for_status()
-                j = r.json() or {}
-                clientes = j.get("clientes") or []
-                print(f"[CLIENTE] tentativa params={params} retornou {len(clientes)} cliente(s)")
-                for cli in clientes:
-                    if str(cli.get("codigo_cliente")) == str(codigo):
-                        print(f"[CLIENTE] match exato codigo_cliente={codigo} -> id={cli.get('id_cliente')}")
-                        return cli
-            except Exception as e:
-                print(f"[CLIENTE] erro HTTP params={params} err={e}")
-    return None
+async def _consultar_clientes(params: dict, coalesce: bool = True) -> list:
+    j = await hubsoft_get(CLIENTE_PATH, params=params, coalesce=coalesce) or {}
+    return j.get("clientes") or []
+
+async def _get_cliente_por_codigo(codigo: str) -> dict | None:
+    # a ordem das formas de busca (busca="", "codigo_cliente", "codigo") é aprendida em cliente_busca
+    return await busca_cliente.buscar(codigo, _consultar_clientes)
+
 def _extrai_codigo_cliente(rotulo: str | None) -> str | None:
     if not rotulo: 
         return None
@@ -315,48 +349,40 @@ async def import_os(
     _valida_data(data_inicio)
     _valida_data(data_fim)
 
-    headers = {"Authorization": f"Bearer {await get_hubsoft_token()}"}
-    url = f"{HUBSOFT_BASE_URL}/api/v1/integracao/ordem_servico/todos"
     total_baixadas = 0
-    total_salvas = 0
+    contagem = contagem_vazia()
     ultima_paginacao = None
-    pagina = 0
-
-    async with httpx.AsyncClient(timeout=60) as c:
-        while True:
-            params = {
-                "pagina": pagina,
-                "itens_por_pagina": itens_por_pagina,
-                "data_inicio": data_inicio,
-                "data_fim": data_fim,
-            }
-            print(f"[IMPORT_OS] GET {url} params={params}")
-            r = await c.get(url, headers=headers, params=params)
-            if r.status_code != 200:
-                raise HTTPException(status_code=r.status_code, detail=r.text)
-            data = r.json()
-            lista = data.get("ordens_servico") or data.get("dados") or data.get("itens") or []
+    # a gravação da página anterior roda no executor do banco enquanto as próximas são baixadas
+    gravacao: Optional[asyncio.Task] = None
+
+    async def fetch_page(params: dict) -> dict:
+        print(f"[IMPORT_OS] GET {TODOS_PATH} params={params}")
+        try:
+            return await hubsoft_get(TODOS_PATH, params=params)
+        except httpx.HTTPStatusError as e:
+            raise HTTPException(status_code=e.response.status_code, detail=e.response.text)
+
+    try:
+        async for pagina, data in paginar_todos(data_inicio, data_fim, itens_por_pagina, fetch_page=fetch_page):
+            lista = extrair_itens(data)
             pag = data.get("paginacao") or {}
             ultima_paginacao = pag
-            print(f"[IMPORT_OS] status={data.get('status')} msg={data.get('msg')} pag={pag} itens={len(lista)}")
+            print(f"[IMPORT_OS] pagina={pagina} status={data.get('status')} msg={data.get('msg')} pag={pag} itens={len(lista)}")
             if not lista:
                 break
             total_baixadas += len(lista)
-            total_salvas += upsert_ordens(lista)
-            ult = pag.get("ultima_pagina")
-            atual = pag.get("pagina_atual")
-            if ult is not None and atual is not None:
-                if atual >= ult:
-                    break
-            else:
-                if len(lista) < itens_por_pagina:
-                    break
-            pagina += 1
+            if gravacao is not None:
+                somar_contagem(contagem, await gravacao)
+            gravacao = asyncio.create_task(upsert_ordens_async(lista))
+    finally:
+        if gravacao is not None:
+            somar_contagem(contagem, await gravacao)
     return {
         "status": "success",
         "intervalo": [data_inicio, data_fim],
         "total_baixadas": total_baixadas,
-        "total_salvas": total_salvas,
+        "total_salvas": contagem["inseridas"] + contagem["atualizadas"],
+        **contagem,
         "paginacao_ultima_resposta": ultima_paginacao,
     }
 
@@ -365,6 +391,156 @@ async def import_os(
 # ------------------------------
 DEFAULT_RELACOES = ["tecnicos", "motivos_fechamento", "cobrancas_disponiveis", "assinatura"]
 
+def _fala_de_relacoes(msg: str) -> bool:
+    # só uma mensagem sobre as relações conta como recusa do conjunto pedido
+    msg = (msg or "").lower()
+    return "relac" in msg or "relação" in msg
+
+# concorrência e tamanho de fila de cada estágio do pipeline do import detalhado;
+# os workers de /consultar são só o teto: quem dosa as chamadas é o limitador adaptativo
+IMPORT_WORKERS_CONSULTAR = int(os.getenv("IMPORT_WORKERS_CONSULTAR", str(int(HUBSOFT_LIMITE_MAX))))
+IMPORT_WORKERS_ENRIQUECER = int(os.getenv("IMPORT_WORKERS_ENRIQUECER", "4"))
+IMPORT_WORKERS_MAPEAR = int(os.getenv("IMPORT_WORKERS_MAPEAR", "1"))
+IMPORT_FILA_ESTAGIO = int(os.getenv("IMPORT_FILA_ESTAGIO", "200"))
+
+async def _executar_import_detalhado(numeros: AsyncIterator[str], relacoes: List[str]) -> dict:
+    # Pipeline: números -> /consultar -> enriquecimento -> map_item -> gravação em lote.
+    # O.S. que falham (após os retries da camada Hubsoft) vão para import_falhas.
+    # Um número só entra em sucesso quando o lote com a sua linha foi gravado.
+    falhas: List[dict] = []
+    sucesso: List[str] = []
+
+    async def consultar(num: str) -> List[dict]:
+        # ordem das tentativas vem da negociação memorizada (relacoes_negociacao)
+        plano = negociador_relacoes.plano(relacoes)
+        jd_ok = None
+        used_rels = None
+        ultimo_erro = None
+        try:
+            for rels in plano.candidatos:
+                try:
+                    payload = {"consulta": num}
+                    if rels:
+                        payload["relacoes"] = rels
+                    print(f"[CONSULTAR] POST {CONSULTAR_PATH} consulta={num} relacoes={rels}")
+                    jd = await hubsoft_post(CONSULTAR_PATH, json_body=payload)
+                    st = (jd.get("status") or "").strip().lower()
+                    msg = (jd.get("msg") or jd.get("mensagem") or "").lower()
+                    if st and st not in ("ok", "success", "sucesso") and _fala_de_relacoes(msg):
+                        print(f"[CONSULTAR] rejeitou relacoes={rels} num={num} msg={msg}")
+                        plano.recusou(rels)
+                        ultimo_erro = f"relacoes recusadas: {msg}"
+                        continue
+                    if st and st not in ("ok", "success", "sucesso"):
+                        print(f"[CONSULTAR] status={jd.get('status')} msg={jd.get('msg') or jd.get('mensagem')} num={num}")
+                        sucesso.append(num)
+                        return []
+                    plano.aceitou(rels)
+                    jd_ok = jd
+                    used_rels = rels
+                    break
+                except httpx.HTTPStatusError as e:
+                    if e.response.status_code >= 500 or e.response.status_code == 429:
+                        raise  # já passou pelos retries: é falha da Hubsoft, não das relações
+                    print(f"[CONSULTAR] ERRO HTTP num={num} relacoes={rels} err={e} body={e.response.text}")
+                    try:
+                        corpo = json.dumps(e.response.json(), ensure_ascii=False)  # acentos legíveis
+                    except ValueError:
+                        corpo = e.response.text
+                    if not _fala_de_relacoes(corpo):
+                        raise  # 404/422 desta O.S.: falha só ela, sem desaprender as relações
+                    ultimo_erro = f"HTTP {e.response.status_code}: {e.response.text[:300]}"
+                    plano.recusou(rels)
+        finally:
+            plano.fim()
+        if jd_ok is None:
+            raise RuntimeError(ultimo_erro or "nenhuma combinação de relações aceita")
+        dets = _extract_os_from_consultar(jd_ok)
+        if not dets:
+            # nada para gravar: a consulta em si é o resultado
+            sucesso.append(num)
+            print(f"[CONSULTAR] sem OS reconhecível num={num} relacoes={used_rels} keys={list(jd_ok.keys())}")
+        return dets
+
+    async def enriquecer(item: dict) -> List[dict]:
+        ass = (item.get("assinatura") or {})
+        v = ass.get("assinado")
+        item["assinatura_assinado"] = 1 if v is True else 0 if v is False else None
+        end = item.get("dados_endereco_instalacao") or {}
+        precisa_cliente = (_is_blank(item.get("dados_cliente")) or _is_blank(item.get("dados_servico")) or _any_missing_address(end))
+        if precisa_cliente:
+            rotulo = item.get("cliente")
+            codigo = _extrai_codigo_cliente(rotulo)
+            if codigo:
+                try:
+                    cli = await cliente_cache.get(codigo, _get_cliente_por_codigo)
+                except Exception as e:
+                    # sem os dados do cliente a O.S. ainda é gravada, só não é enriquecida
+                    print(f"[ENRIQUECER] ERRO buscando cliente codigo={codigo} err={e}")
+                    cli = None
+                if cli:
+                    print(f"[ENRIQUECER] OK codigo={codigo} nome='{cli.get('nome_razaosocial')}'")
+                    _enriquecer_os_com_cliente(item, cli, rotulo_cliente=rotulo)
+                else:
+                    print(f"[ENRIQUECER] NAO ENCONTRADO codigo={codigo} rotulo='{rotulo}'")
+            else:
+                print(f"[ENRIQUECER] sem codigo_cliente no rotulo='{rotulo}'")
+        _apply_address_fallbacks(item)
+        return [item]
+
+    async def mapear(item: dict) -> list:
+        return [(str(item.get("numero")), map_item(item))]
+
+    async def gravar(par) -> None:
+        # bloqueia quando o lote enche: a fila deste estágio enche e segura os anteriores
+        numero, row = par
+        await batcher.add_mapped([row], chaves=[numero])
+
+    def falhou_consulta(num, e: BaseException) -> None:
+        falhas.append({"numero": str(num), "erro": f"{type(e).__name__}: {e}"})
+
+    def falhou_item(item, e: BaseException) -> None:
+        if isinstance(item, dict) and item.get("numero") is not None:
+            falhas.append({"numero": str(item["numero"]), "erro": f"{type(e).__name__}: {e}"})
+
+    def falhou_gravacao(par, e: BaseException) -> None:
+        falhas.append({"numero": par[0], "erro": f"{type(e).__name__}: {e}"})
+
+    def lote_gravado(numeros_lote: List[str]) -> None:
+        sucesso.extend(numeros_lote)
+
+    def lote_falhou(numeros_lote: List[str], e: BaseException) -> None:
+        for n in numeros_lote:
+            falhas.append({"numero": n, "erro": f"gravação: {type(e).__name__}: {e}"})
+
+    # as gravações de todas as O.S. são agrupadas em INSERTs multi-valores
+    try:
+        async with UpsertBatcher(on_ok=lote_gravado, on_falha=lote_falhou) as batcher:
+            pipe = Pipeline("import_os_detalhado")
+            pipe.add_stage("consultar", consultar, IMPORT_WORKERS_CONSULTAR, IMPORT_FILA_ESTAGIO, on_erro=falhou_consulta)
+            pipe.add_stage("enriquecer", enriquecer, IMPORT_WORKERS_ENRIQUECER, IMPORT_FILA_ESTAGIO, on_erro=falhou_item)
+            pipe.add_stage("mapear", mapear, IMPORT_WORKERS_MAPEAR, IMPORT_FILA_ESTAGIO, on_erro=falhou_item)
+            pipe.add_stage("gravar", gravar, 1, IMPORT_FILA_ESTAGIO, on_erro=falhou_gravacao)
+            await pipe.run(numeros)
+    finally:
+        # mesmo se a origem (/todos) estourar no meio: o que já falhou ou já foi gravado
+        # fica registrado antes de o erro subir
+        numeros_falhos = {f["numero"] for f in falhas}
+        await run_db(limpar_falhas_import, [n for n in sucesso if n not in numeros_falhos])
+        await run_db(registrar_falhas_import, falhas)
+    return {
+        "total_numeros_encontrados": pipe.origem,
+        "total_baixadas": pipe.stages[0].saida,
+        "total_salvas": batcher.total_gravadas,
+        "inseridas": batcher.contagem["inseridas"],
+        "atualizadas": batcher.contagem["atualizadas"],
+        "inalteradas": batcher.contagem["inalteradas"],
+        "dias_rollup_pendentes": batcher.contagem["dias_rollup_pendentes"],
+        "gravacao": batcher.resumo(),
+        "pipeline": pipe.stats(),
+        "falhas": {"total": len(falhas), "itens": falhas},
+    }
+
 @app.post("/import_os_detalhado")
 async def import_os_detalhado(
     data_inicio: str = Query(..., description="YYYY-MM-DD"),
@@ -376,178 +552,301 @@ async def import_os_detalhado(
     _valida_data(data_inicio)
     _valida_data(data_fim)
 
-    token = await get_hubsoft_token()
-    headers = {"Authorization": f"Bearer {token}"}
-    url_todos = f"{HUBSOFT_BASE_URL}/api/v1/integracao/ordem_servico/todos"
-    url_consultar = f"{HUBSOFT_BASE_URL}/api/v1/integracao/ordem_servico/consultar"
-    numeros: List[str] = []
     relacoes = _sanitize_relacoes(relacoes)
-    pagina = 0
-    cliente_cache: dict[str, dict] = {}
-    limits = httpx.Limits(max_keepalive_connections=20, max_connections=50)
-    async with httpx.AsyncClient(timeout=60, limits=limits) as c:
-        while True:
-            params = {
-                "pagina": pagina,
-                "itens_por_pagina": itens_por_pagina,
-                "data_inicio": data_inicio,
-                "data_fim": data_fim,
-            }
-            print(f"[TODOS] GET {url_todos} params={params}")
-            r = await c.get(url_todos, headers=headers, params=params)
-            r.raise_for_status()
-            j = r.json()
-            itens = j.get("ordens_servico") or j.get("dados") or j.get("itens") or []
+
+    # origem: números das O.S. conforme as páginas de /todos chegam
+    async def listar_numeros():
+        async for pagina, j in paginar_todos(data_inicio, data_fim, itens_por_pagina, ordenado=False):
+            itens = extrair_itens(j)
             print(f"[TODOS] pagina={pagina} itens={len(itens)} paginacao={j.get('paginacao')}")
-            if not itens:
-                break
             for it in itens:
                 num = it.get("numero")
                 if num is not None:
-                    numeros.append(str(num))
-            pag = j.get("paginacao") or {}
-            ult = pag.get("ultima_pagina")
-            atual = pag.get("pagina_atual")
-            if ult is not None and atual is not None:
-                if atual >= ult:
-                    break
-            else:
-                if len(itens) < itens_por_pagina:
-                    break
-            pagina += 1
-        if not numeros:
-            return {
-                "status": "success",
-                "intervalo": [data_inicio, data_fim],
-                "mensagem": "Nenhuma O.S. listada no período via /todos.",
-                "total_baixadas": 0,
-                "total_salvas": 0,
-                "relacoes_usadas": relacoes,
-            }
-        total_baixadas = 0
-        sem = asyncio.Semaphore(6)
-        async def fetch_and_upsert(num: str) -> int:
-            nonlocal total_baixadas
-            rels_candidates = [
-                relacoes,
-                [r for r in relacoes if r != "assinatura"],
-                [r for r in relacoes if r != "atendimento"],
-                [r for r in relacoes if r in ("tecnicos", "motivos_fechamento", "cobrancas_disponiveis")],
-                [],
-            ]
-            async with sem:
-                jd_ok = None
-                used_rels = None
-                for rels in rels_candidates:
-                    try:
-                        payload = {"consulta": num}
-                        if rels:
-                            payload["relacoes"] = rels
-                        print(f"[CONSULTAR] POST {url_consultar} consulta={num} relacoes={rels}")
-                        r2 = await c.post(url_consultar, headers=headers, json=payload)
-                        r2.raise_for_status()
-                        jd = r2.json()
-                        st = (jd.get("status") or "").strip().lower()
-                        msg = (jd.get("msg") or jd.get("mensagem") or "").lower()
-                        if st and st not in ("ok", "success", "sucesso") and ("relac" in msg or "relação" in msg):
-                            print(f"[CONSULTAR] rejeitou relacoes={rels} num={num} msg={msg}")
-                            continue
-                        if st and st not in ("ok", "success", "sucesso"):
-                            print(f"[CONSULTAR] status={jd.get('status')} msg={jd.get('msg') or jd.get('mensagem')} num={num}")
-                            return 0
-                        jd_ok = jd
-                        used_rels = rels
-                        break
-                    except Exception as e:
-                        body = None
-                        try:
-                            body = r2.text
-                        except Exception:
-                            pass
-                        print(f"[CONSULTAR] ERRO HTTP num={num} relacoes={rels} err={e} body={body}")
-                if jd_ok is None:
-                    return 0
-                dets = _extract_os_from_consultar(jd_ok)
-                if not dets:
-                    print(f"[CONSULTAR] sem OS reconhecível num={num} relacoes={used_rels} keys={list(jd_ok.keys())}")
-                    return 0
-                for item in dets:
-                    ass = (item.get("assinatura") or {})
-                    v = ass.get("assinado")
-                    item["assinatura_assinado"] = 1 if v is True else 0 if v is False else None
-                    end = item.get("dados_endereco_instalacao") or {}
-                    precisa_cliente = (_is_blank(item.get("dados_cliente")) or _is_blank(item.get("dados_servico")) or _any_missing_address(end))
-                    if precisa_cliente:
-                        rotulo = item.get("cliente")
-                        codigo = _extrai_codigo_cliente(rotulo)
-                        if codigo:
-                            if codigo not in cliente_cache:
-                                cliente_cache[codigo] = await _get_cliente_por_codigo(codigo, token)
-                            cli = cliente_cache[codigo]
-                            if cli:
-                                print(f"[ENRIQUECER] OK codigo={codigo} nome='{cli.get('nome_razaosocial')}'")
-                                _enriquecer_os_com_cliente(item, cli, rotulo_cliente=rotulo)
-                            else:
-                                print(f"[ENRIQUECER] NAO ENCONTRADO codigo={codigo} rotulo='{rotulo}'")
-                        else:
-                            print(f"[ENRIQUECER] sem codigo_cliente no rotulo='{rotulo}'")
-                    _apply_address_fallbacks(item)
-                n = len(dets)
-                total_baixadas += n
-                return upsert_ordens(dets) if n else 0
-        saved_counts = await asyncio.gather(*(fetch_and_upsert(n) for n in numeros))
-        total_salvas = sum(saved_counts)
+                    yield str(num)
+
+    res = await _executar_import_detalhado(listar_numeros(), relacoes)
+    if not res["total_numeros_encontrados"]:
+        return {
+            "status": "success",
+            "intervalo": [data_inicio, data_fim],
+            "mensagem": "Nenhuma O.S. listada no período via /todos.",
+            "total_baixadas": 0,
+            "total_salvas": 0,
+            "relacoes_usadas": relacoes,
+        }
     return {
         "status": "success",
         "intervalo": [data_inicio, data_fim],
-        "total_numeros_encontrados": len(numeros),
-        "total_baixadas": total_baixadas,
-        "total_salvas": total_salvas,
+        **res,
         "relacoes_usadas": relacoes,
     }
 
+@app.post("/import_os_detalhado/reprocessar_falhas")
+async def import_os_reprocessar_falhas(
+    limite: int = Query(500, ge=1, le=5000),
+    relacoes: List[str] = Body(DEFAULT_RELACOES, embed=True, description="Relacionamentos extras para /consultar"),
+    user: dict = Depends(get_current_user),
+):
+    relacoes = _sanitize_relacoes(relacoes)
+    pendentes = await run_db(list_falhas_import, limite)
+
+    async def numeros_pendentes():
+        for f in pendentes:
+            yield str(f["numero"])
+
+    res = await _executar_import_detalhado(numeros_pendentes(), relacoes)
+    return {
+        "status": "success",
+        "reprocessadas": len(pendentes),
+        **res,
+        "relacoes_usadas": relacoes,
+    }
+
+@app.post("/sync/incremental")
+async def sync_incremental(
+    itens_por_pagina: int = 200,
+    user: dict = Depends(get_current_user),
+):
+    # mesma rotina do job do scheduler: só a janela desde a última marca d'água
+    try:
+        return await sincronizar_incremental(itens_por_pagina=itens_por_pagina)
+    except httpx.HTTPStatusError as e:
+        raise HTTPException(status_code=e.response.status_code, detail=e.response.text)
+
+@app.get("/api/sync/watermarks")
+def api_sync_watermarks():
+    itens = list_watermarks()
+    return {"total": len(itens), "items": itens}
+
+@app.get("/api/import/falhas")
+def api_falhas_import(limite: int = Query(500, ge=1, le=5000)):
+    itens = list_falhas_import(limite)
+    return {"total": len(itens), "items": itens}
+
 # ------------------------------
 # APIs de consulta ao banco
 # ------------------------------
 @app.get("/api/ordens")
 def api_listar_ordens(
-    status: Optional[str] = Query(None, description="Filtro por status (parcial, ex.: 'Finaliz')"),
+    request: Request,
+    status: Optional[str] = Query(None, description="Filtro por status (prefixo, ex.: 'Finaliz')"),
     q: Optional[str] = Query(None, description="Busca por número/tipo/cliente/cidade"),
     data_inicio: Optional[str] = Query(None, description="YYYY-MM-DD"),
     data_fim: Optional[str] = Query(None, description="YYYY-MM-DD"),
     page: int = 1,
-    page_size: int = 50
+    page_size: int = 50,
+    cursor: Optional[str] = Query(None, description="next_cursor da página anterior (paginação por cursor)"),
+    paginacao: str = Query("page", pattern="^(page|cursor)$", description="page (page/total) ou cursor (next_cursor)"),
+    total: str = Query("exact", pattern="^(exact|estimate|none)$", description="exact, estimate (aproximado) ou none"),
 ):
     if page < 1: page = 1
     if page_size < 1 or page_size > 500: page_size = 50
+    params = {"status": status, "q": q, "data_inicio": data_inicio, "data_fim": data_fim, "page": page,
+              "page_size": page_size, "cursor": cursor, "paginacao": paginacao, "total": total}
+    # respostas de leitura passam pelo cache com ETag (invalidado pela geração das O.S.)
+    return resposta_cache.responder(request, "ordens", params,
+                                    lambda: _listar_ordens(status, q, data_inicio, data_fim, page, page_size,
+                                                           cursor, paginacao, total))
+
+def _listar_ordens(status, q, data_inicio, data_fim, page, page_size, cursor, paginacao, total):
+    if cursor is not None or paginacao == "cursor":
+        # sem OFFSET nem COUNT: custo constante em qualquer profundidade
+        try:
+            res = list_ordens_cursor(status, q, data_inicio, data_fim, page_size, cursor)
+        except ValueError as e:
+            raise HTTPException(400, str(e))
+        return {
+            "items": res["items"],
+            "page_size": page_size,
+            "next_cursor": res["next_cursor"],
+        }
     offset = (page - 1) * page_size
-    res = list_ordens(status, q, data_inicio, data_fim, page_size, offset)
+    res = list_ordens(status, q, data_inicio, data_fim, page_size, offset, total)
     return {
         "items": res["items"],
         "page": page,
         "page_size": page_size,
         "total": res["total"],
-        "total_pages": (res["total"] + page_size - 1) // page_size
+        "total_tipo": total,
+        "total_pages": (res["total"] + page_size - 1) // page_size if res["total"] is not None else None
     }
 
+@app.get("/api/ordens/export")
+def api_exportar_ordens(
+    status: Optional[str] = Query(None, description="Filtro por status (prefixo, ex.: 'Finaliz')"),
+    q: Optional[str] = Query(None, description="Busca por número/tipo/cliente/cidade"),
+    data_inicio: Optional[str] = Query(None, description="YYYY-MM-DD"),
+    data_fim: Optional[str] = Query(None, description="YYYY-MM-DD"),
+    formato: str = Query("csv", pattern="^(csv|ndjson)$"),
+    colunas: Optional[str] = Query(None, description="Colunas separadas por vírgula (padrão: as da listagem)"),
+    gzip: bool = Query(False, description="Entrega o arquivo compactado (.gz)"),
+):
+    # Exporta tudo que casa com os filtros em streaming: sem page_size, COUNT nem OFFSET,
+    # com memória constante (cursor sem buffer no banco, pedaços de 64 KB na resposta).
+    cols = [c.strip() for c in colunas.split(",") if c.strip()] if colunas else EXPORT_DEFAULT
+    try:
+        validar_colunas_export(cols)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    vaga = reservar_vaga()
+    if vaga is None:
+        raise HTTPException(503, "Muitas exportações em andamento; tente de novo em instantes.",
+                            headers={"Retry-After": "30"})
+    parar = threading.Event()
+    linhas = iterar_ordens(status, q, data_inicio, data_fim, cols, parar=parar)
+    try:
+        # a primeira linha é lida aqui: erro de banco ainda vira status HTTP, não um arquivo cortado
+        primeira = next(linhas, None)
+    except BaseException:
+        vaga.liberar()
+        raise
+    fonte = itertools.chain([primeira], linhas) if primeira is not None else iter(())
+    trava = threading.Lock()
+    iniciado = [False]
+
+    def corpo():
+        with trava:
+            if parar.is_set():
+                return  # cliente saiu antes do stream começar: encerrar() já fechou tudo
+            iniciado[0] = True
+        try:
+            yield from exportar(formato, cols, fonte, gzip=gzip)
+        finally:
+            # mesma thread que lê o cursor: fechar aqui é seguro
+            linhas.close()
+            vaga.liberar()
+
+    def encerrar():
+        # background da resposta (roda sempre, inclusive com desconexão): não mexe no
+        # gerador de outra thread, só sinaliza; iterar_ordens para na próxima linha
+        parar.set()
+        with trava:
+            fechar = not iniciado[0]
+        if fechar:
+            linhas.close()
+            vaga.liberar()
+
+    nome = f"ordens.{'csv' if formato == 'csv' else 'ndjson'}"
+    media = "text/csv; charset=utf-8" if formato == "csv" else "application/x-ndjson"
+    if gzip:
+        nome += ".gz"
+        media = "application/gzip"
+    return StreamingResponse(
+        corpo(),
+        media_type=media,
+        headers={"Content-Disposition": f'attachment; filename="{nome}"'},
+        # se o stream nem começar (cliente saiu antes), a vaga e a conexão são soltas aqui
+        background=BackgroundTask(encerrar),
+    )
+
 @app.get("/api/ordens/{id_os}")
-def api_ordem_detalhe(id_os: int):
-    row = get_ordem(id_os)
-    if not row:
-        raise HTTPException(404, "O.S. não encontrada")
-    return row
+def api_ordem_detalhe(request: Request, id_os: int,
+                      incluir_raw: bool = Query(False, description="Inclui o JSON bruto da Hubsoft")):
+    def produzir():
+        row = get_ordem(id_os, incluir_raw)
+        if not row:
+            raise HTTPException(404, "O.S. não encontrada")
+        return row
+    return resposta_cache.responder(request, "ordem", {"id_os": id_os, "incluir_raw": incluir_raw}, produzir)
 
 @app.get("/api/relatorios/concluidas-ontem")
-def api_concluidas_ontem():
-    itens = list_concluidas_ontem()
+def api_concluidas_ontem(request: Request):
+    def produzir():
+        itens = list_concluidas_ontem()
+        return {
+            "data_referencia": str(date.today()),
+            "total": len(itens),
+            "items": itens
+        }
+    # "ontem" muda à meia-noite mesmo sem import: a data entra na chave
+    return resposta_cache.responder(request, "concluidas_ontem", {"dia": str(date.today())}, produzir)
+
+@app.get("/api/relatorios/diario")
+def api_relatorio_diario(
+    request: Request,
+    data_inicio: str = Query(..., description="YYYY-MM-DD"),
+    data_fim: str = Query(..., description="YYYY-MM-DD"),
+    agrupar: List[str] = Query([], description="status, cidade, tecnico e/ou tipo"),
+    status: Optional[str] = Query(None, description="Filtro por status (prefixo, ex.: 'Finaliz')"),
+):
+    # lê só ordens_rollup_diario (mantida pelo upsert), nunca ordens_servico
+    _valida_data(data_inicio)
+    _valida_data(data_fim)
+    dims = []
+    for d in agrupar:
+        for parte in d.split(","):
+            parte = parte.strip().lower()
+            if not parte:
+                continue
+            if parte not in DIMENSOES:
+                raise HTTPException(422, f"Agrupamento inválido: {parte}. Use {', '.join(DIMENSOES)}")
+            if parte not in dims:
+                dims.append(parte)
+    di = datetime.strptime(data_inicio, "%Y-%m-%d").date()
+    df = datetime.strptime(data_fim, "%Y-%m-%d").date()
+
+    def produzir():
+        itens = relatorio_diario(di, df, dims, status)
+        return {
+            "intervalo": [data_inicio, data_fim],
+            "agrupar": dims,
+            "total": sum(i["total"] for i in itens),
+            "items": itens,
+        }
+    params = {"data_inicio": data_inicio, "data_fim": data_fim, "agrupar": dims, "status": status}
+    return resposta_cache.responder(request, "relatorio_diario", params, produzir)
+
+@app.post("/api/relatorios/rollups/reconstruir")
+async def api_reconstruir_rollups(
+    data_inicio: str = Query(..., description="YYYY-MM-DD"),
+    data_fim: str = Query(..., description="YYYY-MM-DD"),
+    user: dict = Depends(get_current_user),
+):
+    _valida_data(data_inicio)
+    _valida_data(data_fim)
+    di = datetime.strptime(data_inicio, "%Y-%m-%d").date()
+    df = datetime.strptime(data_fim, "%Y-%m-%d").date()
+    if df < di:
+        raise HTTPException(422, "data_fim anterior a data_inicio")
+    dias = await run_db(reconstruir_intervalo, di, df)
+    nova_geracao()  # respostas em cache dos relatórios deixam de valer
+    return {"status": "success", "intervalo": [data_inicio, data_fim], "dias_reconstruidos": dias}
+
+# ------------------------------
+# Métricas internas
+# ------------------------------
+@app.get("/api/metricas")
+def api_metricas(user: dict = Depends(get_current_user)):
     return {
-        "data_referencia": str(date.today()),
-        "total": len(itens),
-        "items": itens
+        "mysql_pool": pool_stats(),
+        "mysql_executor": db_executor_stats(),
+        "hubsoft_http": hubsoft_client.client_stats(),
+        "hubsoft_limites": limiter_stats(),
+        "hubsoft_resiliencia": resiliencia_stats(),
+        "cliente_cache": cliente_cache.stats(),
+        "singleflight": singleflight_stats(),
+        "cliente_busca": busca_cliente.stats(),
+        "relacoes": negociador_relacoes.stats(),
+        "contagem_ordens": cache_contagem.stats(),
+        "resposta_cache": resposta_cache.stats(),
+        "usuarios_cache": user_cache_stats(),
+        "exportacoes": export_stats(),
+        "senha_pool": senha_pool_stats(),
     }
 
 logging.basicConfig(level=logging.INFO)
 
 @app.on_event("startup")
 async def on_startup():
+    await run_db(ensure_schema)
+    await hubsoft_client.startup()
+    start_token_refresher()
     start_scheduler()
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    await stop_token_refresher()
+    await hubsoft_client.shutdown()
+    close_senha_pool()
+    close_db_executor()
+    close_pool()
@@ -0,0 +1,112 @@
+import sys
+import json
+import time
+import argparse
+from dotenv import load_dotenv
+from db_mysql import get_conn, close_pool
+from db_schema import ensure_schema
+from os_raw import gravar_raws
+from os_repository import conteudo_hash
+
+# Move o JSON bruto de ordens_servico.raw para ordens_servico_raw (comprimido),
+# em lotes por id_ordem_servico. Pode ser interrompido e rodado de novo: só
+# pega linhas que ainda têm raw.
+#   python migrar_raw.py --lote 500
+#   python migrar_raw.py --limpar-orfaos
+
+load_dotenv()
+
+def migrar_lote(ultimo_id, lote: int):
+    conn = get_conn()
+    try:
+        cur = conn.cursor(dictionary=True)
+        cur.execute("""
+          SELECT id_ordem_servico, raw FROM ordens_servico
+          WHERE raw IS NOT NULL AND id_ordem_servico > %s
+          ORDER BY id_ordem_servico
+          LIMIT %s
+        """, (ultimo_id, lote))
+        linhas = cur.fetchall()
+        if not linhas:
+            return None, 0, 0
+        pares = []
+        atualizacoes = []
+        bytes_json = 0
+        for row in linhas:
+            texto = row["raw"]
+            if isinstance(texto, (bytes, bytearray)):
+                texto = texto.decode("utf-8")
+            try:
+                h = conteudo_hash(json.loads(texto))
+            except Exception as e:
+                # JSON inválido fica onde está; não vale perder o dado
+                print(f"[MIGRAR_RAW] id={row['id_ordem_servico']} raw ilegível, mantido: {e}")
+                continue
+            pares.append((h, texto))
+            atualizacoes.append((h, row["id_ordem_servico"]))
+            bytes_json += len(texto)
+        cur = conn.cursor()
+        gravar_raws(cur, pares)
+        cur.executemany(
+            "UPDATE ordens_servico SET conteudo_hash = %s, raw = NULL WHERE id_ordem_servico = %s",
+            atualizacoes,
+        )
+        conn.commit()
+        return linhas[-1]["id_ordem_servico"], len(atualizacoes), bytes_json
+    finally:
+        conn.close()
+
+def limpar_orfaos(lote: int) -> int:
+    total = 0
+    while True:
+        conn = get_conn()
+        try:
+            cur = conn.cursor()
+            cur.execute("""
+              DELETE r FROM ordens_servico_raw r
+              JOIN (
+                SELECT r2.conteudo_hash FROM ordens_servico_raw r2
+                LEFT JOIN ordens_servico o ON o.conteudo_hash = r2.conteudo_hash
+                WHERE o.conteudo_hash IS NULL
+                LIMIT %s
+              ) orfaos ON orfaos.conteudo_hash = r.conteudo_hash
+            """, (lote,))
+            apagadas = cur.rowcount
+            conn.commit()
+        finally:
+            conn.close()
+        total += apagadas
+        if apagadas < lote:
+            return total
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="Migra ordens_servico.raw para ordens_servico_raw (comprimido).")
+    ap.add_argument("--lote", type=int, default=500, help="linhas por transação")
+    ap.add_argument("--pausa", type=float, default=0.0, help="segundos entre lotes (alivia a replicação)")
+    ap.add_argument("--limpar-orfaos", action="store_true", help="apaga payloads sem nenhuma O.S. apontando")
+    args = ap.parse_args(argv)
+
+    ensure_schema()
+    try:
+        if args.limpar_orfaos:
+            print(f"[MIGRAR_RAW] payloads órfãos apagados: {limpar_orfaos(args.lote)}")
+            return 0
+        ultimo_id, total, total_bytes, t0 = 0, 0, 0, time.monotonic()
+        while True:
+            ultimo_id_lote, n, b = migrar_lote(ultimo_id, args.lote)
+            if ultimo_id_lote is None:
+                break
+            ultimo_id = ultimo_id_lote
+            total += n
+            total_bytes += b
+            print(f"[MIGRAR_RAW] até id={ultimo_id}: {total} linha(s), {total_bytes / 1e6:.1f} MB de JSON "
+                  f"em {time.monotonic() - t0:.0f}s")
+            if args.pausa:
+                time.sleep(args.pausa)
+        print(f"[MIGRAR_RAW] concluído: {total} linha(s) migradas.")
+        return 0
+    finally:
+        close_pool()
+
+if __name__ == "__main__":
+    sys.exit(main())
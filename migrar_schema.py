@@ -0,0 +1,42 @@
+import sys
+import time
+import argparse
+from dotenv import load_dotenv
+from db_mysql import get_conn, close_pool
+from db_schema import aplicar_migracoes, colunas_pendentes, indices_pendentes
+
+# Aplica as colunas e índices novos de ordens_servico e users (db_schema.COLUNAS/INDICES).
+# Cada ALTER pode reescrever a tabela inteira: rode numa janela de manutenção,
+# antes de subir a versão nova da API. Rodar de novo não refaz o que já existe.
+#   python migrar_schema.py
+#   python migrar_schema.py --verificar
+
+load_dotenv()
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="Aplica as migrações de schema de ordens_servico e users.")
+    ap.add_argument("--verificar", action="store_true", help="só lista o que falta, sem alterar nada")
+    args = ap.parse_args(argv)
+
+    try:
+        if args.verificar:
+            conn = get_conn()
+            try:
+                cur = conn.cursor()
+                pendentes = colunas_pendentes(cur) + indices_pendentes(cur)
+            finally:
+                conn.close()
+            print(f"[MIGRAR_SCHEMA] pendentes: {', '.join(pendentes) or 'nenhuma'}")
+            return 1 if pendentes else 0
+        t0 = time.monotonic()
+        feitas, falhas = aplicar_migracoes()
+        print(f"[MIGRAR_SCHEMA] concluído em {time.monotonic() - t0:.0f}s: {', '.join(feitas) or 'nada a fazer'}")
+        if falhas:
+            print(f"[MIGRAR_SCHEMA] não criados: {', '.join(falhas)}")
+            return 1
+        return 0
+    finally:
+        close_pool()
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,128 @@
+import os
+import time
+import asyncio
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from db_mysql import run_db
+from os_repository import map_item, upsert_mapped, contagem_vazia, somar_contagem
+
+IMPORT_BATCH_LINHAS = int(os.getenv("IMPORT_BATCH_LINHAS", "500"))
+IMPORT_BATCH_JANELA = float(os.getenv("IMPORT_BATCH_JANELA", "2.0"))
+
+# callbacks por lote: recebem as chaves (ex.: número da O.S.) das linhas do lote
+OkFn = Callable[[List[Any]], None]
+FalhaFn = Callable[[List[Any], BaseException], None]
+
+class UpsertBatcher:
+    # Write-behind: acumula linhas mapeadas de várias tarefas e grava em lote
+    # quando atinge max_linhas ou quando a linha mais antiga passa de janela_segundos.
+    # Com on_falha, um lote que falha é entregue a ele (com as chaves das linhas) em
+    # vez de subir como exceção; sem on_falha o erro sobe no add()/close().
+    def __init__(self, max_linhas: int = IMPORT_BATCH_LINHAS, janela_segundos: float = IMPORT_BATCH_JANELA,
+                 on_ok: Optional[OkFn] = None, on_falha: Optional[FalhaFn] = None):
+        self.max_linhas = max(1, max_linhas)
+        self.janela_segundos = janela_segundos
+        self.on_ok = on_ok
+        self.on_falha = on_falha
+        self._buffer: List[Tuple] = []
+        self._chaves: List[Any] = []
+        self._primeira_em: Optional[float] = None
+        self._flush_lock = asyncio.Lock()
+        self._timer: Optional[asyncio.Task] = None
+        self._erro: Optional[BaseException] = None
+        self.flushes: List[Dict[str, Any]] = []
+        self.total_linhas = 0
+        self.contagem = contagem_vazia()
+        self.linhas_com_erro = 0
+
+    async def __aenter__(self) -> "UpsertBatcher":
+        self._timer = asyncio.create_task(self._tick())
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        await self.close()
+
+    async def add(self, items: Iterable[Dict[str, Any]]) -> int:
+        return await self.add_mapped([map_item(x) for x in items])
+
+    async def add_mapped(self, rows: List[Tuple], chaves: Optional[List[Any]] = None) -> int:
+        if rows:
+            if not self._buffer:
+                self._primeira_em = time.monotonic()
+            self._buffer.extend(rows)
+            self._chaves.extend(chaves if chaves is not None else [None] * len(rows))
+        # erro de um flush do timer sobe só depois de as linhas deste chamador estarem no buffer
+        self._raise_pending()
+        if not rows:
+            return 0
+        if len(self._buffer) >= self.max_linhas:
+            # quem enche o buffer espera o flush: é a contrapressão sobre os produtores
+            await self.flush()
+        return len(rows)
+
+    async def flush(self) -> None:
+        async with self._flush_lock:
+            if not self._buffer:
+                return
+            lote, self._buffer = self._buffer, []
+            chaves, self._chaves = self._chaves, []
+            self._primeira_em = None
+            t0 = time.monotonic()
+            try:
+                contagem = await run_db(upsert_mapped, lote)
+            except Exception as e:
+                self.linhas_com_erro += len(lote)
+                print(f"[BATCH] ERRO ao gravar lote de {len(lote)} linha(s): {e}")
+                if self.on_falha is None:
+                    raise
+                self.on_falha([c for c in chaves if c is not None], e)
+                return
+            dt = time.monotonic() - t0
+            self.total_linhas += len(lote)
+            somar_contagem(self.contagem, contagem)
+            self.flushes.append({"linhas": len(lote), **contagem, "segundos": round(dt, 3)})
+            if self.on_ok is not None:
+                self.on_ok([c for c in chaves if c is not None])
+            print(f"[BATCH] flush #{len(self.flushes)} linhas={len(lote)} inseridas={contagem['inseridas']} "
+                  f"atualizadas={contagem['atualizadas']} inalteradas={contagem['inalteradas']} em {dt:.2f}s")
+
+    async def _tick(self) -> None:
+        while True:
+            await asyncio.sleep(max(self.janela_segundos / 4, 0.05))
+            if self._primeira_em is None:
+                continue
+            if time.monotonic() - self._primeira_em >= self.janela_segundos:
+                try:
+                    await self.flush()
+                except Exception as e:
+                    # entregue ao próximo add()/close()
+                    self._erro = e
+
+    def _raise_pending(self) -> None:
+        if self._erro is not None:
+            e, self._erro = self._erro, None
+            raise e
+
+    async def close(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            try:
+                await self._timer
+            except asyncio.CancelledError:
+                pass
+            self._timer = None
+        await self.flush()
+        self._raise_pending()
+
+    @property
+    def total_gravadas(self) -> int:
+        # inalteradas não chegam ao banco
+        return self.contagem["inseridas"] + self.contagem["atualizadas"]
+
+    def resumo(self) -> Dict[str, Any]:
+        return {
+            "flushes": len(self.flushes),
+            "linhas": self.total_linhas,
+            **self.contagem,
+            "linhas_com_erro": self.linhas_com_erro,
+            "por_flush": self.flushes,
+        }
@@ -0,0 +1,62 @@
+import os
+import json
+import zlib
+from typing import Any, Dict, List, Optional, Tuple
+try:
+    import zstandard
+except ImportError:  # zstd é opcional; zlib sempre disponível
+    zstandard = None
+
+# Payload bruto das O.S. fora da tabela quente: ordens_servico_raw guarda o JSON
+# comprimido, uma linha por conteudo_hash (O.S. com o mesmo conteúdo compartilham).
+OS_RAW_COMPRESSAO = os.getenv("OS_RAW_COMPRESSAO", "zlib").lower()
+OS_RAW_NIVEL = int(os.getenv("OS_RAW_NIVEL", "6"))
+
+def _formato() -> str:
+    if OS_RAW_COMPRESSAO == "zstd" and zstandard is not None:
+        return "zstd"
+    return "zlib"
+
+def comprimir(texto: str) -> Tuple[str, bytes]:
+    dados = texto.encode("utf-8")
+    fmt = _formato()
+    if fmt == "zstd":
+        return fmt, zstandard.ZstdCompressor(level=OS_RAW_NIVEL).compress(dados)
+    return fmt, zlib.compress(dados, OS_RAW_NIVEL)
+
+def descomprimir(formato: str, payload: bytes) -> str:
+    if formato == "zstd":
+        if zstandard is None:
+            raise RuntimeError("payload em zstd mas o pacote zstandard não está instalado")
+        return zstandard.ZstdDecompressor().decompress(payload).decode("utf-8")
+    return zlib.decompress(payload).decode("utf-8")
+
+def gravar_raws(cur, pares: List[Tuple[str, str]]) -> int:
+    # pares = [(conteudo_hash, json)]; hash já presente não é regravado (dedup)
+    vistos = set()
+    linhas: List[Any] = []
+    for h, texto in pares:
+        if not h or texto is None or h in vistos:
+            continue
+        vistos.add(h)
+        fmt, blob = comprimir(texto)
+        linhas.append((h, fmt, blob, len(texto)))
+    for i in range(0, len(linhas), 200):
+        chunk = linhas[i:i + 200]
+        marks = ",".join(["(%s,%s,%s,%s,NOW())"] * len(chunk))
+        cur.execute(
+            "INSERT IGNORE INTO ordens_servico_raw (conteudo_hash, formato, payload, tamanho_original, criado_em) "
+            f"VALUES {marks}",
+            [v for row in chunk for v in row],
+        )
+    return len(linhas)
+
+def carregar_raw(cur, conteudo_hash: Optional[str]) -> Optional[Dict[str, Any]]:
+    if not conteudo_hash:
+        return None
+    cur.execute("SELECT formato, payload FROM ordens_servico_raw WHERE conteudo_hash = %s", (conteudo_hash,))
+    row = cur.fetchone()
+    if not row:
+        return None
+    fmt, payload = (row["formato"], row["payload"]) if isinstance(row, dict) else row
+    return json.loads(descomprimir(fmt, bytes(payload)))
@@ -1,7 +1,17 @@
+import os
+import re
+import time
+import base64
+import hashlib
+import threading
+from collections import OrderedDict
 from datetime import datetime
-from typing import Any, Dict, Optional, List, Tuple, Iterable
+from typing import Any, Dict, Optional, List, Tuple, Iterable, Iterator
 import json
-from db_mysql import get_conn
+from db_mysql import get_conn, get_conn_dedicada, run_db
+from os_raw import gravar_raws, carregar_raw
+from db_schema import BUSCA_COLUNAS, fulltext_disponivel
+from rollup_repository import atualizar_dias
 
 def _parse_dt(s:str | None):
     if not s: return None
@@ -12,6 +22,11 @@ def _parse_dt(s:str | None):
             continue
     return None
 
+def conteudo_hash(item: Dict[str, Any]) -> str:
+    # JSON canônico (chaves ordenadas): a mesma O.S. gera sempre o mesmo hash
+    canon = json.dumps(item, ensure_ascii=False, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.blake2b(canon.encode("utf-8"), digest_size=16).hexdigest()
+
 def map_item(item: Dict[str, Any]) -> Tuple:
     cliente_rotulo = item.get("cliente")
     servico_rotulo = item.get("servico")
@@ -91,11 +106,13 @@ def map_item(item: Dict[str, Any]) -> Tuple:
         coords.get("latitude"),
         coords.get("longitude"),
         assinatura_assinado,
-        json.dumps(item, ensure_ascii=False)
+        # as duas últimas posições não vão para ordens_servico: o JSON segue
+        # comprimido para ordens_servico_raw, referenciado pelo hash
+        json.dumps(item, ensure_ascii=False),
+        conteudo_hash(item),
     )
 
-UPSERT_SQL = """
-INSERT INTO ordens_servico (
+UPSERT_COLUMNS = """
   id_ordem_servico, numero, tipo, status,
   status_servico, id_tipo_ordem_servico, cliente_rotulo, servico_rotulo,
   endereco_instalacao_text, pop, descricao_abertura, descricao_servico, descricao_fechamento, disponibilidade,
@@ -108,8 +125,10 @@ INSERT INTO ordens_servico (
   id_cliente_servico, servico_descricao,
   endereco, numero_endereco, bairro, cidade, estado, cep, latitude, longitude,
   assinatura_assinado,
-  raw, updated_at
-) VALUES (
+  conteudo_hash, updated_at
+"""
+
+UPSERT_ROW = """(
   %s,%s,%s,%s,
   %s,%s,%s,%s,
   %s,%s,%s,%s,%s,%s,
@@ -123,7 +142,9 @@ INSERT INTO ordens_servico (
   %s,%s,%s,%s,%s,%s,%s,%s,
   %s,
   %s, NOW()
-)
+)"""
+
+UPSERT_ON_DUPLICATE = """
 ON DUPLICATE KEY UPDATE
   -- chaves “fortes”
   numero                  = COALESCE(VALUES(numero), numero),
@@ -185,69 +206,438 @@ ON DUPLICATE KEY UPDATE
   -- assinatura
   assinatura_assinado = COALESCE(VALUES(assinatura_assinado), assinatura_assinado),
 
-  -- raw sempre atualiza
-  raw = COALESCE(VALUES(raw), raw),
+  -- o payload bruto agora mora em ordens_servico_raw; libera a cópia antiga da tabela quente
+  raw = NULL,
 
-  updated_at = NOW();
+  -- conteúdo idêntico vira no-op (0 linhas afetadas, sem mexer em updated_at).
+  -- a ordem importa: updated_at compara com o hash antigo antes de ele ser trocado
+  updated_at = IF(conteudo_hash <=> VALUES(conteudo_hash), updated_at, NOW()),
+  conteudo_hash = VALUES(conteudo_hash)
 """
 
-def upsert_ordens(items: Iterable[Dict[str, Any]]) -> int:
-    mapped: List[Tuple] = [map_item(x) for x in items]
-    if not mapped: return 0
+UPSERT_SQL = f"INSERT INTO ordens_servico ({UPSERT_COLUMNS}) VALUES {UPSERT_ROW} {UPSERT_ON_DUPLICATE}"
+
+# linhas por INSERT multi-valores (o raw pesa; mantém o pacote bem abaixo do max_allowed_packet)
+UPSERT_MAX_ROWS = int(os.getenv("UPSERT_MAX_ROWS", "200"))
+
+def _upsert_multi_sql(n: int) -> str:
+    return (f"INSERT INTO ordens_servico ({UPSERT_COLUMNS}) VALUES "
+            + ",".join([UPSERT_ROW] * n) + f" {UPSERT_ON_DUPLICATE}")
+
+# ------------------------------
+# Geração das O.S.: muda a cada upsert que grava algo. Caches derivados da tabela
+# (contagens, respostas da API) comparam a geração em vez de adivinhar validade.
+# ------------------------------
+# O mesmo lock protege a geração, as escritas em andamento e o cache de contagens.
+_geracao = 0
+_escritas_em_andamento = 0
+_geracao_lock = threading.Lock()
+
+def geracao_ordens() -> int:
+    with _geracao_lock:
+        return _geracao
+
+def _inicio_escrita() -> None:
+    # antes do primeiro INSERT: COUNT feito daqui até _marcar_escrita não vai para o cache
+    global _escritas_em_andamento
+    with _geracao_lock:
+        _escritas_em_andamento += 1
+
+def _marcar_escrita(inseridas: Optional[int], iniciada: bool = False) -> None:
+    # inseridas=None: não se sabe o que foi gravado (erro no meio); limpa todas as contagens
+    global _geracao, _escritas_em_andamento
+    with _geracao_lock:
+        if iniciada:
+            _escritas_em_andamento -= 1
+        _geracao += 1
+        cache_contagem._apos_escrita_locked(inseridas, _geracao)
+
+def nova_geracao() -> None:
+    # alteração feita por fora do upsert (ex.: rollups reconstruídos à mão)
+    _marcar_escrita(0)
+
+def contagem_vazia() -> Dict[str, int]:
+    return {"inseridas": 0, "atualizadas": 0, "inalteradas": 0, "dias_rollup_pendentes": 0}
+
+def somar_contagem(total: Dict[str, int], parcial: Dict[str, int]) -> Dict[str, int]:
+    for k, v in parcial.items():
+        total[k] = total.get(k, 0) + v
+    return total
+
+def _estado_existente(cur, ids: List[str]) -> Dict[str, Tuple[Optional[str], Any]]:
+    # id -> (conteudo_hash, dia de referência) das O.S. que já estão no banco
+    existentes: Dict[str, Tuple[Optional[str], Any]] = {}
+    for i in range(0, len(ids), UPSERT_MAX_ROWS):
+        chunk = ids[i:i + UPSERT_MAX_ROWS]
+        marks = ",".join(["%s"] * len(chunk))
+        cur.execute(f"""
+          SELECT id_ordem_servico, conteudo_hash, DATE(data_referencia)
+          FROM ordens_servico WHERE id_ordem_servico IN ({marks})
+        """, chunk)
+        for id_os, h, dia in cur.fetchall():
+            existentes[str(id_os)] = (h, dia)
+    return existentes
+
+def _dias_das_ordens(cur, ids: List[str]) -> set:
+    dias = set()
+    for i in range(0, len(ids), UPSERT_MAX_ROWS):
+        chunk = ids[i:i + UPSERT_MAX_ROWS]
+        marks = ",".join(["%s"] * len(chunk))
+        cur.execute(f"SELECT DISTINCT DATE(data_referencia) FROM ordens_servico WHERE id_ordem_servico IN ({marks})", chunk)
+        dias.update(d for (d,) in cur.fetchall() if d is not None)
+    return dias
+
+def upsert_mapped(mapped: List[Tuple]) -> Dict[str, int]:
+    # Grava linhas já mapeadas por map_item em INSERTs multi-valores, num único commit.
+    # O.S. cujo hash de conteúdo já está no banco nem são enviadas; o ON DUPLICATE ainda
+    # transforma em no-op as que mudarem de ideia entre a leitura dos hashes e a escrita.
+    contagem = contagem_vazia()
+    if not mapped: return contagem
+    escrevendo = False
     conn = get_conn()
     try:
         cur = conn.cursor()
-        cur.executemany(UPSERT_SQL, mapped)
+        ids = list({str(row[0]) for row in mapped if row[0] is not None})
+        existentes = _estado_existente(cur, ids) if ids else {}
+        conhecidos = {k: v[0] for k, v in existentes.items()}
+        gravar: List[Tuple] = []
+        raws: List[Tuple[str, str]] = []
+        tocados: List[str] = []
+        dias = set()
+        for row in mapped:
+            id_os, h = (str(row[0]) if row[0] is not None else None), row[-1]
+            if id_os is not None and id_os in conhecidos:
+                if conhecidos[id_os] == h:
+                    contagem["inalteradas"] += 1
+                    continue
+                contagem["atualizadas"] += 1
+            else:
+                contagem["inseridas"] += 1
+            if id_os is not None:
+                conhecidos[id_os] = h  # repetida no mesmo lote conta como atualização
+                tocados.append(id_os)
+                if id_os in existentes and existentes[id_os][1] is not None:
+                    dias.add(existentes[id_os][1])  # o dia antigo também perde/ganha a O.S.
+            gravar.append(row[:-2] + (h,))
+            raws.append((h, row[-2]))
+        gravar_raws(cur, raws)
+        if gravar:
+            _inicio_escrita()
+            escrevendo = True
+        for i in range(0, len(gravar), UPSERT_MAX_ROWS):
+            chunk = gravar[i:i + UPSERT_MAX_ROWS]
+            params: List[Any] = [v for row in chunk for v in row]
+            cur.execute(_upsert_multi_sql(len(chunk)), params)
         conn.commit()
-        return cur.rowcount
+        if gravar:
+            dias |= _dias_das_ordens(cur, list(set(tocados)))
+            # rollups antes da nova geração: quem vê a geração nova já vê os totais novos;
+            # dia que falhar fica em ordens_rollup_pendentes para o scheduler
+            contagem["dias_rollup_pendentes"] = len(atualizar_dias(conn, sorted(dias)))
+            escrevendo = False
+            _marcar_escrita(contagem["inseridas"], iniciada=True)
+        return contagem
     finally:
+        if escrevendo:
+            _marcar_escrita(None, iniciada=True)
         conn.close()
 
+def upsert_ordens(items: Iterable[Dict[str, Any]]) -> Dict[str, int]:
+    mapped: List[Tuple] = [map_item(x) for x in items]
+    return upsert_mapped(mapped)
+
+_RE_NUMERO_OS = re.compile(r"^\d+$")
+_RE_CODIGO_CLIENTE = re.compile(r"^\(\s*(\d+)\s*\)$")
+_RE_OPERADORES_FT = re.compile(r'[+\-<>()~*"@]')
+# tamanho mínimo de termo que o parser ngram consegue achar (ngram_token_size padrão)
+BUSCA_TERMO_MIN = int(os.getenv("OS_BUSCA_TERMO_MIN", "2"))
+
+def _expressao_fulltext(q: str) -> Optional[str]:
+    # cada termo vira uma frase obrigatória: com ngram, "+\"joa\"" casa pedaços da palavra
+    termos = [t for t in _RE_OPERADORES_FT.sub(" ", q).split() if len(t) >= BUSCA_TERMO_MIN]
+    if not termos:
+        return None
+    return " ".join(f'+"{t}"' for t in termos)
+
+def _filtro_busca(q: str) -> Tuple[str, List[Any]]:
+    q = q.strip()
+    # atalhos exatos (índices de numero e cliente_codigo)
+    if _RE_NUMERO_OS.match(q):
+        return "numero = %s", [q]
+    m = _RE_CODIGO_CLIENTE.match(q)
+    if m:
+        return "cliente_codigo = %s", [m.group(1)]
+    expr = _expressao_fulltext(q) if fulltext_disponivel() else None
+    if expr:
+        return f"MATCH({BUSCA_COLUNAS}) AGAINST (%s IN BOOLEAN MODE)", [expr]
+    # termo curto demais para o índice (ou FULLTEXT desligado/ausente): LIKE como antes
+    return ("(CAST(numero AS CHAR) LIKE %s OR tipo LIKE %s OR cliente_nome LIKE %s OR cidade LIKE %s "
+            "OR cliente_rotulo LIKE %s OR servico_rotulo LIKE %s)"), [f"%{q}%"] * 6
+
+def _ordem_relevancia(q: Optional[str]) -> Tuple[str, List[Any]]:
+    # com busca textual, as mais relevantes primeiro; desempate pela ordem normal
+    cond, qparams = _filtro_busca(q) if q else ("", [])
+    if not cond.startswith("MATCH("):
+        return LIST_ORDER, []
+    return f"ORDER BY {cond} DESC, data_referencia DESC, id_ordem_servico DESC", qparams
+
+def _escape_like(v: str) -> str:
+    return v.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
 def _build_where(status: Optional[str], q: Optional[str], di: Optional[str], df: Optional[str]):
     where = []
     params: List[Any] = []
+    # predicados de faixa sobre colunas indexadas (status, data_referencia):
+    # prefixo no status e data_referencia = COALESCE(data_termino_executado, data_cadastro)
     if status:
         where.append("status LIKE %s")
-        params.append(f"%{status}%")
+        params.append(f"{_escape_like(status)}%")
     if di:
-        where.append("(data_cadastro >= %s OR data_termino_executado >= %s)")
-        params += [f"{di} 00:00:00", f"{di} 00:00:00"]
+        where.append("data_referencia >= %s")
+        params.append(f"{di} 00:00:00")
     if df:
-        where.append("(data_cadastro <= %s OR data_termino_executado <= %s)")
-        params += [f"{df} 23:59:59", f"{df} 23:59:59"]
+        where.append("data_referencia < DATE_ADD(%s, INTERVAL 1 DAY)")
+        params.append(df)
     if q:
-        where.append("(CAST(numero AS CHAR) LIKE %s OR tipo LIKE %s OR cliente_nome LIKE %s OR cidade LIKE %s OR cliente_rotulo LIKE %s OR servico_rotulo LIKE %s)")
-        params += [f"%{q}%", f"%{q}%", f"%{q}%", f"%{q}%", f"%{q}%", f"%{q}%"]
+        cond, qparams = _filtro_busca(q)
+        where.append(cond)
+        params += qparams
     where_sql = ("WHERE " + " AND ".join(where)) if where else ""
     return where_sql, params
 
+LIST_COLUMNS = """
+  id_ordem_servico, numero, tipo, status, status_servico,
+  data_cadastro, data_inicio_programado, data_termino_programado,
+  data_inicio_executado, data_termino_executado,
+  cliente_rotulo, cliente_nome, cidade, estado, servico_rotulo
+"""
+
+# data_referencia = COALESCE(data_termino_executado, data_cadastro), coluna gerada e indexada
+# junto com o id (desempate), o que deixa a ordem total e estável para o cursor
+LIST_ORDER = "ORDER BY data_referencia DESC, id_ordem_servico DESC"
+
+OS_COUNT_CACHE_TTL = float(os.getenv("OS_COUNT_CACHE_TTL", "300"))
+OS_COUNT_CACHE_MAX = int(os.getenv("OS_COUNT_CACHE_MAX", "1000"))
+
+class CacheContagem:
+    # COUNT(*) por conjunto de filtros normalizado (o WHERE já montado + parâmetros).
+    # Upserts deste processo invalidam tudo, exceto o total sem filtro, que só soma as
+    # inserções; o TTL cobre escritas de outros processos.
+    # Usa o lock da geração: a troca de geração e a limpeza do cache são atômicas.
+    def __init__(self, ttl: float = OS_COUNT_CACHE_TTL, maximo: int = OS_COUNT_CACHE_MAX):
+        self.ttl = ttl
+        self.maximo = max(1, maximo)
+        self._itens: "OrderedDict[Tuple, Tuple[float, int, int]]" = OrderedDict()
+        self._lock = _geracao_lock
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, chave: Tuple) -> Optional[int]:
+        with self._lock:
+            ent = self._itens.get(chave)
+            if ent is None or time.monotonic() >= ent[0]:
+                self.misses += 1
+                return None
+            self._itens.move_to_end(chave)
+            self.hits += 1
+            return ent[1]
+
+    def put(self, chave: Tuple, total: int, geracao: int) -> None:
+        with self._lock:
+            if geracao != _geracao or _escritas_em_andamento:
+                return  # houve (ou há) escrita durante o COUNT: o valor pode já nascer velho
+            self._itens[chave] = (time.monotonic() + self.ttl, int(total), geracao)
+            self._itens.move_to_end(chave)
+            while len(self._itens) > self.maximo:
+                self._itens.popitem(last=False)
+
+    def _apos_escrita_locked(self, inseridas: Optional[int], geracao: int) -> None:
+        # chamado com o lock já tomado por _marcar_escrita
+        sem_filtro = self._itens.get(("", ()))
+        self._itens.clear()
+        if sem_filtro is not None and inseridas is not None:
+            expira, total, _ = sem_filtro
+            self._itens[("", ())] = (expira, total + inseridas, geracao)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"entradas": len(self._itens), "hits": self.hits, "misses": self.misses}
+
+cache_contagem = CacheContagem()
+
+def _contar(cur, where_sql: str, params: List[Any], modo: str) -> Optional[int]:
+    # modo: exact (COUNT(*) com cache), estimate (cache ou estimativa do otimizador), none
+    if modo == "none":
+        return None
+    chave = (where_sql, tuple(params))
+    total = cache_contagem.get(chave)
+    if total is not None:
+        return total
+    if modo == "estimate":
+        if not where_sql:
+            cur.execute("""
+              SELECT TABLE_ROWS AS total FROM information_schema.TABLES
+              WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'ordens_servico'
+            """)
+        else:
+            cur.execute(f"EXPLAIN SELECT 1 FROM ordens_servico {where_sql}", params)
+        row = cur.fetchone() or {}
+        cur.fetchall()
+        return int(row.get("total") or row.get("rows") or 0)
+    geracao = geracao_ordens()  # lida antes do COUNT; put() confere de novo sob o lock
+    cur.execute(f"SELECT COUNT(*) AS total FROM ordens_servico {where_sql}", params)
+    total = cur.fetchone()["total"]
+    cache_contagem.put(chave, total, geracao)
+    return total
+
 def list_ordens(status: Optional[str], q: Optional[str], di: Optional[str], df: Optional[str],
-                limit: int, offset: int) -> Dict[str, Any]:
+                limit: int, offset: int, total_modo: str = "exact") -> Dict[str, Any]:
     where_sql, params = _build_where(status, q, di, df)
     conn = get_conn()
     try:
         cur = conn.cursor(dictionary=True)
-        cur.execute(f"SELECT COUNT(*) AS total FROM ordens_servico {where_sql}", params)
-        total = cur.fetchone()["total"]
+        total = _contar(cur, where_sql, params, total_modo)
 
+        order_sql, order_params = _ordem_relevancia(q)
         sql = f"""
-          SELECT
-            id_ordem_servico, numero, tipo, status, status_servico,
-            data_cadastro, data_inicio_programado, data_termino_programado,
-            data_inicio_executado, data_termino_executado,
-            cliente_rotulo, cliente_nome, cidade, estado, servico_rotulo
+          SELECT {LIST_COLUMNS}
           FROM ordens_servico
           {where_sql}
-          ORDER BY COALESCE(data_termino_executado, data_cadastro) DESC
+          {order_sql}
           LIMIT %s OFFSET %s
         """
-        cur.execute(sql, params + [int(limit), int(offset)])
+        cur.execute(sql, params + order_params + [int(limit), int(offset)])
         rows = cur.fetchall()
         return {"items": rows, "total": total}
     finally:
         conn.close()
 
-def get_ordem(id_os: int) -> Optional[Dict[str, Any]]:
+# colunas que o export aceita (raw fica de fora: mora comprimido em ordens_servico_raw)
+EXPORT_COLUMNS = [
+    "id_ordem_servico", "numero", "tipo", "status", "status_servico", "id_tipo_ordem_servico",
+    "data_cadastro", "data_inicio_programado", "data_termino_programado",
+    "data_inicio_executado", "data_termino_executado", "data_referencia",
+    "cliente_id", "cliente_codigo", "cliente_nome", "cliente_rotulo",
+    "telefone_primario", "telefone_secundario",
+    "id_cliente_servico", "servico_descricao", "servico_rotulo",
+    "endereco", "numero_endereco", "bairro", "cidade", "estado", "cep", "latitude", "longitude",
+    "endereco_instalacao_text", "pop",
+    "descricao_abertura", "descricao_servico", "descricao_fechamento", "disponibilidade",
+    "atendimento_protocolo", "atendimento_id", "atendimento_tipo", "atendimento_status",
+    "tecnico_principal_id", "tecnico_principal_nome", "assinatura_assinado", "updated_at",
+]
+EXPORT_DEFAULT = [c.strip() for c in LIST_COLUMNS.split(",")]
+EXPORT_LOTE = int(os.getenv("OS_EXPORT_LOTE", "1000"))
+
+def validar_colunas_export(colunas: List[str]) -> None:
+    invalidas = [c for c in colunas if c not in EXPORT_COLUMNS]
+    if invalidas:
+        raise ValueError(f"colunas inválidas: {', '.join(invalidas)}")
+
+def iterar_ordens(status: Optional[str], q: Optional[str], di: Optional[str], df: Optional[str],
+                  colunas: List[str], lote: int = EXPORT_LOTE,
+                  parar: Optional[threading.Event] = None) -> Iterator[Tuple]:
+    # Cursor sem buffer + fetchmany: o servidor entrega as linhas conforme são lidas,
+    # a memória fica em um lote. A conexão é dedicada (fora do pool) e fica presa ao
+    # export até o fim; quem chama limita quantos exports rodam juntos e sinaliza
+    # `parar` quando o cliente vai embora (o fechamento fica sempre neste finally).
+    validar_colunas_export(colunas)
+    where_sql, params = _build_where(status, q, di, df)
+    conn = get_conn_dedicada()
+    try:
+        cur = conn.cursor(buffered=False)
+        cur.execute(f"""
+          SELECT {", ".join(colunas)}
+          FROM ordens_servico
+          {where_sql}
+          {LIST_ORDER}
+        """, params)
+        while True:
+            rows = cur.fetchmany(lote)
+            if not rows:
+                break
+            for row in rows:
+                if parar is not None and parar.is_set():
+                    return
+                yield row
+    finally:
+        # se o cliente desconectou no meio sobra resultado não lido: só derruba a conexão
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+def encode_cursor(data_referencia: Optional[datetime], id_os: Any) -> str:
+    ref = data_referencia.strftime("%Y-%m-%d %H:%M:%S") if data_referencia else None
+    bruto = json.dumps([ref, id_os], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(bruto).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[Optional[str], Any]:
+    # ValueError para cursor adulterado/inválido
+    try:
+        bruto = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        ref, id_os = json.loads(bruto)
+    except Exception:
+        raise ValueError("cursor inválido")
+    if ref is not None and _parse_dt(ref) is None:
+        raise ValueError("cursor inválido")
+    if not isinstance(id_os, (int, str)):
+        raise ValueError("cursor inválido")
+    return ref, id_os
+
+def list_ordens_cursor(status: Optional[str], q: Optional[str], di: Optional[str], df: Optional[str],
+                       limit: int, cursor: Optional[str]) -> Dict[str, Any]:
+    # Paginação por chave (keyset): continua logo depois da última linha vista, sem OFFSET.
+    # O.S. novas inseridas durante a navegação não deslocam as páginas seguintes.
+    # A busca textual aqui só filtra: a ordem por relevância não serve de chave de cursor.
+    # Duas fases, cada uma com predicado de faixa simples (sem "OR ... IS NULL", que
+    # impediria o range scan no índice de data_referencia): primeiro as O.S. com data,
+    # depois a cauda sem data (NULLs vêm por último no DESC), ordenada só pelo id.
+    where_sql, params = _build_where(status, q, di, df)
+    ref, id_os = decode_cursor(cursor) if cursor else (None, None)
+    na_cauda = cursor is not None and ref is None
+    conn = get_conn()
+    try:
+        cur = conn.cursor(dictionary=True)
+
+        def buscar(cond: str, cparams: List[Any], ordem: str, n: int) -> List[Dict[str, Any]]:
+            w = (where_sql + " AND " + cond) if where_sql else ("WHERE " + cond)
+            cur.execute(f"""
+              SELECT {LIST_COLUMNS}, data_referencia
+              FROM ordens_servico
+              {w}
+              {ordem}
+              LIMIT %s
+            """, params + cparams + [int(n)])
+            return cur.fetchall()
+
+        rows: List[Dict[str, Any]] = []
+        if not na_cauda:
+            if cursor:
+                cond = "data_referencia <= %s AND (data_referencia < %s OR id_ordem_servico < %s)"
+                cparams: List[Any] = [ref, ref, id_os]
+            else:
+                cond, cparams = "data_referencia IS NOT NULL", []
+            rows = buscar(cond, cparams, LIST_ORDER, limit + 1)
+        if len(rows) <= limit:
+            # completa a página com a cauda sem data (o +1 diz se ainda sobra algo depois)
+            if na_cauda:
+                cond, cparams = "data_referencia IS NULL AND id_ordem_servico < %s", [id_os]
+            else:
+                cond, cparams = "data_referencia IS NULL", []
+            rows += buscar(cond, cparams, "ORDER BY id_ordem_servico DESC", limit - len(rows) + 1)
+        proximo = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            ultimo = rows[-1]
+            proximo = encode_cursor(ultimo["data_referencia"], ultimo["id_ordem_servico"])
+        for r in rows:
+            r.pop("data_referencia", None)
+        return {"items": rows, "next_cursor": proximo}
+    finally:
+        conn.close()
+
+def get_ordem(id_os: int, incluir_raw: bool = False) -> Optional[Dict[str, Any]]:
     conn = get_conn()
     try:
         cur = conn.cursor(dictionary=True)
@@ -265,16 +655,23 @@ def get_ordem(id_os: int) -> Optional[Dict[str, Any]]:
             descricao_abertura, descricao_servico, descricao_fechamento, disponibilidade,
             atendimento_protocolo, atendimento_id, atendimento_tipo, atendimento_status,
             tecnico_principal_id, tecnico_principal_nome,
-            assinatura_assinado,
-            raw
+            assinatura_assinado, conteudo_hash
           FROM ordens_servico
           WHERE id_ordem_servico = %s
         """, (id_os,))
         row = cur.fetchone()
         if not row: return None
-        if isinstance(row.get("raw"), str):
-            try: row["raw"] = json.loads(row["raw"])
-            except Exception: pass
+        if incluir_raw:
+            # só quem pede paga a leitura e a descompressão do payload
+            row["raw"] = carregar_raw(cur, row.get("conteudo_hash"))
+            if row["raw"] is None:
+                # linha ainda não migrada: o JSON continua na coluna antiga
+                cur.execute("SELECT raw FROM ordens_servico WHERE id_ordem_servico = %s", (id_os,))
+                legado = (cur.fetchone() or {}).get("raw")
+                if isinstance(legado, str):
+                    try: legado = json.loads(legado)
+                    except Exception: pass
+                row["raw"] = legado
         return row
     finally:
         conn.close()
@@ -289,9 +686,81 @@ def list_concluidas_ontem() -> List[Dict[str, Any]]:
             data_termino_executado, cliente_rotulo, cliente_nome, cidade, estado
           FROM ordens_servico
           WHERE status LIKE 'Finaliz%%'
-            AND DATE(data_termino_executado) = DATE(DATE_SUB(CURDATE(), INTERVAL 1 DAY))
-          ORDER BY data_termino_executado DESC
+            AND data_referencia >= CURDATE() - INTERVAL 1 DAY
+            AND data_referencia < CURDATE()
+            AND data_termino_executado IS NOT NULL
+          ORDER BY data_referencia DESC
         """)
         return cur.fetchall()
     finally:
-        conn.close()
\ No newline at end of file
+        conn.close()
+
+# ------------------------------
+# API assíncrona (para uso dentro do event loop)
+# ------------------------------
+async def upsert_ordens_async(items: Iterable[Dict[str, Any]]) -> Dict[str, int]:
+    return await run_db(upsert_ordens, list(items))
+
+async def list_ordens_async(status: Optional[str], q: Optional[str], di: Optional[str], df: Optional[str],
+                            limit: int, offset: int, total_modo: str = "exact") -> Dict[str, Any]:
+    return await run_db(list_ordens, status, q, di, df, limit, offset, total_modo)
+
+async def list_ordens_cursor_async(status: Optional[str], q: Optional[str], di: Optional[str], df: Optional[str],
+                                   limit: int, cursor: Optional[str]) -> Dict[str, Any]:
+    return await run_db(list_ordens_cursor, status, q, di, df, limit, cursor)
+
+async def get_ordem_async(id_os: int, incluir_raw: bool = False) -> Optional[Dict[str, Any]]:
+    return await run_db(get_ordem, id_os, incluir_raw)
+
+async def list_concluidas_ontem_async() -> List[Dict[str, Any]]:
+    return await run_db(list_concluidas_ontem)
+
+# ------------------------------
+# Falhas de import (O.S. que não puderam ser detalhadas)
+# ------------------------------
+def registrar_falhas_import(falhas: List[Dict[str, Any]]) -> int:
+    if not falhas: return 0
+    conn = get_conn()
+    try:
+        cur = conn.cursor()
+        cur.executemany("""
+          INSERT INTO import_falhas (numero, erro) VALUES (%s, %s)
+          ON DUPLICATE KEY UPDATE
+            erro = VALUES(erro),
+            tentativas = tentativas + 1,
+            ultima_falha = NOW()
+        """, [(str(f["numero"]), (f.get("erro") or "")[:2000]) for f in falhas])
+        conn.commit()
+        return cur.rowcount
+    finally:
+        conn.close()
+
+def limpar_falhas_import(numeros: Iterable[str]) -> int:
+    numeros = [str(n) for n in numeros]
+    if not numeros: return 0
+    conn = get_conn()
+    try:
+        cur = conn.cursor()
+        removidas = 0
+        for i in range(0, len(numeros), 500):
+            lote = numeros[i:i + 500]
+            cur.execute(f"DELETE FROM import_falhas WHERE numero IN ({','.join(['%s'] * len(lote))})", lote)
+            removidas += cur.rowcount
+        conn.commit()
+        return removidas
+    finally:
+        conn.close()
+
+def list_falhas_import(limit: int = 500) -> List[Dict[str, Any]]:
+    conn = get_conn()
+    try:
+        cur = conn.cursor(dictionary=True)
+        cur.execute("""
+          SELECT numero, erro, tentativas, primeira_falha, ultima_falha
+          FROM import_falhas
+          ORDER BY ultima_falha DESC
+          LIMIT %s
+        """, (int(limit),))
+        return cur.fetchall()
+    finally:
+        conn.close()
@@ -0,0 +1,122 @@
+import time
+import asyncio
+from typing import Any, AsyncIterable, Awaitable, Callable, Dict, Iterable, List, Optional
+
+# Pipeline em estágios ligados por filas limitadas: quando um estágio atrasa
+# (ex.: gravação no banco), as filas enchem e os estágios anteriores esperam.
+
+StageFn = Callable[[Any], Awaitable[Optional[Iterable[Any]]]]
+ErroFn = Callable[[Any, BaseException], None]
+
+_FIM = object()
+
+class Stage:
+    def __init__(self, nome: str, fn: StageFn, concorrencia: int = 1, fila: int = 100,
+                 on_erro: Optional[ErroFn] = None):
+        self.nome = nome
+        self.fn = fn
+        self.concorrencia = max(1, concorrencia)
+        self.fila: asyncio.Queue = asyncio.Queue(maxsize=max(1, fila))
+        self.on_erro = on_erro
+        self.entrada = 0
+        self.saida = 0
+        self.erros = 0
+        self.ocupado_segundos = 0.0
+        self.espera_saida_segundos = 0.0  # tempo bloqueado na fila do estágio seguinte
+        self.fila_max = 0
+        self.inicio: Optional[float] = None
+        self.fim: Optional[float] = None
+
+    def stats(self) -> Dict[str, Any]:
+        fim = self.fim or time.monotonic()
+        dur = (fim - self.inicio) if self.inicio else 0.0
+        return {
+            "concorrencia": self.concorrencia,
+            "entrada": self.entrada,
+            "saida": self.saida,
+            "erros": self.erros,
+            "fila_atual": self.fila.qsize(),
+            "fila_max": self.fila_max,
+            "ocupado_segundos": round(self.ocupado_segundos, 3),
+            "espera_saida_segundos": round(self.espera_saida_segundos, 3),
+            "itens_por_segundo": round(self.entrada / dur, 2) if dur > 0 else None,
+        }
+
+class Pipeline:
+    def __init__(self, nome: str):
+        self.nome = nome
+        self.stages: List[Stage] = []
+        self.origem = 0
+        self.origem_espera_segundos = 0.0
+
+    def add_stage(self, nome: str, fn: StageFn, concorrencia: int = 1, fila: int = 100,
+                  on_erro: Optional[ErroFn] = None) -> Stage:
+        st = Stage(nome, fn, concorrencia, fila, on_erro)
+        self.stages.append(st)
+        return st
+
+    async def _put(self, st: Stage, item: Any) -> float:
+        t0 = time.monotonic()
+        await st.fila.put(item)
+        st.fila_max = max(st.fila_max, st.fila.qsize())
+        return time.monotonic() - t0
+
+    async def _produzir(self, origem: AsyncIterable[Any]) -> None:
+        primeiro = self.stages[0]
+        async for item in origem:
+            self.origem += 1
+            self.origem_espera_segundos += await self._put(primeiro, item)
+
+    async def _worker(self, idx: int) -> None:
+        st = self.stages[idx]
+        prox = self.stages[idx + 1] if idx + 1 < len(self.stages) else None
+        while True:
+            item = await st.fila.get()
+            if item is _FIM:
+                return
+            st.entrada += 1
+            t0 = time.monotonic()
+            try:
+                saidas = await st.fn(item)
+            except Exception as e:
+                st.erros += 1
+                print(f"[PIPELINE] {self.nome}/{st.nome} erro: {e}")
+                if st.on_erro:
+                    st.on_erro(item, e)
+                continue
+            finally:
+                st.ocupado_segundos += time.monotonic() - t0
+            for out in saidas or ():
+                st.saida += 1
+                if prox is not None:
+                    st.espera_saida_segundos += await self._put(prox, out)
+
+    async def _estagio(self, idx: int) -> None:
+        st = self.stages[idx]
+        st.inicio = time.monotonic()
+        await asyncio.gather(*(self._worker(idx) for _ in range(st.concorrencia)))
+        st.fim = time.monotonic()
+        if idx + 1 < len(self.stages):
+            prox = self.stages[idx + 1]
+            for _ in range(prox.concorrencia):
+                await prox.fila.put(_FIM)
+
+    async def run(self, origem: AsyncIterable[Any]) -> None:
+        if not self.stages:
+            raise ValueError("Pipeline sem estágios")
+        tarefas = [asyncio.create_task(self._estagio(i)) for i in range(len(self.stages))]
+        try:
+            await self._produzir(origem)
+            for _ in range(self.stages[0].concorrencia):
+                await self.stages[0].fila.put(_FIM)
+            await asyncio.gather(*tarefas)
+        finally:
+            for t in tarefas:
+                t.cancel()
+            await asyncio.gather(*tarefas, return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "origem": {"itens": self.origem, "espera_saida_segundos": round(self.origem_espera_segundos, 3)},
+            "estagios": {st.nome: st.stats() for st in self.stages},
+        }
@@ -0,0 +1,141 @@
+import os
+import json
+import time
+import tempfile
+from typing import Any, Dict, List, Optional
+
+# Memória de qual conjunto de "relacoes" o /consultar da Hubsoft aceita.
+# Sem isso cada O.S. descia a escada de fallback sozinha e pagava um POST
+# recusado por degrau. O conjunto aceito fica em arquivo (como o token) e
+# expira: depois disso uma única consulta volta a sondar a escada desde o topo.
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+RELACOES_FILE = os.getenv(
+    "HUBSOFT_RELACOES_FILE",
+    os.path.join(BASE_DIR, ".cache_hubsoft_relacoes.json")
+)
+RELACOES_TTL = float(os.getenv("HUBSOFT_RELACOES_TTL_HORAS", "24")) * 3600
+# sondagem travada (ex.: consulta cancelada) é liberada depois desse tempo
+RELACOES_SONDA_TIMEOUT = 120.0
+
+def escada_relacoes(relacoes: List[str]) -> List[List[str]]:
+    degraus = [
+        relacoes,
+        [r for r in relacoes if r != "assinatura"],
+        [r for r in relacoes if r != "atendimento"],
+        [r for r in relacoes if r in ("tecnicos", "motivos_fechamento", "cobrancas_disponiveis")],
+        [],
+    ]
+    unicos: List[List[str]] = []
+    for d in degraus:
+        if d not in unicos:
+            unicos.append(d)
+    return unicos
+
+def _chave(relacoes: List[str]) -> str:
+    return ",".join(sorted(relacoes))
+
+class PlanoRelacoes:
+    # Uma consulta: candidatos em ordem + retorno do que a Hubsoft aceitou/recusou.
+    def __init__(self, negociador: "NegociadorRelacoes", relacoes: List[str],
+                 candidatos: List[List[str]], sonda: bool):
+        self.negociador = negociador
+        self.relacoes = relacoes
+        self.candidatos = candidatos
+        self.sonda = sonda
+
+    def aceitou(self, rels: List[str]) -> None:
+        self.negociador._aceitou(self, rels)
+
+    def recusou(self, rels: List[str]) -> None:
+        self.negociador._recusou(self, rels)
+
+    def fim(self) -> None:
+        if self.sonda:
+            self.negociador._sondas.pop(_chave(self.relacoes), None)
+            self.sonda = False
+
+class NegociadorRelacoes:
+    def __init__(self, arquivo: str = RELACOES_FILE, ttl: float = RELACOES_TTL):
+        self.arquivo = arquivo
+        self.ttl = ttl
+        self._memo: Optional[Dict[str, Dict[str, Any]]] = None
+        self._sondas: Dict[str, float] = {}
+        self.stats_ = {"memorizadas": 0, "sondagens": 0, "recusas": 0, "aprendizados": 0, "esquecidas": 0}
+
+    def _carregar(self) -> Dict[str, Dict[str, Any]]:
+        if self._memo is None:
+            self._memo = {}
+            try:
+                with open(self.arquivo, "r", encoding="utf-8") as f:
+                    self._memo = json.load(f) or {}
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                print(f"⚠️  [RELACOES] Falha ao ler cache de relações: {e}")
+        return self._memo
+
+    def _salvar(self) -> None:
+        # escrita atômica, igual ao cache de token
+        try:
+            fd, tmp = tempfile.mkstemp(prefix=".relacoes-", dir=os.path.dirname(self.arquivo) or ".")
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    json.dump(self._memo or {}, f)
+                os.replace(tmp, self.arquivo)
+            except Exception:
+                try:
+                    os.remove(tmp)
+                except OSError:
+                    pass
+                raise
+        except Exception as e:
+            print(f"⚠️  [RELACOES] Falha ao salvar cache de relações: {e}")
+
+    def plano(self, relacoes: List[str]) -> PlanoRelacoes:
+        escada = escada_relacoes(relacoes)
+        chave = _chave(relacoes)
+        ent = self._carregar().get(chave)
+        agora = time.time()
+        if ent is not None and ent.get("aceitas") in escada:
+            idx = escada.index(ent["aceitas"])
+            expirou = agora - float(ent.get("aprendido_em", 0)) >= self.ttl
+            sonda_ativa = self._sondas.get(chave, 0) > time.monotonic()
+            if idx == 0 or not expirou or sonda_ativa:
+                # vai direto ao conjunto aceito; se ele passar a falhar, desce a escada a partir dele
+                self.stats_["memorizadas"] += 1
+                return PlanoRelacoes(self, relacoes, escada[idx:], False)
+        # sem memória ou memória vencida: esta consulta sonda a escada inteira
+        self._sondas[chave] = time.monotonic() + RELACOES_SONDA_TIMEOUT
+        self.stats_["sondagens"] += 1
+        return PlanoRelacoes(self, relacoes, escada, True)
+
+    def _aceitou(self, plano: PlanoRelacoes, rels: List[str]) -> None:
+        memo = self._carregar()
+        chave = _chave(plano.relacoes)
+        ent = memo.get(chave)
+        if ent is not None and ent.get("aceitas") == rels and not plano.sonda:
+            return
+        memo[chave] = {"aceitas": rels, "aprendido_em": time.time()}
+        self.stats_["aprendizados"] += 1
+        print(f"[RELACOES] /consultar aceita relacoes={rels} (pedidas={plano.relacoes})")
+        self._salvar()
+
+    def _recusou(self, plano: PlanoRelacoes, rels: List[str]) -> None:
+        self.stats_["recusas"] += 1
+        memo = self._carregar()
+        chave = _chave(plano.relacoes)
+        ent = memo.get(chave)
+        if ent is not None and ent.get("aceitas") == rels:
+            # o conjunto memorizado parou de funcionar: esquece e deixa a escada decidir de novo
+            del memo[chave]
+            self.stats_["esquecidas"] += 1
+            print(f"[RELACOES] relacoes={rels} passaram a ser recusadas; reaprendendo")
+            self._salvar()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.stats_,
+            "aceitas": {k: v.get("aceitas") for k, v in (self._memo or {}).items()},
+        }
+
+negociador_relacoes = NegociadorRelacoes()
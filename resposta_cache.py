@@ -0,0 +1,117 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Any, Callable, Dict, Optional, Tuple
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+from os_repository import geracao_ordens
+
+# Cache das respostas de leitura (/api/ordens, detalhe, relatórios) com ETag.
+# Cada entrada guarda a geração das O.S. em que foi montada: qualquer upsert que
+# grave algo muda a geração e a entrada deixa de valer, sem esperar o TTL.
+RESPOSTA_CACHE_TTL = float(os.getenv("RESPOSTA_CACHE_TTL", "120"))
+RESPOSTA_CACHE_MAX = int(os.getenv("RESPOSTA_CACHE_MAX", "500"))
+# corpo acima disso não fica em memória (ainda ganha ETag/304)
+RESPOSTA_CACHE_MAX_BYTES = int(os.getenv("RESPOSTA_CACHE_MAX_BYTES", str(2 * 1024 * 1024)))
+
+class _Entrada:
+    __slots__ = ("expira", "geracao", "etag", "modificado", "corpo")
+
+    def __init__(self, expira: float, geracao: int, etag: str, modificado: float, corpo: bytes):
+        self.expira = expira
+        self.geracao = geracao
+        self.etag = etag
+        self.modificado = modificado
+        self.corpo = corpo
+
+def _normalizar(params: Dict[str, Any]) -> Tuple:
+    itens = []
+    for k, v in params.items():
+        if isinstance(v, str):
+            v = v.strip()
+        if v is None or v == "":
+            continue
+        itens.append((k, tuple(v) if isinstance(v, list) else v))
+    return tuple(sorted(itens))
+
+def _etag(corpo: bytes) -> str:
+    return '"' + hashlib.blake2b(corpo, digest_size=12).hexdigest() + '"'
+
+def _nao_modificado(request: Request, ent: _Entrada) -> bool:
+    inm = request.headers.get("if-none-match")
+    if inm is not None:
+        tags = [t.strip().removeprefix("W/") for t in inm.split(",")]
+        return "*" in tags or ent.etag in tags
+    ims = request.headers.get("if-modified-since")
+    if ims:
+        try:
+            return int(ent.modificado) <= parsedate_to_datetime(ims).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+class RespostaCache:
+    def __init__(self, ttl: float = RESPOSTA_CACHE_TTL, maximo: int = RESPOSTA_CACHE_MAX):
+        self.ttl = ttl
+        self.maximo = max(1, maximo)
+        self._itens: "OrderedDict[Tuple, _Entrada]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats_ = {"hits": 0, "misses": 0, "nao_modificado": 0, "invalidadas": 0}
+
+    def _get(self, chave: Tuple, geracao: int) -> Optional[_Entrada]:
+        with self._lock:
+            ent = self._itens.get(chave)
+            if ent is None:
+                return None
+            if ent.geracao != geracao or time.monotonic() >= ent.expira:
+                if ent.geracao != geracao:
+                    self.stats_["invalidadas"] += 1
+                del self._itens[chave]
+                return None
+            self._itens.move_to_end(chave)
+            return ent
+
+    def _put(self, chave: Tuple, ent: _Entrada) -> None:
+        if len(ent.corpo) > RESPOSTA_CACHE_MAX_BYTES:
+            return
+        with self._lock:
+            self._itens[chave] = ent
+            self._itens.move_to_end(chave)
+            while len(self._itens) > self.maximo:
+                self._itens.popitem(last=False)
+
+    def responder(self, request: Request, nome: str, params: Dict[str, Any],
+                  produzir: Callable[[], Any]) -> Response:
+        # produzir() só roda em miss; exceções (ex.: 404) sobem sem ir para o cache
+        chave = (nome, _normalizar(params))
+        geracao = geracao_ordens()
+        ent = self._get(chave, geracao)
+        if ent is None:
+            self.stats_["misses"] += 1
+            corpo = json.dumps(jsonable_encoder(produzir()), ensure_ascii=False,
+                               separators=(",", ":")).encode("utf-8")
+            # geração lida antes da consulta: se houve escrita no meio, a entrada já nasce inválida
+            ent = _Entrada(time.monotonic() + self.ttl, geracao, _etag(corpo), time.time(), corpo)
+            self._put(chave, ent)
+        else:
+            self.stats_["hits"] += 1
+        headers = {
+            "ETag": ent.etag,
+            "Last-Modified": formatdate(ent.modificado, usegmt=True),
+            # o cliente sempre revalida; a resposta 304 sai sem tocar no banco
+            "Cache-Control": "no-cache",
+        }
+        if _nao_modificado(request, ent):
+            self.stats_["nao_modificado"] += 1
+            return Response(status_code=304, headers=headers)
+        return Response(content=ent.corpo, media_type="application/json", headers=headers)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self.stats_, "entradas": len(self._itens), "geracao": geracao_ordens()}
+
+resposta_cache = RespostaCache()
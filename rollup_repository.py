@@ -0,0 +1,146 @@
+import os
+import time
+import random
+from datetime import date, timedelta
+from typing import Any, Dict, List, Optional, Sequence
+from mysql.connector import errorcode, Error as MySQLError
+from db_mysql import get_conn
+
+# Totais diários das O.S. por status/cidade/técnico/tipo (dia = data_referencia).
+# O upsert reconstrói só os dias que tocou; os relatórios leem apenas esta tabela.
+# Texto nulo vira '' para caber na chave primária.
+# Dia que não deu para reconstruir (ex.: deadlock entre o sync do scheduler e um
+# import manual no mesmo dia, mesmo após as novas tentativas) vai para
+# ordens_rollup_pendentes, e o job do scheduler refaz.
+ROLLUP_TENTATIVAS = int(os.getenv("ROLLUP_TENTATIVAS", "3"))
+_ERROS_TRANSITORIOS = (errorcode.ER_LOCK_DEADLOCK, errorcode.ER_LOCK_WAIT_TIMEOUT)
+
+DIMENSOES = {
+    "status": "status",
+    "cidade": "cidade",
+    "tecnico": "tecnico_principal_id",
+    "tipo": "tipo",
+}
+
+def reconstruir_dias(cur, dias: Sequence[date]) -> int:
+    # roda na transação de quem chama (o commit fica com ele)
+    for dia in dias:
+        cur.execute("DELETE FROM ordens_rollup_diario WHERE dia = %s", (dia,))
+        cur.execute("""
+          INSERT INTO ordens_rollup_diario
+            (dia, status, cidade, tecnico_principal_id, tipo, tecnico_nome, total, atualizado_em)
+          SELECT
+            DATE(data_referencia),
+            LEFT(COALESCE(status, ''), 100), LEFT(COALESCE(cidade, ''), 100),
+            COALESCE(CAST(tecnico_principal_id AS CHAR), ''), LEFT(COALESCE(tipo, ''), 100),
+            LEFT(MAX(tecnico_principal_nome), 150), COUNT(*), NOW()
+          FROM ordens_servico
+          WHERE data_referencia >= %s AND data_referencia < %s + INTERVAL 1 DAY
+          GROUP BY DATE(data_referencia), LEFT(COALESCE(status, ''), 100), LEFT(COALESCE(cidade, ''), 100),
+                   COALESCE(CAST(tecnico_principal_id AS CHAR), ''), LEFT(COALESCE(tipo, ''), 100)
+        """, (dia, dia))
+    return len(dias)
+
+def _reconstruir_dia(conn, dia: date, versao_pendente: Optional[int] = None) -> None:
+    # um dia por transação, repetindo em deadlock/lock wait
+    for tentativa in range(1, ROLLUP_TENTATIVAS + 1):
+        try:
+            cur = conn.cursor()
+            reconstruir_dias(cur, [dia])
+            if versao_pendente is not None:
+                # só sai da fila se ninguém marcou o dia de novo enquanto reconstruíamos
+                cur.execute("DELETE FROM ordens_rollup_pendentes WHERE dia = %s AND versao = %s",
+                            (dia, versao_pendente))
+            conn.commit()
+            return
+        except MySQLError as e:
+            conn.rollback()
+            if e.errno not in _ERROS_TRANSITORIOS or tentativa == ROLLUP_TENTATIVAS:
+                raise
+            time.sleep(0.05 * tentativa * (1 + random.random()))
+
+def marcar_pendentes(conn, dias: Sequence[date], erro: str) -> None:
+    try:
+        cur = conn.cursor()
+        for dia in dias:
+            cur.execute("""
+              INSERT INTO ordens_rollup_pendentes (dia, versao, marcado_em, erro) VALUES (%s, 1, NOW(), %s)
+              ON DUPLICATE KEY UPDATE versao = versao + 1, marcado_em = NOW(), erro = VALUES(erro)
+            """, (dia, erro[:1000]))
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        print(f"[ROLLUP] não consegui marcar {len(dias)} dia(s) como pendentes: {e}")
+
+def atualizar_dias(conn, dias: Sequence[date]) -> List[date]:
+    # usado pelo upsert depois do commit das O.S.; devolve os dias que ficaram pendentes
+    falhos: List[date] = []
+    ultimo_erro = ""
+    for dia in dias:
+        try:
+            _reconstruir_dia(conn, dia)
+        except Exception as e:
+            falhos.append(dia)
+            ultimo_erro = f"{type(e).__name__}: {e}"
+    if falhos:
+        print(f"[ROLLUP] {len(falhos)} dia(s) pendentes para o scheduler: {ultimo_erro}")
+        marcar_pendentes(conn, falhos, ultimo_erro)
+    return falhos
+
+def reconstruir_pendentes(limite: int = 100) -> Dict[str, int]:
+    conn = get_conn()
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT dia, versao FROM ordens_rollup_pendentes ORDER BY dia LIMIT %s", (limite,))
+        pendentes = cur.fetchall()
+        feitos = 0
+        for dia, versao in pendentes:
+            try:
+                _reconstruir_dia(conn, dia, versao)
+                feitos += 1
+            except Exception as e:
+                print(f"[ROLLUP] dia {dia} continua pendente: {e}")
+        return {"reconstruidos": feitos, "pendentes": len(pendentes) - feitos}
+    finally:
+        conn.close()
+
+def reconstruir_intervalo(data_inicio: date, data_fim: date) -> int:
+    # reconstrução completa (ex.: depois de carga manual no banco), um commit por dia
+    conn = get_conn()
+    try:
+        dia, total = data_inicio, 0
+        while dia <= data_fim:
+            _reconstruir_dia(conn, dia)
+            total += 1
+            dia += timedelta(days=1)
+        return total
+    finally:
+        conn.close()
+
+def relatorio_diario(data_inicio: date, data_fim: date, dimensoes: List[str],
+                     status: Optional[str] = None) -> List[Dict[str, Any]]:
+    cols = [DIMENSOES[d] for d in dimensoes]
+    select_dims = "".join(f", {c}" for c in cols)
+    if "tecnico_principal_id" in cols:
+        select_dims += ", MAX(tecnico_nome) AS tecnico_nome"
+    where = ["dia >= %s", "dia <= %s"]
+    params: List[Any] = [data_inicio, data_fim]
+    if status:
+        where.append("status LIKE %s")
+        params.append(status.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%")
+    conn = get_conn()
+    try:
+        cur = conn.cursor(dictionary=True)
+        cur.execute(f"""
+          SELECT dia{select_dims}, SUM(total) AS total
+          FROM ordens_rollup_diario
+          WHERE {" AND ".join(where)}
+          GROUP BY dia{"".join(f", {c}" for c in cols)}
+          ORDER BY dia, total DESC
+        """, params)
+        rows = cur.fetchall()
+        for r in rows:
+            r["total"] = int(r["total"] or 0)
+        return rows
+    finally:
+        conn.close()
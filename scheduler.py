@@ -1,46 +1,104 @@
 import os, asyncio, logging
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Optional, Tuple
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
 import pytz
-import httpx
-from hubsoft_auth import get_hubsoft_token, HUBSOFT_BASE_URL
-from os_repository import upsert_ordens
+from os_repository import upsert_ordens_async, contagem_vazia, somar_contagem, _parse_dt
+from hubsoft_paginacao import paginar_todos, extrair_itens
+from sync_repository import get_watermark, registrar_sync_ok, registrar_sync_erro
+from db_mysql import run_db
+from rollup_repository import reconstruir_pendentes
 
 TZ = os.getenv("TIMEZONE", "America/Sao_Paulo")
 tz = pytz.timezone(TZ)
 log = logging.getLogger("scheduler")
 
-async def importar_intervalo(data_inicio: str, data_fim: str, itens_por_pagina: int = 100):
-    token = await get_hubsoft_token()
-    headers = {"Authorization": f"Bearer {token}"}
-    pagina = 0
+# Sync incremental: reimporta só desde a última janela com sucesso, voltando
+# SYNC_SOBREPOSICAO_DIAS para pegar O.S. que mudaram de status depois.
+SYNC_FONTE = "hubsoft_todos"
+SYNC_INTERVALO_MINUTOS = int(os.getenv("SYNC_INTERVALO_MINUTOS", "30"))  # 0 desliga o job
+SYNC_SOBREPOSICAO_DIAS = int(os.getenv("SYNC_SOBREPOSICAO_DIAS", "3"))
+SYNC_JANELA_INICIAL_DIAS = int(os.getenv("SYNC_JANELA_INICIAL_DIAS", "7"))
+SYNC_JANELA_MAX_DIAS = int(os.getenv("SYNC_JANELA_MAX_DIAS", "31"))
+# campos de data que indicam a última movimentação da O.S.
+CAMPOS_MARCADOR = ("data_termino_executado", "data_inicio_executado", "data_cadastro")
+_sync_locks: Dict[str, asyncio.Lock] = {}
+# dias de ordens_rollup_diario que o upsert não conseguiu atualizar
+ROLLUP_PENDENTES_MINUTOS = int(os.getenv("ROLLUP_PENDENTES_MINUTOS", "10"))
+
+def _marcador(item: dict) -> Optional[datetime]:
+    datas = [d for d in (_parse_dt(item.get(c)) for c in CAMPOS_MARCADOR) if d]
+    return max(datas) if datas else None
+
+async def importar_intervalo(data_inicio: str, data_fim: str, itens_por_pagina: int = 100) -> Dict[str, Any]:
     total_baixadas = 0
-    total_salvas = 0
-    async with httpx.AsyncClient(timeout=60) as c:
-        while True:
-            params = {
-                "pagina": pagina,
-                "itens_por_pagina": itens_por_pagina,
-                "data_inicio": data_inicio,
-                "data_fim": data_fim
-            }
-            r = await c.get(f"{HUBSOFT_BASE_URL}/api/v1/integracao/ordem_servico/todos",
-                            headers=headers, params=params)
-            r.raise_for_status()
-            data = r.json()
-            lista = data.get("ordens_servico") or []
+    contagem = contagem_vazia()
+    marcador: Optional[datetime] = None
+    # a gravação da página anterior roda no executor do banco enquanto a próxima é baixada
+    gravacao: Optional[asyncio.Task] = None
+    try:
+        async for _, data in paginar_todos(data_inicio, data_fim, itens_por_pagina):
+            lista = extrair_itens(data)
             if not lista:
                 break
             total_baixadas += len(lista)
-            total_salvas += upsert_ordens(lista)
-            pag = data.get("paginacao") or {}
-            if pag and (pag.get("pagina_atual") >= pag.get("ultima_pagina", 0)):
-                break
-            if len(lista) < params["itens_por_pagina"]:
-                break
-            pagina += 1
-    log.info(f"[IMPORTADOR] {data_inicio}..{data_fim} -> baixadas={total_baixadas} salvas={total_salvas}")
+            for item in lista:
+                m = _marcador(item)
+                if m and (marcador is None or m > marcador):
+                    marcador = m
+            if gravacao is not None:
+                somar_contagem(contagem, await gravacao)
+            gravacao = asyncio.create_task(upsert_ordens_async(lista))
+    finally:
+        if gravacao is not None:
+            somar_contagem(contagem, await gravacao)
+    total_salvas = contagem["inseridas"] + contagem["atualizadas"]
+    log.info(f"[IMPORTADOR] {data_inicio}..{data_fim} -> baixadas={total_baixadas} salvas={total_salvas} "
+             f"(inseridas={contagem['inseridas']} atualizadas={contagem['atualizadas']} "
+             f"inalteradas={contagem['inalteradas']})")
+    return {"baixadas": total_baixadas, "salvas": total_salvas, **contagem, "marcador": marcador}
+
+def _janela_incremental(wm: Optional[Dict[str, Any]], hoje: date) -> Tuple[date, date]:
+    if not wm or not wm.get("janela_fim"):
+        return hoje - timedelta(days=SYNC_JANELA_INICIAL_DIAS), hoje
+    # a janela parte do fim da última com sucesso, voltando só a sobreposição;
+    # ultimo_marcador fica em sync_watermarks apenas para acompanhamento (uma fonte
+    # quieta, com o último item antigo, não pode puxar a janela para trás a cada execução)
+    inicio = wm["janela_fim"] - timedelta(days=SYNC_SOBREPOSICAO_DIAS)
+    # fonte parada há muito tempo não transforma o incremental num import completo
+    inicio = max(inicio, hoje - timedelta(days=SYNC_JANELA_MAX_DIAS))
+    return min(inicio, hoje), hoje
+
+async def sincronizar_incremental(fonte: str = SYNC_FONTE, itens_por_pagina: int = 200) -> Dict[str, Any]:
+    lock = _sync_locks.setdefault(fonte, asyncio.Lock())
+    if lock.locked():
+        return {"status": "em_andamento", "fonte": fonte}
+    async with lock:
+        wm = await run_db(get_watermark, fonte)
+        inicio, fim = _janela_incremental(wm, datetime.now(tz).date())
+        di, df = inicio.strftime("%Y-%m-%d"), fim.strftime("%Y-%m-%d")
+        log.info(f"[SYNC] {fonte}: janela {di}..{df} (marca anterior={wm and wm.get('janela_fim')})")
+        try:
+            res = await importar_intervalo(di, df, itens_por_pagina=itens_por_pagina)
+        except Exception as e:
+            log.error(f"[SYNC] {fonte}: falhou na janela {di}..{df}: {e}")
+            await run_db(registrar_sync_erro, fonte, f"{type(e).__name__}: {e}")
+            raise
+        await run_db(registrar_sync_ok, fonte, inicio, fim, res["marcador"], res["baixadas"])
+        return {"status": "success", "fonte": fonte, "janela": [di, df], **res}
+
+async def job_sync_incremental():
+    try:
+        await sincronizar_incremental()
+    except Exception:
+        pass  # já registrado em sync_watermarks; a próxima execução repete a janela
+
+async def job_rollups_pendentes():
+    res = await run_db(reconstruir_pendentes)
+    if res["reconstruidos"] or res["pendentes"]:
+        log.info(f"[ROLLUP] pendentes: {res['reconstruidos']} reconstruído(s), {res['pendentes']} ainda com erro")
 
 async def job_diario_ontem():
     agora = datetime.now(tz)
@@ -52,5 +110,10 @@ async def job_diario_ontem():
 def start_scheduler():
     scheduler = AsyncIOScheduler(timezone=tz)
     scheduler.add_job(job_diario_ontem, CronTrigger(hour=0, minute=5))
+    if SYNC_INTERVALO_MINUTOS > 0:
+        scheduler.add_job(job_sync_incremental, IntervalTrigger(minutes=SYNC_INTERVALO_MINUTOS),
+                          max_instances=1, coalesce=True)
+    scheduler.add_job(job_rollups_pendentes, IntervalTrigger(minutes=max(1, ROLLUP_PENDENTES_MINUTOS)),
+                      max_instances=1, coalesce=True)
     scheduler.start()
-    log.info("⏰ Scheduler iniciado (job diário às 00:05).")
+    log.info(f"⏰ Scheduler iniciado (job diário às 00:05; sync incremental a cada {SYNC_INTERVALO_MINUTOS} min).")
@@ -0,0 +1,125 @@
+import os
+import time
+import asyncio
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, Optional, Tuple
+from fastapi import HTTPException
+from passlib.context import CryptContext
+
+# bcrypt em processos dedicados: rajadas de login não ocupam o threadpool do FastAPI
+# (que atende os endpoints síncronos) nem disputam o GIL com o event loop.
+BCRYPT_WORKERS = int(os.getenv("BCRYPT_WORKERS", "2"))
+# hashes em execução + na fila; acima disso a requisição é recusada na hora com 503
+BCRYPT_FILA_MAX = int(os.getenv("BCRYPT_FILA_MAX", "16"))
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+def _hash(password: str) -> Tuple[str, float]:
+    t0 = time.perf_counter()
+    return pwd_context.hash(password), time.perf_counter() - t0
+
+def _verify(password: str, password_hash: str) -> Tuple[bool, float]:
+    t0 = time.perf_counter()
+    try:
+        ok = pwd_context.verify(password, password_hash)
+    except (ValueError, TypeError):
+        ok = False  # hash em formato desconhecido
+    return ok, time.perf_counter() - t0
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+_em_voo = 0
+_stats: Dict[str, Any] = {
+    "rejeitadas": 0,
+    "pool_recriado": 0,
+    "hash": {"total": 0, "cpu_segundos": 0.0, "espera_segundos": 0.0, "max_segundos": 0.0},
+    "verify": {"total": 0, "cpu_segundos": 0.0, "espera_segundos": 0.0, "max_segundos": 0.0},
+}
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn: o filho não herda threads/conexões do servidor, só importa este módulo
+            _pool = ProcessPoolExecutor(max_workers=max(1, BCRYPT_WORKERS),
+                                        mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+def _recriar_pool(quebrado: ProcessPoolExecutor) -> None:
+    # worker morto (ex.: OOM killer) quebra o executor inteiro; só o primeiro a notar recria
+    global _pool
+    with _pool_lock:
+        if _pool is not quebrado:
+            return
+        _pool = None
+        _stats["pool_recriado"] += 1
+    print("[SENHA_POOL] pool de processos quebrado; recriando")
+    quebrado.shutdown(wait=False, cancel_futures=True)
+
+async def _rodar(fn, *args) -> Tuple[Any, float]:
+    loop = asyncio.get_running_loop()
+    pool = _get_pool()
+    try:
+        return await loop.run_in_executor(pool, fn, *args)
+    except BrokenProcessPool:
+        _recriar_pool(pool)
+    # uma nova tentativa, no pool novo
+    pool = _get_pool()
+    try:
+        return await loop.run_in_executor(pool, fn, *args)
+    except BrokenProcessPool:
+        _recriar_pool(pool)
+        raise HTTPException(status_code=503, detail="Serviço de senhas indisponível; tente de novo em instantes.",
+                            headers={"Retry-After": "1"})
+
+async def _executar(tipo: str, fn, *args) -> Any:
+    global _em_voo
+    if _em_voo >= BCRYPT_FILA_MAX:
+        _stats["rejeitadas"] += 1
+        raise HTTPException(status_code=503, detail="Muitas autenticações simultâneas; tente de novo em instantes.",
+                            headers={"Retry-After": "1"})
+    _em_voo += 1
+    t0 = time.perf_counter()
+    try:
+        resultado, cpu = await _rodar(fn, *args)
+    finally:
+        _em_voo -= 1
+    total = time.perf_counter() - t0
+    st = _stats[tipo]
+    st["total"] += 1
+    st["cpu_segundos"] += cpu
+    st["espera_segundos"] += max(0.0, total - cpu)
+    st["max_segundos"] = max(st["max_segundos"], total)
+    return resultado
+
+async def hash_password_async(password: str) -> str:
+    return await _executar("hash", _hash, password)
+
+async def verify_password_async(password: str, password_hash: str) -> bool:
+    return await _executar("verify", _verify, password, password_hash)
+
+def senha_pool_stats() -> Dict[str, Any]:
+    out: Dict[str, Any] = {"workers": BCRYPT_WORKERS, "fila_max": BCRYPT_FILA_MAX,
+                           "em_voo": _em_voo, "rejeitadas": _stats["rejeitadas"],
+                           "pool_recriado": _stats["pool_recriado"]}
+    for tipo in ("hash", "verify"):
+        st = _stats[tipo]
+        n = st["total"]
+        out[tipo] = {
+            "total": n,
+            "media_ms": round((st["cpu_segundos"] + st["espera_segundos"]) / n * 1000, 1) if n else None,
+            "cpu_media_ms": round(st["cpu_segundos"] / n * 1000, 1) if n else None,
+            "espera_media_ms": round(st["espera_segundos"] / n * 1000, 1) if n else None,
+            "max_ms": round(st["max_segundos"] * 1000, 1),
+        }
+    return out
+
+def close_senha_pool() -> None:
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,57 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, TypeVar
+
+T = TypeVar("T")
+
+class SingleFlight:
+    # Coalescência de requisições: chamadas concorrentes com a mesma chave
+    # compartilham uma única execução em voo (e o mesmo resultado ou exceção).
+    def __init__(self, nome: str):
+        self.nome = nome
+        self._voando: Dict[Hashable, asyncio.Future] = {}
+        self.chamadas = 0
+        self.execucoes = 0
+        self.compartilhadas = 0
+
+    async def do(self, chave: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        self.chamadas += 1
+        fut = self._voando.get(chave)
+        if fut is None:
+            self.execucoes += 1
+            fut = asyncio.ensure_future(fn())
+            self._voando[chave] = fut
+
+            def _fim(f: asyncio.Future, chave=chave) -> None:
+                if self._voando.get(chave) is f:
+                    del self._voando[chave]
+                # marca a exceção como lida mesmo que todos os chamadores tenham desistido
+                if not f.cancelled():
+                    f.exception()
+
+            fut.add_done_callback(_fim)
+        else:
+            self.compartilhadas += 1
+        # shield: o cancelamento de um chamador não derruba a execução dos demais
+        return await asyncio.shield(fut)
+
+    def em_voo(self) -> int:
+        return len(self._voando)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "chamadas": self.chamadas,
+            "execucoes": self.execucoes,
+            "compartilhadas": self.compartilhadas,
+            "em_voo": len(self._voando),
+        }
+
+_grupos: Dict[str, SingleFlight] = {}
+
+def grupo(nome: str) -> SingleFlight:
+    sf = _grupos.get(nome)
+    if sf is None:
+        sf = _grupos[nome] = SingleFlight(nome)
+    return sf
+
+def singleflight_stats() -> Dict[str, Any]:
+    return {k: v.stats() for k, v in _grupos.items()}
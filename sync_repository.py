@@ -0,0 +1,74 @@
+from datetime import date, datetime
+from typing import Any, Dict, List, Optional
+from db_mysql import get_conn
+
+# Marca d'água do sync incremental: até onde cada fonte já foi importada com sucesso.
+
+def get_watermark(fonte: str) -> Optional[Dict[str, Any]]:
+    conn = get_conn()
+    try:
+        cur = conn.cursor(dictionary=True)
+        cur.execute("""
+          SELECT fonte, janela_inicio, janela_fim, ultimo_marcador, ultima_execucao,
+                 ultimo_sucesso, itens_ultima, execucoes, erro
+          FROM sync_watermarks WHERE fonte = %s
+        """, (fonte,))
+        return cur.fetchone()
+    finally:
+        conn.close()
+
+def registrar_sync_ok(fonte: str, janela_inicio: date, janela_fim: date,
+                      marcador: Optional[datetime], itens: int) -> None:
+    conn = get_conn()
+    try:
+        cur = conn.cursor()
+        # o marcador nunca anda para trás: uma janela sem itens novos não apaga o último visto
+        cur.execute("""
+          INSERT INTO sync_watermarks
+            (fonte, janela_inicio, janela_fim, ultimo_marcador, ultima_execucao, ultimo_sucesso,
+             itens_ultima, execucoes, erro)
+          VALUES (%s, %s, %s, %s, NOW(), NOW(), %s, 1, NULL)
+          ON DUPLICATE KEY UPDATE
+            janela_inicio = VALUES(janela_inicio),
+            janela_fim = VALUES(janela_fim),
+            ultimo_marcador = GREATEST(COALESCE(ultimo_marcador, VALUES(ultimo_marcador)),
+                                       COALESCE(VALUES(ultimo_marcador), ultimo_marcador)),
+            ultima_execucao = NOW(),
+            ultimo_sucesso = NOW(),
+            itens_ultima = VALUES(itens_ultima),
+            execucoes = execucoes + 1,
+            erro = NULL
+        """, (fonte, janela_inicio, janela_fim, marcador, int(itens)))
+        conn.commit()
+    finally:
+        conn.close()
+
+def registrar_sync_erro(fonte: str, erro: str) -> None:
+    conn = get_conn()
+    try:
+        cur = conn.cursor()
+        # falha não move a janela: a próxima execução recomeça do último sucesso
+        cur.execute("""
+          INSERT INTO sync_watermarks (fonte, ultima_execucao, execucoes, erro)
+          VALUES (%s, NOW(), 1, %s)
+          ON DUPLICATE KEY UPDATE
+            ultima_execucao = NOW(),
+            execucoes = execucoes + 1,
+            erro = VALUES(erro)
+        """, (fonte, erro[:2000]))
+        conn.commit()
+    finally:
+        conn.close()
+
+def list_watermarks() -> List[Dict[str, Any]]:
+    conn = get_conn()
+    try:
+        cur = conn.cursor(dictionary=True)
+        cur.execute("""
+          SELECT fonte, janela_inicio, janela_fim, ultimo_marcador, ultima_execucao,
+                 ultimo_sucesso, itens_ultima, execucoes, erro
+          FROM sync_watermarks ORDER BY fonte
+        """)
+        return cur.fetchall()
+    finally:
+        conn.close()